@@ -12,26 +12,58 @@ Usage:
     python evaluation_test.py --run-all
     python evaluation_test.py --prompt "Write a function to reverse a string"
     python evaluation_test.py --category simple
+    python evaluation_test.py --run-all --concurrency 8
+    python evaluation_test.py --category simple --stream
+    python evaluation_test.py --run-all --replay --refresh local
+    python evaluation_test.py --load-test --users 1,4,16 --duration 120
+    python evaluation_test.py --run-all --resume evaluation_journal_20260110_143000.jsonl
+    python evaluation_test.py --run-all --score
+    python evaluation_test.py --category simple --benchmark --repeat 20 --baseline benchmark_baseline.json
+    python evaluation_test.py --category simple --systems local,claude
+    python evaluation_test.py --mock-server --mock-latency lognormal:0.3,0.5 --mock-429-rate 0.05
+    python evaluation_test.py --harness-benchmark --harness-concurrency 1,8,32
+    python evaluation_test.py --run-all --metrics-port 9464
+    python evaluation_test.py --corpus nhs_prompts.jsonl.gz --category "Code Generation" --shard 0/4
+    python evaluation_test.py --merge shard0.jsonl shard1.jsonl shard2.jsonl shard3.jsonl
+    python evaluation_test.py --merge shard0.jsonl shard1.jsonl --similarity
+    python evaluation_test.py --summary evaluation_journal_20260110_143000.jsonl merged_journal_20260111_090000.jsonl
+    python evaluation_test.py --corpus nhs_prompts.jsonl.gz --batch --batch-size 5000 --systems local,claude
+    python evaluation_test.py --session-replay --sessions 32 --turns 5 --session-concurrency 16
+    python evaluation_test.py --context-sweep --stream --systems local --context-sizes 1000,4000,16000
 """
 
+import array
+import ast
+import atexit
+import codecs
+import csv
+import fnmatch
+import gzip
+import hashlib
 import json
+import mmap
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
 import time
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import List, Dict, Any
 import argparse
 import os
+import random
+import threading
 
-# API clients (install: pip install openai anthropic requests)
-try:
-    import anthropic
-    from openai import OpenAI
-    import requests
-except ImportError:
-    print("Installing required packages...")
-    os.system("pip install anthropic openai requests")
-    import anthropic
-    from openai import OpenAI
-    import requests
+
+# API clients (install: pip install openai anthropic requests) are imported
+# lazily by the interfaces that need them; see SYSTEM_REGISTRY.
 
 
 # ============================================================================
@@ -177,354 +209,5343 @@ TEST_PROMPTS = {
 
 
 # ============================================================================
-# AI SYSTEM INTERFACES
+# PROMPT CORPUS
 # ============================================================================
 
-class AISystemInterface:
-    """Base class for AI system interfaces"""
+def iter_builtin_tests(categories: List[str] = None):
+    """Yield the built-in TEST_PROMPTS, optionally limited to some categories"""
+    for category in categories or TEST_PROMPTS.keys():
+        if category not in TEST_PROMPTS:
+            raise ValueError(f"unknown category: {category} (available: {', '.join(TEST_PROMPTS)})")
+        yield from TEST_PROMPTS[category]
 
-    def __init__(self, name: str):
-        self.name = name
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        """Send prompt and return response with metadata"""
-        raise NotImplementedError
+class PromptCorpus:
+    """Test cases streamed from a JSONL file, one object per line
 
+    Each line needs a "prompt"; "id", "category" and "expected_features"
+    are optional. Files ending in .gz are decompressed on the fly, and with
+    use_mmap an uncompressed file is memory-mapped rather than read through
+    a buffered file. Nothing is held in memory beyond the current line.
+    """
 
-class ClaudeCodeInterface(AISystemInterface):
-    """Interface for Claude Code (Anthropic API)"""
+    def __init__(self, path: str, use_mmap: bool = False):
+        self.path = path
+        self.use_mmap = use_mmap and not path.endswith(".gz")
 
-    def __init__(self):
-        super().__init__("Claude Code")
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            print("⚠️  ANTHROPIC_API_KEY not set. Skipping Claude Code.")
-            self.client = None
+    def _iter_lines(self):
+        if self.path.endswith(".gz"):
+            with gzip.open(self.path, "rb") as f:
+                yield from f
+        elif self.use_mmap:
+            if not os.path.getsize(self.path):
+                return
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                yield from iter(m.readline, b"")
         else:
-            self.client = anthropic.Anthropic(api_key=api_key)
+            with open(self.path, "rb") as f:
+                yield from f
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        if not self.client:
-            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
+    def iter_tests(self, categories: List[str] = None):
+        """Yield test cases in file order, optionally limited to some categories (case-insensitive)"""
+        wanted = {c.lower() for c in categories} if categories else None
+        for line_number, line in enumerate(self._iter_lines(), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{self.path}:{line_number}: invalid JSON ({e})") from e
+            if not isinstance(record, dict) or not record.get("prompt"):
+                raise ValueError(f"{self.path}:{line_number}: missing \"prompt\"")
 
-        start_time = time.time()
-        try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4000,
-                messages=[{"role": "user", "content": prompt}]
-            )
+            test_case = {
+                "id": str(record.get("id") or f"L{line_number}"),
+                "prompt": record["prompt"],
+                "category": record.get("category") or "Uncategorized",
+                "expected_features": record.get("expected_features") or []
+            }
+            if wanted is None or test_case["category"].lower() in wanted:
+                yield test_case
 
-            response_time = time.time() - start_time
 
-            return {
-                "response": message.content[0].text,
-                "tokens": message.usage.input_tokens + message.usage.output_tokens,
-                "time": response_time,
-                "model": "claude-sonnet-4"
-            }
-        except Exception as e:
-            return {"response": f"ERROR: {str(e)}", "tokens": 0, "time": 0}
+def parse_shard(spec: str):
+    """Parse "i/n" into (i, n), with shards numbered from 0"""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"--shard must look like i/n, got {spec!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"--shard {spec}: need 0 <= i < n")
+    return index, count
 
 
-class ChatGPTInterface(AISystemInterface):
-    """Interface for ChatGPT (OpenAI API)"""
+def shard_of(test_id: str, count: int) -> int:
+    """Stable shard for a test ID, independent of file order and machine"""
+    digest = hashlib.sha256(test_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
 
-    def __init__(self):
-        super().__init__("ChatGPT")
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            print("⚠️  OPENAI_API_KEY not set. Skipping ChatGPT.")
-            self.client = None
-        else:
-            self.client = OpenAI(api_key=api_key)
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        if not self.client:
-            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
+def select_tests(test_cases, id_patterns: List[str] = None, shard=None):
+    """Lazily filter test cases by ID glob patterns and (index, count) shard"""
+    for test_case in test_cases:
+        if id_patterns and not any(fnmatch.fnmatchcase(test_case["id"], p) for p in id_patterns):
+            continue
+        if shard and shard_of(test_case["id"], shard[1]) != shard[0]:
+            continue
+        yield test_case
 
-        start_time = time.time()
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=4000
-            )
 
-            response_time = time.time() - start_time
+# ============================================================================
+# RATE LIMITS
+# ============================================================================
 
-            return {
-                "response": response.choices[0].message.content,
-                "tokens": response.usage.total_tokens,
-                "time": response_time,
-                "model": "gpt-4-turbo"
-            }
-        except Exception as e:
-            return {"response": f"ERROR: {str(e)}", "tokens": 0, "time": 0}
+# Requests and tokens per minute for each provider; None means unlimited.
+# Override per provider with <PROVIDER>_RPM / <PROVIDER>_TPM, e.g.
+# ANTHROPIC_RPM=1000 or LOCAL_AI_RPM=60.
+RATE_LIMITS = {
+    "anthropic": {"rpm": 50, "tpm": 40000},
+    "openai": {"rpm": 500, "tpm": 30000},
+    "perplexity": {"rpm": 50, "tpm": None},
+    "local_ai": {"rpm": None, "tpm": None},
+}
 
+# Backoff used for a 429 without a usable Retry-After header
+RATE_LIMIT_BACKOFF_BASE = 1.0
+RATE_LIMIT_BACKOFF_MAX = 60.0
 
-class LocalInstanceInterface(AISystemInterface):
-    """Interface for your local AI instance"""
 
-    def __init__(self):
-        super().__init__("Local Instance")
-        self.base_url = os.getenv("LOCAL_AI_URL", "http://localhost:8000")
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return max(1, len(text) // 4)
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        start_time = time.time()
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/chat",
-                json={"message": prompt},
-                timeout=120
-            )
 
-            response_time = time.time() - start_time
+def parse_retry_after(headers) -> float:
+    """Read a Retry-After header in seconds, or None if absent/unparseable"""
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
 
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "response": data.get("response", ""),
-                    "tokens": 0,  # Add if your API returns token count
-                    "time": response_time,
-                    "model": "local-mistral"
-                }
-            else:
-                return {"response": f"ERROR: HTTP {response.status_code}", "tokens": 0, "time": 0}
 
-        except Exception as e:
-            return {"response": f"ERROR: {str(e)}", "tokens": 0, "time": 0}
+class TokenBucket:
+    """Continuously refilling bucket holding up to `per_minute` units"""
 
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
 
-class GrokInterface(AISystemInterface):
-    """Interface for Grok (X.AI API)"""
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
 
-    def __init__(self):
-        super().__init__("Grok")
-        # Grok API - update when available
-        print("⚠️  Grok API interface not implemented yet")
-        self.client = None
+    def delay_for(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available"""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        return {"response": "SKIPPED - API not available", "tokens": 0, "time": 0}
+    def consume(self, amount: float):
+        # The level may go negative; later callers then wait off the debt
+        self.level -= amount
 
 
-class PerplexityInterface(AISystemInterface):
-    """Interface for Perplexity"""
+class RateLimiter:
+    """Per-provider request and token budget with 429 backoff
+
+    Thread-safe, so one limiter is shared by serial and concurrent runs.
+    """
+
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        self.consecutive_429s = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_provider(cls, provider: str) -> "RateLimiter":
+        """Build a limiter from RATE_LIMITS and environment overrides"""
+        limits = dict(RATE_LIMITS.get(provider) or {})
+        for key in ("rpm", "tpm"):
+            value = os.getenv(f"{provider.upper()}_{key.upper()}")
+            if value is not None:
+                limits[key] = float(value) if value.strip() else None
+        return cls(rpm=limits.get("rpm"), tpm=limits.get("tpm"))
+
+    def acquire(self, estimated_tokens: int = 0) -> float:
+        """Block until a request fits the budget; returns seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self.blocked_until - now
+                if self.requests:
+                    delay = max(delay, self.requests.delay_for(1, now))
+                if self.tokens:
+                    delay = max(delay, self.tokens.delay_for(estimated_tokens, now))
+                if delay <= 0:
+                    if self.requests:
+                        self.requests.consume(1)
+                    if self.tokens:
+                        self.tokens.consume(estimated_tokens)
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def record(self, actual_tokens: int, estimated_tokens: int = 0):
+        """Settle the token budget once real usage is known"""
+        with self._lock:
+            self.consecutive_429s = 0
+            if self.tokens and actual_tokens:
+                self.tokens.consume(actual_tokens - estimated_tokens)
+
+    def backoff(self, retry_after: float = None) -> float:
+        """Pause all callers after a 429; returns the delay applied"""
+        with self._lock:
+            self.consecutive_429s += 1
+            if retry_after is None:
+                retry_after = min(
+                    RATE_LIMIT_BACKOFF_MAX,
+                    RATE_LIMIT_BACKOFF_BASE * 2 ** (self.consecutive_429s - 1)
+                )
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            return retry_after
+
+
+# ============================================================================
+# STREAMING METRICS
+# ============================================================================
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile (0-100) of a list, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class StreamRecorder:
+    """Collects streamed text chunks and their arrival times
+
+    Inter-token latency is measured between streamed chunks, which for the
+    SSE backends is usually one token per chunk.
+    """
 
     def __init__(self):
-        super().__init__("Perplexity")
-        api_key = os.getenv("PERPLEXITY_API_KEY")
-        if not api_key:
-            print("⚠️  PERPLEXITY_API_KEY not set. Skipping Perplexity.")
-            self.api_key = None
+        self.start = time.perf_counter()
+        self.end = None
+        self.chunk_times = []
+        self.parts = []
+
+    def add(self, text: str):
+        if text:
+            self.chunk_times.append(time.perf_counter())
+            self.parts.append(text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def finish(self) -> float:
+        """Stop the clock and return total elapsed seconds"""
+        if self.end is None:
+            self.end = time.perf_counter()
+        return self.end - self.start
+
+    def metrics(self, output_tokens: int = None) -> Dict[str, Any]:
+        """TTFT, inter-token latency percentiles and decode throughput"""
+        total = self.finish()
+        if output_tokens is None:
+            output_tokens = estimate_tokens(self.text) if self.parts else 0
+
+        ttft = self.chunk_times[0] - self.start if self.chunk_times else None
+        gaps = [b - a for a, b in zip(self.chunk_times, self.chunk_times[1:])]
+        decode_time = total - ttft if ttft is not None else 0
+
+        return {
+            "ttft": ttft,
+            "itl_p50": percentile(gaps, 50),
+            "itl_p95": percentile(gaps, 95),
+            "itl_p99": percentile(gaps, 99),
+            "chunks": len(self.chunk_times),
+            "output_tokens": output_tokens,
+            "tokens_per_sec": output_tokens / decode_time if decode_time > 0 else None
+        }
+
+
+SSE_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def iter_sse_events(chunks) -> Any:
+    """Yield the data of each server-sent event from raw body chunks
+
+    Lines are split on CR, LF or CRLF, with an incomplete last line carried
+    over to the next chunk, so an event split across network reads comes
+    out whole. An event's `data:` lines are joined with newlines, as in the
+    SSE spec, and only the one space after the colon is stripped, so
+    whitespace and line breaks in the content survive. Nothing is yielded
+    after [DONE], but the chunks are consumed to the end: abandoning
+    urllib3's reader mid-body closes the connection instead of returning it
+    to the pool.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    buffer, data, done = "", [], False
+
+    def events(lines: List[str]):
+        for line in lines:
+            if line:
+                field, _, value = line.partition(":")
+                if field == "data":
+                    data.append(value[1:] if value.startswith(" ") else value)
+            elif data:
+                yield "\n".join(data)
+                data.clear()
+
+    for chunk in chunks:
+        if done:
+            continue
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        # A trailing CR may be the first half of a CRLF
+        held = "\r" if buffer.endswith("\r") else ""
+        lines = SSE_LINE_BREAK.split(buffer[:len(buffer) - len(held)])
+        buffer = lines.pop() + held
+        for payload in events(lines):
+            if payload.strip() == "[DONE]":
+                done = True
+                break
+            yield payload
+
+    if not done:
+        # Tolerate a stream that ends without the final blank line
+        buffer += decoder.decode(b"", final=True)
+        for payload in events(SSE_LINE_BREAK.split(buffer) + [""]):
+            if payload.strip() == "[DONE]":
+                break
+            yield payload
+
+
+def iter_sse_data(response) -> Any:
+    """Yield the data of each event of a server-sent event stream response"""
+    return iter_sse_events(response.iter_content(chunk_size=None))
+
+
+# ============================================================================
+# TOKEN ACCOUNTING
+# ============================================================================
+
+# Tokenizer files are looked up as <TOKENIZER_DIR>/<family>/tokenizer.json
+# (needs `tokenizers`) or tokenizer.model (needs `sentencepiece`)
+TOKENIZER_DIR = os.getenv("TOKENIZER_DIR", "tokenizers")
+
+# Fallback when no tokenizer is available: rough characters per word token
+APPROX_CHARS_PER_TOKEN = {"mistral": 3.6, "llama": 3.8, "claude": 3.5, "openai": 4.0, "default": 4.0}
+
+# New memoized counts are committed to SQLite this many at a time (and on close/exit)
+TOKEN_DB_COMMIT_EVERY = 500
+
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|\n+|[ \t]{2,}|[^\w\s]+")
+
+
+def tokenizer_family(model: str) -> str:
+    """Map a model name to the tokenizer family used to count its tokens"""
+    model = (model or "").lower()
+    for marker, family in (("mistral", "mistral"), ("claude", "claude"), ("gpt", "openai"),
+                           ("sonar", "llama"), ("llama", "llama")):
+        if marker in model:
+            return family
+    return "default"
+
+
+def approximate_tokens(text: str, chars_per_token: float) -> int:
+    """BPE-like estimate: words split by length, punctuation runs and whitespace runs"""
+    count = 0
+    for piece in TOKEN_PIECE_PATTERN.findall(text):
+        if piece[0] == "\n":
+            count += 1
+        elif piece[0] in " \t":
+            count += -(-len(piece) // 4)
+        elif piece[0].isalnum() or piece[0] == "_":
+            count += max(1, round(len(piece) / chars_per_token))
         else:
-            self.api_key = api_key
+            count += -(-len(piece) // 2)
+    return count
 
-    def query(self, prompt: str) -> Dict[str, Any]:
-        if not self.api_key:
-            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
 
-        start_time = time.time()
-        try:
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "llama-3.1-sonar-large-128k-online",
-                    "messages": [{"role": "user", "content": prompt}]
-                },
-                timeout=120
-            )
+class TokenCounter:
+    """Offline input/output token counts for responses without provider usage
 
-            response_time = time.time() - start_time
+    Real tokenizers are used when their files and libraries are present,
+    otherwise a per-family approximation. Counts are memoized by a hash of
+    the tokenizer and text, in memory and optionally in SQLite, so
+    recounting a large journal only tokenizes text it hasn't seen. SQLite
+    writes are committed every TOKEN_DB_COMMIT_EVERY inserts, on close()
+    and at interpreter exit.
+    """
 
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "response": data["choices"][0]["message"]["content"],
-                    "tokens": data.get("usage", {}).get("total_tokens", 0),
-                    "time": response_time,
-                    "model": "sonar-large"
-                }
+    def __init__(self, tokenizer_dir: str = TOKENIZER_DIR, db_path: str = None):
+        self.tokenizer_dir = tokenizer_dir
+        self._tokenizers = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._uncommitted = 0
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS token_counts (digest TEXT PRIMARY KEY, count INTEGER)")
+            self._db.commit()
+            atexit.register(self.flush)
+
+    def _load_tokenizer(self, family: str):
+        """(source name, encode function) for a family's local tokenizer, or None"""
+        directory = os.path.join(self.tokenizer_dir, family)
+        json_path = os.path.join(directory, "tokenizer.json")
+        model_path = os.path.join(directory, "tokenizer.model")
+        if os.path.exists(json_path):
+            try:
+                from tokenizers import Tokenizer
+            except ImportError:
+                pass
+            else:
+                tokenizer = Tokenizer.from_file(json_path)
+                return f"{family}:tokenizer.json", lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        if os.path.exists(model_path):
+            try:
+                import sentencepiece
+            except ImportError:
+                pass
             else:
-                return {"response": f"ERROR: HTTP {response.status_code}", "tokens": 0, "time": 0}
+                processor = sentencepiece.SentencePieceProcessor(model_file=model_path)
+                return f"{family}:tokenizer.model", lambda text: len(processor.encode(text))
+        return None
 
-        except Exception as e:
-            return {"response": f"ERROR: {str(e)}", "tokens": 0, "time": 0}
+    def _encoder(self, family: str):
+        with self._lock:
+            if family not in self._tokenizers:
+                loaded = self._load_tokenizer(family)
+                if loaded is None:
+                    ratio = APPROX_CHARS_PER_TOKEN.get(family, APPROX_CHARS_PER_TOKEN["default"])
+                    loaded = (f"{family}:approx", lambda text: approximate_tokens(text, ratio))
+                self._tokenizers[family] = loaded
+            return self._tokenizers[family]
+
+    def count(self, text: str, family: str = "default"):
+        """Return (token count, source) for text, e.g. (412, "mistral:tokenizer.json")"""
+        source, encode = self._encoder(family)
+        if not text:
+            return 0, source
+        digest = hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+        with self._lock:
+            cached = self._memo.get(digest)
+            if cached is None and self._db is not None:
+                row = self._db.execute("SELECT count FROM token_counts WHERE digest = ?", (digest,)).fetchone()
+                cached = row[0] if row else None
+            if cached is not None:
+                self.hits += 1
+                self._memo[digest] = cached
+                return cached, source
+            self.misses += 1
+
+        count = encode(text)
+        with self._lock:
+            self._memo[digest] = count
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO token_counts VALUES (?, ?)", (digest, count))
+                self._uncommitted += 1
+                if self._uncommitted >= TOKEN_DB_COMMIT_EVERY:
+                    self._db.commit()
+                    self._uncommitted = 0
+        return count, source
+
+    def fill(self, response: Dict[str, Any], prompt: str, model: str = None) -> Dict[str, Any]:
+        """Fill in token counts and throughput a provider didn't report
+
+        Failed requests still count their input tokens; skipped ones were
+        never sent and are left alone. "token_source" says where the
+        "tokens" total came from: "provider" or the counter that produced it.
+        """
+        status = response_status(response)
+        if status == "skipped":
+            return response
+
+        family = tokenizer_family(model or response.get("model"))
+        provider_total = bool(response.get("tokens"))
+        source = None
+        if response.get("input_tokens") is None:
+            response["input_tokens"], source = self.count(prompt, family)
+        counted_output = response.get("output_tokens") is None and status == "ok"
+        if counted_output:
+            response["output_tokens"], source = self.count(response["response"], family)
+        elif response.get("output_tokens") is None:
+            response["output_tokens"] = 0
+        if not provider_total:
+            response["tokens"] = response["input_tokens"] + response["output_tokens"]
+        response["token_source"] = "provider" if provider_total or source is None else source
+
+        if status == "ok":
+            output_tokens = response["output_tokens"]
+            if response.get("time"):
+                response["tokens_per_sec"] = output_tokens / response["time"]
+            stream = response.get("stream")
+            if stream and counted_output:
+                decode_time = response["time"] - (stream["ttft"] or 0)
+                response["stream"] = dict(stream, output_tokens=output_tokens,
+                                          tokens_per_sec=output_tokens / decode_time if decode_time > 0 else None)
+        return response
+
+    def flush(self):
+        """Commit memoized counts not yet written to SQLite"""
+        with self._lock:
+            if self._db is not None and self._uncommitted:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                atexit.unregister(self.flush)
+                self._db.close()
+                self._db = None
+
+
+def recount_journal_tokens(journal: "ResultJournal", counter: TokenCounter) -> int:
+    """Recount tokens not reported by a provider in a journal; returns records updated"""
+    derived = ("input_tokens", "output_tokens", "tokens", "token_source", "tokens_per_sec")
+    updates = {}
+    for result in journal.iter_test_results():
+        for system_name, response in result["responses"].items():
+            if response.get("token_source") == "provider":
+                continue
+            fresh = {k: v for k, v in response.items() if k not in derived}
+            # Records from before token accounting may still carry a provider total
+            fresh["tokens"] = 0 if "token_source" in response else response.get("tokens", 0)
+            counter.fill(fresh, result["prompt"], response.get("model") or system_name)
+            changed = {k: fresh[k] for k in derived + ("stream",) if k in fresh and fresh[k] != response.get(k)}
+            if changed:
+                updates[(result["test_id"], system_name)] = changed
+    journal.update(updates)
+    return len(updates)
 
 
 # ============================================================================
-# EVALUATION RUNNER
+# REQUEST PHASE TRACING
 # ============================================================================
 
-class EvaluationRunner:
-    """Runs evaluation tests across all AI systems"""
+PHASES = ("dns", "connect", "tls", "send", "wait", "queue", "generation", "transfer", "decode")
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Parse a Server-Timing header ("queue;dur=12, generation;dur=340") into seconds"""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            key, _, value = param.partition("=")
+            if name and key.strip() == "dur":
+                try:
+                    timings[name] = float(value.strip('"')) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+class PhaseTrace:
+    """Per-request phase timings on the monotonic perf_counter clock
+
+    Entering the trace makes it current for this thread; the urllib3
+    connection hooks (PooledHTTPClient) and httpcore trace events (SDK
+    clients) then report into it. Phases:
+
+    - dns, connect, tls: connection setup, absent on a reused connection
+      (the SDK transport folds DNS into connect)
+    - send: writing the request; wait: request sent until response headers
+    - queue, generation: from the server's Server-Timing header, if sent
+    - transfer: response headers until the last body byte
+    - decode: parsing the body into a result
+    """
+
+    _local = threading.local()
 
     def __init__(self):
-        self.systems = [
-            ClaudeCodeInterface(),
-            ChatGPTInterface(),
-            GrokInterface(),
-            PerplexityInterface(),
-            LocalInstanceInterface()
-        ]
+        self.start = time.perf_counter()
+        self.end = None
+        self.phases = {}
+        self.marks = {}
+        self.server = {}
+        self.connection_reused = True
+        self._previous = None
 
-        self.results = []
+    def __enter__(self) -> "PhaseTrace":
+        self._previous = PhaseTrace.current()
+        PhaseTrace._local.trace = self
+        return self
 
-    def run_single_test(self, test_case: Dict[str, Any]):
-        """Run a single test across all systems"""
-        print(f"\n{'='*80}")
-        print(f"Test ID: {test_case['id']}")
-        print(f"Category: {test_case['category']}")
-        print(f"Prompt: {test_case['prompt'][:100]}...")
-        print(f"{'='*80}\n")
+    def __exit__(self, *exc):
+        if self.end is None:
+            self.end = time.perf_counter()
+        PhaseTrace._local.trace = self._previous
+        return False
 
-        test_result = {
-            "test_id": test_case["id"],
-            "prompt": test_case["prompt"],
-            "category": test_case["category"],
-            "timestamp": datetime.now().isoformat(),
-            "responses": {}
-        }
+    @classmethod
+    def current(cls) -> "PhaseTrace":
+        return getattr(cls._local, "trace", None)
 
-        for system in self.systems:
-            print(f"🤖 Testing {system.name}...")
-            response = system.query(test_case["prompt"])
-            test_result["responses"][system.name] = response
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
 
-            # Preview response
-            preview = response["response"][:200].replace("\n", " ")
-            print(f"   Response: {preview}...")
-            print(f"   Time: {response['time']:.2f}s\n")
+    def mark_headers(self, headers=None):
+        self.marks["headers"] = time.perf_counter()
+        if headers is not None:
+            self.server.update(parse_server_timing(headers.get("Server-Timing")))
 
-            # Rate limiting delay
-            time.sleep(2)
+    def mark_body(self):
+        """Last body byte received"""
+        now = time.perf_counter()
+        if "headers" in self.marks and "body" not in self.marks:
+            self.add("transfer", now - self.marks["headers"])
+        self.marks["body"] = now
 
-        self.results.append(test_result)
-        return test_result
+    def mark_decoded(self):
+        now = time.perf_counter()
+        if "body" in self.marks:
+            self.add("decode", now - self.marks["body"])
+        self.end = now
 
-    def run_category(self, category: str):
-        """Run all tests in a category"""
-        if category not in TEST_PROMPTS:
-            print(f"❌ Unknown category: {category}")
-            print(f"Available: {list(TEST_PROMPTS.keys())}")
+    def elapsed(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def breakdown(self) -> Dict[str, Any]:
+        phases = dict(self.phases, queue=self.server.get("queue"), generation=self.server.get("generation"))
+        result = {phase: round(phases[phase], 6) if phases.get(phase) is not None else None
+                  for phase in PHASES}
+        result["total"] = round(self.elapsed(), 6)
+        result["connection_reused"] = self.connection_reused
+        if self.server:
+            result["server_timing"] = {name: round(value, 6) for name, value in self.server.items()}
+        return result
+
+    @staticmethod
+    def on_transport_event(name: str, info: Dict[str, Any]):
+        """httpcore trace extension callback, used by the SDK clients"""
+        trace = PhaseTrace.current()
+        if trace is None:
             return
+        step, _, state = name.rpartition(".")
+        now = time.perf_counter()
+        if step in ("connection.connect_tcp", "connection.start_tls"):
+            if state == "started":
+                trace.marks[step] = now
+            elif state == "complete":
+                phase = "connect" if step.endswith("connect_tcp") else "tls"
+                trace.add(phase, now - trace.marks.pop(step, now))
+                trace.connection_reused = False
+        elif step.endswith("send_request_headers") and state == "started":
+            trace.marks["send"] = now
+        elif step.endswith("send_request_body") and state == "complete":
+            trace.add("send", now - trace.marks.get("send", now))
+            trace.marks["sent"] = now
+        elif step.endswith("receive_response_headers") and state == "complete":
+            trace.add("wait", now - trace.marks.get("sent", now))
+            trace.mark_headers()
+            headers = (info.get("return_value") or (None, None, None, []))[3]
+            for key, value in headers:
+                if key.lower() == b"server-timing":
+                    trace.server.update(parse_server_timing(value.decode("latin-1")))
+        elif step.endswith("receive_response_body") and state == "complete":
+            trace.mark_body()
 
-        print(f"\n🚀 Running {category.upper()} tests...")
 
-        for test_case in TEST_PROMPTS[category]:
-            self.run_single_test(test_case)
+def _attach_trace_extension(request):
+    if PhaseTrace.current() is not None:
+        request.extensions["trace"] = PhaseTrace.on_transport_event
 
-    def run_all(self):
-        """Run all tests"""
-        print("\n🚀 Running ALL evaluation tests...")
-        print(f"Total tests: {sum(len(tests) for tests in TEST_PROMPTS.values())}")
 
-        for category in TEST_PROMPTS.keys():
-            self.run_category(category)
+def traced_sdk_client_options(sdk) -> Dict[str, Any]:
+    """Client kwargs that route an SDK's transport events into PhaseTrace"""
+    client_class = getattr(sdk, "DefaultHttpxClient", None)
+    if client_class is None:
+        return {}
+    return {"http_client": client_class(event_hooks={"request": [_attach_trace_extension]})}
 
-    def save_results(self, filename: str = None):
-        """Save results to JSON file"""
-        if filename is None:
-            filename = f"evaluation_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump({
-                "metadata": {
-                    "timestamp": datetime.now().isoformat(),
-                    "total_tests": len(self.results),
-                    "systems": [s.name for s in self.systems]
-                },
-                "results": self.results
-            }, f, indent=2, ensure_ascii=False)
+def _traced_pool_classes(on_connect=None) -> Dict[str, Any]:
+    """urllib3 pool classes whose connections report phases to PhaseTrace
 
-        print(f"\n✅ Results saved to: {filename}")
-        return filename
+    `on_connect` is called once for every new socket connection.
+    """
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-    def generate_report(self):
-        """Generate markdown report"""
-        report_lines = [
-            "# AI Coding Assistant Evaluation Report",
-            f"\n**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            f"\n**Total Tests:** {len(self.results)}",
-            "\n---\n"
-        ]
+    class TracedConnectionMixin:
+        def _new_conn(self):
+            if on_connect is not None:
+                on_connect()
+            trace = PhaseTrace.current()
+            if trace is None:
+                return super()._new_conn()
+            trace.connection_reused = False
+            host = self._dns_host
+            start = time.perf_counter()
+            try:
+                address = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+            except OSError:
+                return super()._new_conn()  # let urllib3 raise its usual error
+            trace.add("dns", time.perf_counter() - start)
 
-        for result in self.results:
-            report_lines.append(f"\n## Test {result['test_id']}: {result['category']}")
-            report_lines.append(f"\n**Prompt:**\n```\n{result['prompt']}\n```\n")
+            # Connect to the resolved address so the lookup isn't repeated
+            self._dns_host = address
+            start = time.perf_counter()
+            try:
+                return super()._new_conn()
+            finally:
+                self._dns_host = host
+                trace.add("connect", time.perf_counter() - start)
 
-            for system_name, response in result['responses'].items():
-                report_lines.append(f"\n### {system_name}")
+        def request(self, *args, **kwargs):
+            trace = PhaseTrace.current()
+            start = time.perf_counter()
+            try:
+                return super().request(*args, **kwargs)
+            finally:
+                if trace is not None:
+                    trace.add("send", time.perf_counter() - start)
 
-                if response['response'].startswith("ERROR") or response['response'].startswith("SKIPPED"):
-                    report_lines.append(f"\n⚠️ {response['response']}\n")
-                else:
-                    report_lines.append(f"\n**Response:**\n```python\n{response['response'][:500]}...\n```\n")
-                    report_lines.append(f"**Time:** {response['time']:.2f}s | **Tokens:** {response['tokens']}\n")
+        def getresponse(self, *args, **kwargs):
+            trace = PhaseTrace.current()
+            start = time.perf_counter()
+            response = super().getresponse(*args, **kwargs)
+            if trace is not None:
+                trace.add("wait", time.perf_counter() - start)
+                trace.mark_headers(response.headers)
+            return response
 
-            report_lines.append("\n**Manual Evaluation:** (Score each 1-5)")
-            report_lines.append("\n| System | Correctness | Quality | Completeness | Context | Explanation | Total |")
-            report_lines.append("\n|--------|-------------|---------|--------------|---------|-------------|-------|")
+    class TracedHTTPConnection(TracedConnectionMixin, HTTPConnection):
+        pass
 
-            for system_name in result['responses'].keys():
-                report_lines.append(f"\n| {system_name} | - | - | - | - | - | - |")
+    class TracedHTTPSConnection(TracedConnectionMixin, HTTPSConnection):
+        def connect(self):
+            trace = PhaseTrace.current()
+            if trace is None:
+                return super().connect()
+            setup_before = trace.phases.get("dns", 0.0) + trace.phases.get("connect", 0.0)
+            start = time.perf_counter()
+            super().connect()
+            setup = trace.phases.get("dns", 0.0) + trace.phases.get("connect", 0.0) - setup_before
+            trace.add("tls", time.perf_counter() - start - setup)
 
-            report_lines.append("\n\n---\n")
+    return {
+        "http": type("TracedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": TracedHTTPConnection}),
+        "https": type("TracedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": TracedHTTPSConnection}),
+    }
 
-        report_filename = f"evaluation_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
 
-        with open(report_filename, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(report_lines))
+# ============================================================================
+# HTTP CONNECTION POOLING
+# ============================================================================
 
-        print(f"✅ Report generated: {report_filename}")
-        return report_filename
+# Keep-alive connections per host for the REST-based interfaces
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+
+class PooledHTTPClient:
+    """Persistent keep-alive session with a bounded per-host connection pool
+
+    Reusing connections keeps TCP/TLS setup out of the measured latency.
+    The Anthropic and OpenAI SDK clients already pool connections, so this
+    is only used by the interfaces that talk HTTP directly.
+    """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.adapter.poolmanager.pool_classes_by_scheme = _traced_pool_classes(self._count_connect)
+        self._connects = 0
+        self._lock = threading.Lock()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def post(self, url: str, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def _count_connect(self):
+        with self._lock:
+            self._connects += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Requests sent vs. sockets actually connected across all host pools"""
+        pools = self.adapter.poolmanager.pools
+        requests_sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+        # pool.num_connections counts connection objects, which are
+        # reconnected in place when a server drops them
+        with self._lock:
+            connections_opened = self._connects
+
+        return {
+            "pool_size": self.pool_size,
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(0, requests_sent - connections_opened),
+            "reuse_ratio": 1 - connections_opened / requests_sent if requests_sent else None
+        }
+
+    def close(self):
+        self.session.close()
 
 
 # ============================================================================
-# MAIN
+# RESILIENCE (RETRIES, ADAPTIVE TIMEOUTS, HEDGING)
 # ============================================================================
 
-def main():
-    parser = argparse.ArgumentParser(description="AI Coding Assistant Evaluation")
-    parser.add_argument("--run-all", action="store_true", help="Run all tests")
-    parser.add_argument("--category", type=str, help="Run tests for specific category")
-    parser.add_argument("--prompt", type=str, help="Test a custom prompt")
-    parser.add_argument("--list-categories", action="store_true", help="List available categories")
+# Retry delays use "full jitter": uniform(0, min(cap, base * 2**attempt))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+DEFAULT_RETRIES = int(os.getenv("EVAL_RETRIES", "2"))
 
-    args = parser.parse_args()
+# Until a system has ADAPTIVE_MIN_SAMPLES successful responses it gets
+# TIMEOUT_MAX; after that, TIMEOUT_P99_FACTOR x its recent p99, clamped
+TIMEOUT_MAX = 120.0
+TIMEOUT_MIN = 10.0
+TIMEOUT_P99_FACTOR = 3.0
+ADAPTIVE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
 
-    if args.list_categories:
-        print("\n📋 Available test categories:")
-        for category, tests in TEST_PROMPTS.items():
-            print(f"  - {category}: {len(tests)} tests")
-        return
 
-    runner = EvaluationRunner()
-
-    if args.run_all:
-        runner.run_all()
-    elif args.category:
-        runner.run_category(args.category)
-    elif args.prompt:
-        test_case = {
-            "id": "CUSTOM",
-            "prompt": args.prompt,
-            "category": "Custom",
-            "expected_features": []
-        }
-        runner.run_single_test(test_case)
-    else:
-        print("❌ No action specified. Use --help for options")
-        return
+def jittered_backoff(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Sliding window of a system's successful response times"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Recent percentile, or None until there are enough samples to trust it"""
+        with self._lock:
+            samples = list(self._samples)
+        return percentile(samples, pct) if len(samples) >= ADAPTIVE_MIN_SAMPLES else None
+
+    def timeout(self) -> float:
+        p99 = self.percentile(99)
+        if p99 is None:
+            return TIMEOUT_MAX
+        return min(TIMEOUT_MAX, max(TIMEOUT_MIN, TIMEOUT_P99_FACTOR * p99))
+
+
+def is_retryable(response: Dict[str, Any]) -> bool:
+    """Transient failures: timeouts, connection errors, 408 and 5xx
+
+    429s are left to the runner's rate limiter, other 4xx won't improve.
+    """
+    if response_status(response) != "error" or response.get("rate_limited"):
+        return False
+    status_code = response.get("status_code")
+    return status_code is None or status_code == 408 or status_code >= 500
+
+
+class ResiliencePolicy:
+    """Retries transient failures with jittered backoff and optionally hedges
+
+    With hedging, a duplicate request goes out once the first has been
+    running longer than the system's recent p95; whichever succeeds first
+    is returned. Every request sent, retries and hedges included, first
+    takes a slot from the system's rate limiter, so backoff never pushes
+    a provider past its budget; the response's "rate_limit_wait" totals
+    the waits the caller sat through. Responses that needed more than one
+    request carry an "attempts" list (kind, status, time, and whether it
+    won), so the extra load is visible in the journal and metrics.
+    """
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, hedge: bool = False):
+        self.retries = max(0, retries)
+        self.hedge = hedge
+
+    @staticmethod
+    def _acquire(system: "AISystemInterface", prompt: str) -> float:
+        return system.rate_limiter.acquire(estimate_tokens(prompt))
+
+    @classmethod
+    def _attempt(cls, system: "AISystemInterface", prompt: str, stream: bool,
+                 metered: bool = False) -> Dict[str, Any]:
+        """One request; `metered` takes its rate-limiter slot first, on the calling thread"""
+        waited = cls._acquire(system, prompt) if metered else 0.0
+        response = system.query(prompt, stream=stream)
+        if response_status(response) == "ok":
+            system.latency.record(response["time"])
+        if metered:
+            response["rate_limit_wait"] = waited
+        return response
+
+    @classmethod
+    def _launch(cls, system: "AISystemInterface", prompt: str, stream: bool, metered: bool = False) -> Future:
+        """Start an attempt on its own thread
+
+        A shared pool would cap requests in flight at its worker count and
+        add queueing time that neither the hedge delay nor "time" sees.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(cls._attempt(system, prompt, stream, metered))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return future
+
+    @staticmethod
+    def _summary(kind: str, response: Dict[str, Any], seconds: float, won: bool = None) -> Dict[str, Any]:
+        """Attempt record; `time` is how long it had run when the outcome was decided"""
+        summary = {"kind": kind, "status": response_status(response) if response else "abandoned",
+                   "time": round(seconds, 3)}
+        if response and response_status(response) == "error":
+            summary["error"] = response["response"][:200]
+        if won is not None:
+            summary["won"] = won
+        return summary
+
+    def _hedged(self, system: "AISystemInterface", prompt: str, stream: bool, kind: str, attempts: List):
+        """One logical attempt, hedged once it passes the system's p95
+
+        The first request is metered before the hedge clock starts; the
+        hedge waits for its own slot on its thread.
+        """
+        waited = self._acquire(system, prompt)
+        delay = system.latency.percentile(95) if self.hedge else None
+        start = time.perf_counter()
+        if delay is None:
+            response = self._attempt(system, prompt, stream)
+            attempts.append(self._summary(kind, response, time.perf_counter() - start))
+            return dict(response, rate_limit_wait=waited)
+
+        primary = self._launch(system, prompt, stream)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            response = primary.result()
+            attempts.append(self._summary(kind, response, time.perf_counter() - start))
+            return dict(response, rate_limit_wait=waited)
+
+        hedge_start = time.perf_counter()
+        hedge = self._launch(system, prompt, stream, metered=True)
+        pending = {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if winner is None and response_status(future.result()) == "ok":
+                    winner = future
+        winner = winner or hedge
+        now = time.perf_counter()
+
+        # The loser keeps running in the background; it is reported, not awaited
+        for future, label, started in ((primary, kind, start), (hedge, "hedge", hedge_start)):
+            result = future.result() if future.done() else None
+            attempts.append(self._summary(label, result, now - started, won=future is winner))
+
+        response = dict(winner.result(), rate_limit_wait=waited)
+        if winner is hedge:
+            # Report the latency the caller saw, from the first send
+            hedge_wait = hedge.result()["rate_limit_wait"]
+            response["rate_limit_wait"] = waited + hedge_wait
+            offset = hedge_start - start + hedge_wait
+            response["time"] = response["time"] + offset
+            if (response.get("stream") or {}).get("ttft") is not None:
+                response["stream"] = dict(response["stream"], ttft=response["stream"]["ttft"] + offset)
+        return response
+
+    def execute(self, system: "AISystemInterface", prompt: str, stream: bool = False) -> Dict[str, Any]:
+        attempts = []
+        waited = 0.0
+        for attempt in range(self.retries + 1):
+            response = self._hedged(system, prompt, stream, "primary" if attempt == 0 else "retry", attempts)
+            waited += response["rate_limit_wait"]
+            if attempt == self.retries or not is_retryable(response):
+                break
+            delay = jittered_backoff(attempt)
+            attempts[-1]["backoff"] = round(delay, 3)
+            print(f"   🔁 {system.name}: {response['response'][:80]} - retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        response["rate_limit_wait"] = round(waited, 3)
+        if len(attempts) > 1:
+            response["attempts"] = attempts
+        return response
+
+
+# ============================================================================
+# AI SYSTEM INTERFACES
+# ============================================================================
+
+class AISystemInterface:
+    """Base class for AI system interfaces"""
+
+    def __init__(self, name: str, provider: str = None):
+        self.name = name
+        self.model = None
+        self.rate_limiter = RateLimiter.for_provider(provider) if provider else RateLimiter()
+        self.latency = LatencyTracker()
+        self.policy = ResiliencePolicy()
+
+    @property
+    def available(self) -> bool:
+        """Whether the system is configured to send real requests"""
+        return True
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        """Send prompt and return response with metadata
+
+        With stream=True the response is consumed incrementally and a
+        "stream" entry with TTFT / inter-token latency / tokens-per-second
+        metrics is added to the result.
+        """
+        raise NotImplementedError
+
+    def call(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        """query() under this system's retry / hedging policy and rate limiter"""
+        return self.policy.execute(self, prompt, stream)
+
+    @property
+    def supports_batch(self) -> bool:
+        """Whether submit_batch / batch_status / batch_results are implemented"""
+        return False
+
+    def submit_batch(self, requests: List[Dict[str, str]]) -> str:
+        """Submit [{"custom_id", "prompt"}] as one batch job and return its ID"""
+        raise NotImplementedError
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        """{"status", "done", "completed", "total"} for a submitted batch"""
+        raise NotImplementedError
+
+    def batch_results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        """Results of a finished batch keyed by custom_id, shaped like query() results"""
+        raise NotImplementedError
+
+    def cancel_batch(self, batch_id: str):
+        """Stop a submitted batch; requests it already finished keep their results"""
+        raise NotImplementedError
+
+    def request_timeout(self) -> float:
+        """Adaptive timeout learned from this system's recent latencies"""
+        return self.latency.timeout()
+
+    def cache_identity(self) -> Dict[str, Any]:
+        """Everything besides the prompt that determines a response"""
+        return {"system": self.name, "model": self.model, "max_tokens": 4000}
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Connection reuse statistics, or None if the SDK manages its own pool"""
+        http = getattr(self, "http", None)
+        return http.stats() if http else None
+
+    def _error(self, message: str, status_code: int = None, headers=None) -> Dict[str, Any]:
+        """Build an error result, flagging 429s for the rate limiter"""
+        result = {"response": f"ERROR: {message}", "tokens": 0, "time": 0}
+        if status_code is not None:
+            result["status_code"] = status_code
+        if status_code == 429:
+            result["rate_limited"] = True
+            result["retry_after"] = parse_retry_after(headers)
+        return result
+
+    def _exception_error(self, error: Exception) -> Dict[str, Any]:
+        """Build an error result from an SDK exception"""
+        response = getattr(error, "response", None)
+        return self._error(str(error), getattr(error, "status_code", None),
+                           getattr(response, "headers", None))
+
+
+class ClaudeCodeInterface(AISystemInterface):
+    """Interface for Claude Code (Anthropic API)"""
+
+    def __init__(self):
+        super().__init__("Claude Code", provider="anthropic")
+        self.model = "claude-sonnet-4-20250514"
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            print("⚠️  ANTHROPIC_API_KEY not set. Skipping Claude Code.")
+            self.client = None
+        else:
+            try:
+                import anthropic
+            except ImportError:
+                print("⚠️  anthropic not installed (pip install anthropic). Skipping Claude Code.")
+                self.client = None
+            else:
+                # Retries are handled by ResiliencePolicy so each one is recorded
+                self.client = anthropic.Anthropic(api_key=api_key, max_retries=0,
+                                                  **traced_sdk_client_options(anthropic))
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        if not self.client:
+            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
+
+        if stream:
+            return self._query_stream(prompt)
+
+        try:
+            with PhaseTrace() as trace:
+                message = self.client.messages.create(
+                    model=self.model,
+                    max_tokens=4000,
+                    messages=[{"role": "user", "content": prompt}],
+                    timeout=self.request_timeout()
+                )
+                trace.mark_decoded()
+
+            return {
+                "response": message.content[0].text,
+                "tokens": message.usage.input_tokens + message.usage.output_tokens,
+                "input_tokens": message.usage.input_tokens,
+                "output_tokens": message.usage.output_tokens,
+                "time": trace.elapsed(),
+                "model": "claude-sonnet-4",
+                "phases": trace.breakdown()
+            }
+        except Exception as e:
+            return self._exception_error(e)
+
+    def _query_stream(self, prompt: str) -> Dict[str, Any]:
+        recorder = StreamRecorder()
+        try:
+            with PhaseTrace() as trace, self.client.messages.stream(
+                model=self.model,
+                max_tokens=4000,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=self.request_timeout()
+            ) as stream:
+                for text in stream.text_stream:
+                    recorder.add(text)
+                message = stream.get_final_message()
+                trace.mark_body()
+
+            return {
+                "response": recorder.text,
+                "tokens": message.usage.input_tokens + message.usage.output_tokens,
+                "input_tokens": message.usage.input_tokens,
+                "output_tokens": message.usage.output_tokens,
+                "time": recorder.finish(),
+                "model": "claude-sonnet-4",
+                "stream": recorder.metrics(message.usage.output_tokens),
+                "phases": trace.breakdown()
+            }
+        except Exception as e:
+            return self._exception_error(e)
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.client is not None
+
+    def submit_batch(self, requests: List[Dict[str, str]]) -> str:
+        batch = self.client.messages.batches.create(requests=[
+            {
+                "custom_id": request["custom_id"],
+                "params": {
+                    "model": self.model,
+                    "max_tokens": 4000,
+                    "messages": [{"role": "user", "content": request["prompt"]}]
+                }
+            }
+            for request in requests
+        ])
+        return batch.id
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        finished = counts.succeeded + counts.errored + counts.canceled + counts.expired
+        return {"status": batch.processing_status, "done": batch.processing_status == "ended",
+                "completed": finished, "total": finished + counts.processing}
+
+    def batch_results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                error = getattr(entry.result, "error", None)
+                results[entry.custom_id] = self._error(f"batch request {entry.result.type}"
+                                                       + (f": {error}" if error else ""))
+                continue
+            message = entry.result.message
+            results[entry.custom_id] = {
+                "response": message.content[0].text,
+                "tokens": message.usage.input_tokens + message.usage.output_tokens,
+                "input_tokens": message.usage.input_tokens,
+                "output_tokens": message.usage.output_tokens,
+                "time": 0.0,  # Not reported per request
+                "model": "claude-sonnet-4"
+            }
+        return results
+
+    def cancel_batch(self, batch_id: str):
+        self.client.messages.batches.cancel(batch_id)
+
+
+class ChatGPTInterface(AISystemInterface):
+    """Interface for ChatGPT (OpenAI API)"""
+
+    def __init__(self):
+        super().__init__("ChatGPT", provider="openai")
+        self.model = "gpt-4-turbo-preview"
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            print("⚠️  OPENAI_API_KEY not set. Skipping ChatGPT.")
+            self.client = None
+        else:
+            try:
+                import openai
+            except ImportError:
+                print("⚠️  openai not installed (pip install openai). Skipping ChatGPT.")
+                self.client = None
+            else:
+                # Retries are handled by ResiliencePolicy so each one is recorded
+                self.client = openai.OpenAI(api_key=api_key, max_retries=0, **traced_sdk_client_options(openai))
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        if not self.client:
+            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
+
+        if stream:
+            return self._query_stream(prompt)
+
+        try:
+            with PhaseTrace() as trace:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=4000,
+                    timeout=self.request_timeout()
+                )
+                trace.mark_decoded()
+
+            return {
+                "response": response.choices[0].message.content,
+                "tokens": response.usage.total_tokens,
+                "input_tokens": response.usage.prompt_tokens,
+                "output_tokens": response.usage.completion_tokens,
+                "time": trace.elapsed(),
+                "model": "gpt-4-turbo",
+                "phases": trace.breakdown()
+            }
+        except Exception as e:
+            return self._exception_error(e)
+
+    def _query_stream(self, prompt: str) -> Dict[str, Any]:
+        recorder = StreamRecorder()
+        try:
+            with PhaseTrace() as trace:
+                chunks = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=4000,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=self.request_timeout()
+                )
+
+                usage = None
+                for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        recorder.add(chunk.choices[0].delta.content)
+                    if chunk.usage:
+                        usage = chunk.usage
+                trace.mark_body()
+
+            return {
+                "response": recorder.text,
+                "tokens": usage.total_tokens if usage else 0,
+                "input_tokens": usage.prompt_tokens if usage else None,
+                "output_tokens": usage.completion_tokens if usage else None,
+                "time": recorder.finish(),
+                "model": "gpt-4-turbo",
+                "stream": recorder.metrics(usage.completion_tokens if usage else None),
+                "phases": trace.breakdown()
+            }
+        except Exception as e:
+            return self._exception_error(e)
+
+    @property
+    def supports_batch(self) -> bool:
+        return self.client is not None
+
+    def submit_batch(self, requests: List[Dict[str, str]]) -> str:
+        lines = "".join(
+            json.dumps({
+                "custom_id": request["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": request["prompt"]}],
+                    "max_tokens": 4000
+                }
+            }) + "\n"
+            for request in requests
+        )
+        batch_file = self.client.files.create(file=("batch.jsonl", lines.encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        return batch.id
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {"status": batch.status,
+                "done": batch.status in ("completed", "failed", "expired", "cancelled"),
+                "completed": counts.completed + counts.failed if counts else 0,
+                "total": counts.total if counts else 0}
+
+    def batch_results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") != 200:
+                    error = item.get("error") or body.get("error") or {}
+                    results[item["custom_id"]] = self._error(error.get("message", "batch request failed"),
+                                                             response.get("status_code"))
+                    continue
+                usage = body.get("usage") or {}
+                results[item["custom_id"]] = {
+                    "response": body["choices"][0]["message"]["content"],
+                    "tokens": usage.get("total_tokens", 0),
+                    "input_tokens": usage.get("prompt_tokens"),
+                    "output_tokens": usage.get("completion_tokens"),
+                    "time": 0.0,  # Not reported per request
+                    "model": "gpt-4-turbo"
+                }
+        return results
+
+    def cancel_batch(self, batch_id: str):
+        self.client.batches.cancel(batch_id)
+
+
+class LocalInstanceInterface(AISystemInterface):
+    """Interface for your local AI instance"""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE):
+        super().__init__("Local Instance", provider="local_ai")
+        self.base_url = os.getenv("LOCAL_AI_URL", "http://localhost:8000")
+        self.model = "local-mistral"
+        try:
+            self.http = PooledHTTPClient(pool_size)
+        except ImportError:
+            print("⚠️  requests not installed (pip install requests). Skipping Local Instance.")
+            self.http = None
+
+    @property
+    def available(self) -> bool:
+        return self.http is not None
+
+    def cache_identity(self) -> Dict[str, Any]:
+        return {"system": self.name, "model": self.model, "base_url": self.base_url}
+
+    @staticmethod
+    def _payload(prompt: str, session_id: str = None, context: Dict[str, Any] = None) -> Dict[str, Any]:
+        """ChatRequest body; session_id and context are only sent when set"""
+        payload = {"message": prompt}
+        if session_id:
+            payload["session_id"] = session_id
+        if context:
+            payload["context"] = context
+        return payload
+
+    def query(self, prompt: str, stream: bool = False, session_id: str = None,
+              context: Dict[str, Any] = None) -> Dict[str, Any]:
+        if not self.http:
+            return {"response": "SKIPPED - requests not installed", "tokens": 0, "time": 0}
+        if stream:
+            return self._query_stream(prompt, session_id, context)
+
+        try:
+            with PhaseTrace() as trace:
+                response = self.http.post(
+                    f"{self.base_url}/api/chat",
+                    json=self._payload(prompt, session_id, context),
+                    timeout=self.request_timeout()
+                )
+                trace.mark_body()
+                data = response.json() if response.status_code == 200 else None
+                trace.mark_decoded()
+
+            if response.status_code == 200:
+                result = {
+                    "response": data.get("response", ""),
+                    "tokens": 0,  # Filled in by TokenCounter
+                    "time": trace.elapsed(),
+                    "model": "local-mistral",
+                    "phases": trace.breakdown()
+                }
+                if session_id:
+                    result["session_id"] = data.get("session_id", session_id)
+                return result
+            else:
+                return self._error(f"HTTP {response.status_code}", response.status_code, response.headers)
+
+        except Exception as e:
+            return self._exception_error(e)
+
+    @staticmethod
+    def _iter_stream_text(response) -> Any:
+        """Yield the text of each /api/chat/stream event as it completes
+
+        Events are standard SSE: one or more "data: <text>" lines ended by a
+        blank line, with multi-line text sent as several data lines.
+        """
+        return iter_sse_data(response)
+
+    def _query_stream(self, prompt: str, session_id: str = None,
+                      context: Dict[str, Any] = None) -> Dict[str, Any]:
+        recorder = StreamRecorder()
+        try:
+            with PhaseTrace() as trace:
+                response = self.http.post(
+                    f"{self.base_url}/api/chat/stream",
+                    json=self._payload(prompt, session_id, context),
+                    timeout=self.request_timeout(),
+                    stream=True
+                )
+
+                with response:
+                    if response.status_code != 200:
+                        response.content  # read the error body so the connection can be reused
+                        return self._error(f"HTTP {response.status_code}", response.status_code, response.headers)
+
+                    for text in self._iter_stream_text(response):
+                        recorder.add(text)
+                trace.mark_body()
+
+            return {
+                "response": recorder.text,
+                "tokens": 0,
+                "time": recorder.finish(),
+                "model": "local-mistral",
+                "stream": recorder.metrics(),
+                "phases": trace.breakdown()
+            }
+
+        except Exception as e:
+            return self._exception_error(e)
+
+    @property
+    def supports_batch(self) -> bool:
+        return True
+
+    def submit_batch(self, requests: List[Dict[str, str]]) -> str:
+        response = self.http.post(
+            f"{self.base_url}/api/batch",
+            json={"requests": [{"custom_id": r["custom_id"], "message": r["prompt"]} for r in requests]},
+            timeout=TIMEOUT_MAX
+        )
+        response.raise_for_status()
+        return response.json()["batch_id"]
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        response = self.http.get(f"{self.base_url}/api/batch/{batch_id}", timeout=TIMEOUT_MIN)
+        response.raise_for_status()
+        data = response.json()
+        return {"status": data["status"], "done": data["status"] in ("completed", "failed", "cancelled"),
+                "completed": data.get("completed", 0), "total": data.get("total", 0)}
+
+    def batch_results(self, batch_id: str) -> Dict[str, Dict[str, Any]]:
+        response = self.http.get(f"{self.base_url}/api/batch/{batch_id}/results", timeout=TIMEOUT_MAX)
+        response.raise_for_status()
+        results = {}
+        for item in response.json().get("results", []):
+            if item.get("error"):
+                results[item["custom_id"]] = self._error(item["error"], item.get("status_code"))
+            else:
+                results[item["custom_id"]] = {
+                    "response": item.get("response", ""),
+                    "tokens": 0,  # Filled in by TokenCounter
+                    "time": item.get("time", 0.0),
+                    "model": "local-mistral"
+                }
+        return results
+
+    def cancel_batch(self, batch_id: str):
+        response = self.http.post(f"{self.base_url}/api/batch/{batch_id}/cancel", timeout=TIMEOUT_MIN)
+        response.raise_for_status()
+
+
+class GrokInterface(AISystemInterface):
+    """Interface for Grok (X.AI API)"""
+
+    def __init__(self):
+        super().__init__("Grok")
+        # Grok API - update when available
+        print("⚠️  Grok API interface not implemented yet")
+        self.client = None
+
+    @property
+    def available(self) -> bool:
+        return False
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        return {"response": "SKIPPED - API not available", "tokens": 0, "time": 0}
+
+
+class PerplexityInterface(AISystemInterface):
+    """Interface for Perplexity"""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE):
+        super().__init__("Perplexity", provider="perplexity")
+        self.base_url = os.getenv("PERPLEXITY_BASE_URL", "https://api.perplexity.ai")
+        self.model = "llama-3.1-sonar-large-128k-online"
+        try:
+            self.http = PooledHTTPClient(pool_size)
+        except ImportError:
+            print("⚠️  requests not installed (pip install requests). Skipping Perplexity.")
+            self.http = None
+        api_key = os.getenv("PERPLEXITY_API_KEY")
+        if not api_key:
+            print("⚠️  PERPLEXITY_API_KEY not set. Skipping Perplexity.")
+            self.api_key = None
+        else:
+            self.api_key = api_key
+
+    @property
+    def available(self) -> bool:
+        return self.api_key is not None and self.http is not None
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        if not self.api_key:
+            return {"response": "SKIPPED - No API key", "tokens": 0, "time": 0}
+        if not self.http:
+            return {"response": "SKIPPED - requests not installed", "tokens": 0, "time": 0}
+
+        if stream:
+            return self._query_stream(prompt)
+
+        try:
+            with PhaseTrace() as trace:
+                response = self.http.post(
+                    f"{self.base_url}/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": self.model,
+                        "messages": [{"role": "user", "content": prompt}]
+                    },
+                    timeout=self.request_timeout()
+                )
+                trace.mark_body()
+                data = response.json() if response.status_code == 200 else None
+                trace.mark_decoded()
+
+            if response.status_code == 200:
+                return {
+                    "response": data["choices"][0]["message"]["content"],
+                    "tokens": data.get("usage", {}).get("total_tokens", 0),
+                    "input_tokens": data.get("usage", {}).get("prompt_tokens"),
+                    "output_tokens": data.get("usage", {}).get("completion_tokens"),
+                    "time": trace.elapsed(),
+                    "model": "sonar-large",
+                    "phases": trace.breakdown()
+                }
+            else:
+                return self._error(f"HTTP {response.status_code}", response.status_code, response.headers)
+
+        except Exception as e:
+            return self._exception_error(e)
+
+    def _query_stream(self, prompt: str) -> Dict[str, Any]:
+        recorder = StreamRecorder()
+        try:
+            with PhaseTrace() as trace:
+                response = self.http.post(
+                    f"{self.base_url}/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": self.model,
+                        "messages": [{"role": "user", "content": prompt}],
+                        "stream": True
+                    },
+                    timeout=self.request_timeout(),
+                    stream=True
+                )
+
+                usage = {}
+                with response:
+                    if response.status_code != 200:
+                        response.content  # read the error body so the connection can be reused
+                        return self._error(f"HTTP {response.status_code}", response.status_code, response.headers)
+
+                    for payload in iter_sse_data(response):
+                        data = json.loads(payload)
+                        if data.get("choices"):
+                            recorder.add(data["choices"][0].get("delta", {}).get("content"))
+                        usage = data.get("usage") or usage
+                trace.mark_body()
+
+            return {
+                "response": recorder.text,
+                "tokens": usage.get("total_tokens", 0),
+                "input_tokens": usage.get("prompt_tokens"),
+                "output_tokens": usage.get("completion_tokens"),
+                "time": recorder.finish(),
+                "model": "sonar-large",
+                "stream": recorder.metrics(usage.get("completion_tokens")),
+                "phases": trace.breakdown()
+            }
+
+        except Exception as e:
+            return self._exception_error(e)
+
+
+# ============================================================================
+# SYSTEM REGISTRY
+# ============================================================================
+
+# Selectable systems in report order: key -> (display name, factory).
+# Factories run only for selected systems, so a backend's SDK is imported
+# only when that backend is used.
+SYSTEM_REGISTRY = {
+    "claude": ("Claude Code", lambda pool_size: ClaudeCodeInterface()),
+    "chatgpt": ("ChatGPT", lambda pool_size: ChatGPTInterface()),
+    "grok": ("Grok", lambda pool_size: GrokInterface()),
+    "perplexity": ("Perplexity", lambda pool_size: PerplexityInterface(pool_size=pool_size)),
+    "local": ("Local Instance", lambda pool_size: LocalInstanceInterface(pool_size=pool_size)),
+}
+
+
+def resolve_systems(selection: List[str] = None) -> List[str]:
+    """Registry keys for a selection of keys or display names (None = all)"""
+    if not selection:
+        return list(SYSTEM_REGISTRY)
+
+    wanted = set()
+    for item in selection:
+        needle = item.strip().lower()
+        matches = [key for key, (name, _) in SYSTEM_REGISTRY.items() if needle in (key, name.lower())]
+        if not matches:
+            raise ValueError(f"Unknown system: {item} (available: {', '.join(SYSTEM_REGISTRY)})")
+        wanted.update(matches)
+    return [key for key in SYSTEM_REGISTRY if key in wanted]
+
+
+def build_systems(selection: List[str] = None, pool_size: int = HTTP_POOL_SIZE) -> List[AISystemInterface]:
+    """Instantiate the selected systems in registry order"""
+    return [SYSTEM_REGISTRY[key][1](pool_size) for key in resolve_systems(selection)]
+
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+
+CACHE_DIR = os.getenv("EVAL_CACHE_DIR", ".eval_cache")
+CACHE_MAX_MB = 512
+CACHE_MAX_AGE_DAYS = 30
+
+
+def response_status(response: Dict[str, Any]) -> str:
+    """Classify a result as ok, error or skipped"""
+    text = response.get("response") or ""
+    if text.startswith("SKIPPED"):
+        return "skipped"
+    if text.startswith("ERROR"):
+        return "error"
+    return "ok"
+
+
+class ResponseCache:
+    """Content-addressed on-disk store of successful responses
+
+    Entries live in one SQLite file keyed by a SHA-256 of the system, model,
+    prompt and request parameters, with zlib-compressed JSON payloads.
+    Entries older than max_age are dropped and the least recently used ones
+    are evicted once the store exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_mb: float = CACHE_MAX_MB,
+                 max_age_days: float = CACHE_MAX_AGE_DAYS):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "responses.sqlite3")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, system TEXT, created REAL, accessed REAL,"
+            " size INTEGER, payload BLOB)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+        self.evict()
+
+    @staticmethod
+    def key(identity: Dict[str, Any], prompt: str, **params) -> str:
+        material = json.dumps({"identity": identity, "prompt": prompt, "params": params},
+                              sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Dict[str, Any]:
+        """Return a cached response, or None on a miss"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, system_name: str, response: Dict[str, Any]):
+        payload = zlib.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, system_name, now, now, len(payload), payload)
+            )
+            self._db.commit()
+
+    def evict(self) -> int:
+        """Apply age and size limits; returns the number of entries removed"""
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            ).rowcount
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall():
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    removed += 1
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            self._db.commit()
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._db.close()
+
+
+# ============================================================================
+# AUTOMATED SCORING
+# ============================================================================
+
+# Hidden test cases per test ID. "find" picks candidate functions/classes
+# from the response by name keyword; "checks" runs once per candidate with
+# it bound to `f`, and the best candidate's pass count is the score.
+# Helpers available to checks: check(label, fn), raises(fn, *exc_types),
+# accepts(value) / rejects(value) for validator-style functions, timed(fn).
+# timed() measures the sandbox's own CPU time, so complexity checks compare
+# how cost scales with input size rather than wall-clock limits that depend
+# on how busy the machine is.
+HIDDEN_TESTS = {
+    "S1": {
+        "find": ("function", ["prime"]),
+        "checks": """
+check("2 is prime", lambda: f(2) is True)
+check("97 is prime", lambda: f(97) is True)
+check("1 is not prime", lambda: f(1) is False)
+check("0 is not prime", lambda: f(0) is False)
+check("15 is not prime", lambda: f(15) is False)
+check("negative handled", lambda: raises(lambda: f(-7)) or f(-7) is False)
+"""
+    },
+    "S2": {
+        "find": ("function", ["reverse"]),
+        "checks": """
+check("reverses word", lambda: f("hello") == "olleh")
+check("empty string", lambda: f("") == "")
+check("single char", lambda: f("a") == "a")
+check("keeps spaces", lambda: f("ab c") == "c ba")
+"""
+    },
+    "S3": {
+        "find": ("function", ["factorial", "fact"]),
+        "checks": """
+check("0! == 1", lambda: f(0) == 1)
+check("5! == 120", lambda: f(5) == 120)
+check("10! == 3628800", lambda: f(10) == 3628800)
+check("negative handled", lambda: raises(lambda: f(-1)) or f(-1) is None)
+"""
+    },
+    "M3": {
+        "find": ("function", ["merge"]),
+        "checks": """
+check("interleaves", lambda: f([1, 3, 5], [2, 4, 6]) == [1, 2, 3, 4, 5, 6])
+check("empty left", lambda: f([], [1, 2]) == [1, 2])
+check("empty right", lambda: f([1, 2], []) == [1, 2])
+check("duplicates kept", lambda: f([1, 1], [1]) == [1, 1, 1])
+"""
+    },
+    "C1": {
+        "find": ("class", ["lru", "cache"]),
+        "checks": """
+def basic():
+    c = f(2)
+    c.put(1, 1)
+    c.put(2, 2)
+    return c.get(1) == 1
+
+def evicts():
+    c = f(2)
+    c.put(1, 1)
+    c.put(2, 2)
+    c.get(1)
+    c.put(3, 3)
+    return c.get(2) in (-1, None) and c.get(1) == 1 and c.get(3) == 3
+
+def ops(n):
+    c = f(n)
+    for i in range(n):
+        c.put(i, i)
+    for i in range(n):
+        c.get(i)
+
+check("get after put", basic)
+check("evicts least recently used", evicts)
+# O(1) operations scale ~10x for 10x the work; O(n) ones scale ~100x
+check("O(1) get/put", lambda: timed(lambda: ops(20000)) < 30 * timed(lambda: ops(2000)))
+"""
+    },
+    "C4": {
+        "find": ("function", ["cycle"]),
+        "checks": """
+check("detects cycle", lambda: bool(f({0: [1], 1: [2], 2: [0]})) is True)
+check("acyclic graph", lambda: bool(f({0: [1], 1: [2], 2: []})) is False)
+check("self loop", lambda: bool(f({0: [0]})) is True)
+check("diamond is acyclic", lambda: bool(f({0: [1, 2], 1: [3], 2: [3], 3: []})) is False)
+"""
+    },
+    "D1": {
+        "find": ("function", ["average", "avg", "mean"]),
+        "checks": """
+check("averages", lambda: f([1, 2, 3]) == 2)
+check("empty list handled", lambda: not raises(lambda: f([]), ZeroDivisionError))
+"""
+    },
+    "D2": {
+        "find": ("function", ["duplicate"]),
+        "checks": """
+check("finds duplicates", lambda: sorted(f([1, 2, 2, 3, 3, 3])) == [2, 3])
+check("no duplicates", lambda: list(f([1, 2, 3])) == [])
+check("empty list", lambda: list(f([])) == [])
+# Linear or n log n scales ~10x for 10x the input; quadratic ~100x
+check("linear time", lambda: timed(lambda: f(list(range(20000)) * 2)) < 30 * timed(lambda: f(list(range(2000)) * 2)))
+"""
+    },
+    "D3": {
+        "find": ("class", ["processor"]),
+        "checks": """
+def isolated():
+    a, b = f(), f()
+    a.process(1)
+    return b.process(2) == 1
+
+check("cache is per instance", isolated)
+"""
+    },
+    "N1": {
+        "find": ("function", ["nhs", "valid"]),
+        "checks": """
+check("accepts 9434765919", lambda: accepts("9434765919"))
+check("accepts 4010232137", lambda: accepts("4010232137"))
+check("accepts check digit 0", lambda: accepts("9876543210"))
+check("rejects wrong check digit", lambda: rejects("9434765918"))
+check("rejects check digit 10", lambda: rejects("1234567890"))
+check("rejects short number", lambda: rejects("943476591"))
+check("rejects non-digits", lambda: rejects("94347659AB"))
+"""
+    },
+}
+
+SANDBOX_CHECK_SECONDS = 2
+SANDBOX_WALL_FACTOR = 10
+SANDBOX_CPU_SECONDS = 30
+SANDBOX_MEMORY_MB = 512
+SANDBOX_WALL_SECONDS = 60
+
+CODE_BLOCK_PATTERN = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)```", re.DOTALL)
+
+# Executed in a fresh `python -I` process; reads {"blocks", "find", "checks",
+# "timeout", "cpu_seconds", "memory_mb"} on stdin. The process caps its own
+# CPU time and address space before running any response code (preexec_fn
+# is not safe from the scorer's worker threads). Each block and check gets
+# its own CPU time limit where available, so one hung check does not lose
+# the others; a wall-clock limit of SANDBOX_WALL_FACTOR times that catches
+# checks that block without using CPU.
+SANDBOX_RUNNER = r"""
+import contextlib, io, json, signal, sys, time
+
+payload = json.loads(sys.stdin.read())
+
+try:
+    import resource
+except ImportError:  # not POSIX; run without limits
+    resource = None
+if resource is not None:
+    resource.setrlimit(resource.RLIMIT_CPU, (payload["cpu_seconds"], payload["cpu_seconds"]))
+    memory = payload["memory_mb"] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+result = {"blocks_run": 0, "errors": [], "passed": 0, "total": 0, "failed": []}
+ns = {"__name__": "candidate"}
+
+
+class TimeLimit(BaseException):
+    pass
+
+
+def _expired(signum, frame):
+    raise TimeLimit(f"exceeded {payload['timeout']}s")
+
+
+if hasattr(signal, "setitimer"):
+    signal.signal(signal.SIGPROF, _expired)
+    signal.signal(signal.SIGALRM, _expired)
+
+
+@contextlib.contextmanager
+def time_limit():
+    if hasattr(signal, "setitimer"):
+        signal.setitimer(signal.ITIMER_PROF, payload["timeout"])
+        signal.setitimer(signal.ITIMER_REAL, payload["timeout"] * payload["wall_factor"])
+    try:
+        yield
+    finally:
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+for block in payload["blocks"]:
+    try:
+        with time_limit(), contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            exec(compile(block, "<response>", "exec"), ns)
+        result["blocks_run"] += 1
+    except BaseException as e:
+        result["errors"].append(f"{type(e).__name__}: {e}"[:200])
+
+if payload.get("checks"):
+    kind, keywords = payload["find"]
+    candidates = [
+        obj for name, obj in ns.items()
+        if not name.startswith("_") and any(k in name.lower() for k in keywords)
+        and (isinstance(obj, type) if kind == "class" else callable(obj) and not isinstance(obj, type))
+    ]
+
+    def raises(fn, *types):
+        try:
+            fn()
+        except (types or Exception):
+            return True
+        return False
+
+    def timed(fn, repeat=3):
+        # Best of a few runs of process CPU time; the floor keeps ratios of tiny timings meaningful
+        best = None
+        for _ in range(repeat):
+            start = time.process_time()
+            fn()
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return max(best, 1e-3)
+
+    if not candidates:
+        result["errors"].append(f"no {kind} named like {keywords}")
+
+    best = None
+    for candidate in candidates:
+        outcomes = []
+
+        def check(label, fn):
+            try:
+                with time_limit(), contextlib.redirect_stdout(io.StringIO()):
+                    ok = bool(fn())
+            except BaseException:
+                ok = False
+            outcomes.append((label, ok))
+
+        def verdict(value):
+            value = candidate(value)
+            return value[0] if isinstance(value, tuple) else value
+
+        def accepts(value):
+            return verdict(value) is True
+
+        def rejects(value):
+            try:
+                return not verdict(value)
+            except Exception:
+                return True
+
+        env = {"f": candidate, "check": check, "raises": raises, "timed": timed,
+               "accepts": accepts, "rejects": rejects}
+        try:
+            exec(payload["checks"], env)
+        except BaseException as e:
+            result["errors"].append(f"checks: {type(e).__name__}: {e}"[:200])
+        if best is None or sum(ok for _, ok in outcomes) > sum(ok for _, ok in best):
+            best = outcomes
+
+    result["total"] = payload["checks"].count("check(")
+    if best:
+        result["passed"] = sum(ok for _, ok in best)
+        result["failed"] = [label for label, ok in best if not ok]
+
+print(json.dumps(result))
+"""
+
+
+def extract_code_blocks(text: str) -> List[str]:
+    """Python code blocks from a markdown response"""
+    blocks = [code for lang, code in CODE_BLOCK_PATTERN.findall(text)
+              if lang.lower() in ("", "python", "py", "python3")]
+    if not blocks:
+        # Some models answer with bare code
+        try:
+            ast.parse(text)
+            blocks = [text]
+        except (SyntaxError, ValueError):
+            pass
+    return blocks
+
+
+def score_response(test_id: str, text: str) -> Dict[str, Any]:
+    """Syntax-check and execute a response's code against its hidden tests"""
+    blocks = extract_code_blocks(text)
+    valid = []
+    for block in blocks:
+        try:
+            ast.parse(block)
+            valid.append(block)
+        except (SyntaxError, ValueError):
+            pass
+
+    scoring = {
+        "code_blocks": len(blocks),
+        "syntax_ok": bool(blocks) and len(valid) == len(blocks),
+        "executed": False,
+        "passed": 0,
+        "total": 0,
+        "score": None,
+        "errors": []
+    }
+    if not valid:
+        return scoring
+
+    spec = HIDDEN_TESTS.get(test_id, {})
+    payload = json.dumps({"blocks": valid, "find": spec.get("find"), "checks": spec.get("checks"),
+                          "timeout": SANDBOX_CHECK_SECONDS, "wall_factor": SANDBOX_WALL_FACTOR,
+                          "cpu_seconds": SANDBOX_CPU_SECONDS,
+                          "memory_mb": SANDBOX_MEMORY_MB})
+
+    with tempfile.TemporaryDirectory(prefix="eval_sandbox_") as workdir:
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-I", "-c", SANDBOX_RUNNER],
+                input=payload, capture_output=True, text=True, cwd=workdir,
+                timeout=SANDBOX_WALL_SECONDS,
+                env={"PATH": os.environ.get("PATH", ""), "PYTHONHASHSEED": "0"}
+            )
+            outcome = json.loads(completed.stdout.strip().splitlines()[-1])
+        except subprocess.TimeoutExpired:
+            scoring["errors"].append(f"timed out after {SANDBOX_WALL_SECONDS}s")
+            return scoring
+        except (ValueError, IndexError):
+            reason = "resource limit exceeded" if completed.returncode < 0 else "sandbox crashed"
+            scoring["errors"].append(f"{reason} (exit {completed.returncode})")
+            return scoring
+
+    scoring["executed"] = outcome["blocks_run"] > 0
+    scoring["errors"] = outcome["errors"]
+    scoring["passed"] = outcome["passed"]
+    scoring["total"] = outcome["total"]
+    scoring["failed"] = outcome["failed"]
+    if outcome["total"]:
+        scoring["score"] = round(outcome["passed"] / outcome["total"], 3)
+    return scoring
+
+
+class ResponseScorer:
+    """Scores many responses in parallel, one sandboxed process per response
+
+    Worker threads only wait on their subprocess, so `workers` processes run
+    side by side; the default uses every core.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+
+    def score_all(self, jobs: List[Any]) -> Dict[Any, Dict[str, Any]]:
+        """Score (key, test_id, text) jobs; returns {key: scoring}"""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {key: executor.submit(score_response, test_id, text) for key, test_id, text in jobs}
+            return {key: future.result() for key, future in futures.items()}
+
+
+# ============================================================================
+# SIMILARITY ANALYSIS
+# ============================================================================
+
+# SimHash signatures within this Hamming distance (of 64 bits) are near-duplicates
+NEAR_DUPLICATE_BITS = 3
+SIMILARITY_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _mix64(np, keys):
+    """splitmix64 finaliser: spreads n-gram ids over all 64 bits for SimHash"""
+    with np.errstate(over="ignore"):
+        x = keys + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _popcount64(np, values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class SimilarityAnalyzer:
+    """TF-IDF word 1-2 gram similarity across every response in a run, with NumPy
+
+    All successful responses are vectorised once as sparse (doc, feature,
+    weight) arrays. Per-test similarity matrices come from joining entries
+    that share a (test, feature) key, so the work is proportional to shared
+    n-grams rather than to response pairs. A system's agreement on a test is
+    its mean cosine similarity to the other systems' answers. Near-duplicates
+    across the whole run are found with 64-bit SimHash signatures, banded
+    into four 16-bit keys so only colliding candidates are compared.
+    """
+
+    def __init__(self):
+        import numpy  # optional dependency; callers check for ImportError
+
+        self.np = numpy
+
+    def _vectorize(self, texts: List[str]):
+        np = self.np
+        vocab = {}
+        doc_ids, keys = [], []
+        for doc, text in enumerate(texts):
+            ids = np.array([vocab.setdefault(token, len(vocab))
+                            for token in SIMILARITY_TOKEN_PATTERN.findall(text.lower())], dtype=np.uint64)
+            grams = np.concatenate([ids, (ids[:-1] + np.uint64(1)) * np.uint64(1 << 32) + ids[1:]]) \
+                if len(ids) else ids
+            keys.append(grams)
+            doc_ids.append(np.full(len(grams), doc, dtype=np.int64))
+
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+        docs = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int64)
+        features, feature_of = np.unique(keys, return_inverse=True)
+        pair_keys, tf = np.unique(docs * len(features) + feature_of, return_counts=True)
+        entry_doc, entry_feature = np.divmod(pair_keys, len(features))
+
+        n_docs = len(texts)
+        df = np.bincount(entry_feature, minlength=len(features))
+        idf = np.log((1 + n_docs) / (1 + df)) + 1
+        weight = (1 + np.log(tf)) * idf[entry_feature]
+        norms = np.sqrt(np.bincount(entry_doc, weights=weight ** 2, minlength=n_docs))
+        weight = weight / np.where(norms > 0, norms, 1)[entry_doc]
+        return entry_doc, entry_feature, weight, _mix64(np, features)
+
+    def _test_similarity(self, entry_doc, entry_feature, weight, doc_test, doc_system, n_tests, n_systems):
+        """(tests, systems, systems) cosine similarity, from entries sharing a (test, feature) key"""
+        np = self.np
+        key = doc_test[entry_doc] * (int(entry_feature.max()) + 1 if len(entry_feature) else 1) + entry_feature
+        order = np.lexsort((entry_doc, key))
+        key, doc, w = key[order], entry_doc[order], weight[order]
+
+        flat = np.zeros(n_tests * n_systems * n_systems)
+        for offset in range(1, n_systems):
+            match = key[offset:] == key[:-offset]
+            a, b = doc[:-offset][match], doc[offset:][match]
+            products = w[:-offset][match] * w[offset:][match]
+            for first, second in ((a, b), (b, a)):
+                index = (doc_test[first] * n_systems + doc_system[first]) * n_systems + doc_system[second]
+                flat += np.bincount(index, weights=products, minlength=len(flat))
+        similarity = flat.reshape(n_tests, n_systems, n_systems)
+        similarity[doc_test, doc_system, doc_system] = 1.0
+        return similarity
+
+    def _simhash(self, entry_doc, entry_feature, weight, feature_hash, n_docs):
+        np = self.np
+        hashes = feature_hash[entry_feature]
+        signature = np.zeros(n_docs, dtype=np.uint64)
+        for bit in range(64):
+            signs = ((hashes >> np.uint64(bit)) & np.uint64(1)).astype(np.float64) * 2 - 1
+            votes = np.bincount(entry_doc, weights=weight * signs, minlength=n_docs)
+            signature |= (votes > 0).astype(np.uint64) << np.uint64(bit)
+        return signature
+
+    def _near_duplicates(self, signature, max_bits: int = NEAR_DUPLICATE_BITS):
+        """Doc index pairs whose signatures differ in at most max_bits bits"""
+        np = self.np
+        pairs = set()
+        for band in range(4):
+            values = (signature >> np.uint64(16 * band)) & np.uint64(0xFFFF)
+            order = np.argsort(values, kind="stable")
+            sorted_values = values[order]
+            for offset in range(1, len(order)):
+                match = sorted_values[offset:] == sorted_values[:-offset]
+                if not match.any():
+                    break
+                a, b = order[:-offset][match], order[offset:][match]
+                close = _popcount64(np, signature[a] ^ signature[b]) <= max_bits
+                pairs.update(zip(np.minimum(a, b)[close].tolist(), np.maximum(a, b)[close].tolist()))
+        return sorted(pairs)
+
+    def analyze(self, test_results) -> Dict[str, Any]:
+        """Per-response similarity fields keyed by (test_id, system), plus run-level output"""
+        np = self.np
+        test_index, system_index = {}, {}
+        texts, doc_test, doc_system = [], [], []
+        for result in test_results:
+            for system_name, response in result["responses"].items():
+                if response_status(response) == "ok":
+                    texts.append(response["response"])
+                    doc_test.append(test_index.setdefault(result["test_id"], len(test_index)))
+                    doc_system.append(system_index.setdefault(system_name, len(system_index)))
+        if not texts:
+            return {"responses": {}, "matrices": {}, "near_duplicates": []}
+        test_ids, system_names = list(test_index), list(system_index)
+
+        doc_test = np.array(doc_test, dtype=np.int64)
+        doc_system = np.array(doc_system, dtype=np.int64)
+        entry_doc, entry_feature, weight, feature_hash = self._vectorize(texts)
+        similarity = self._test_similarity(entry_doc, entry_feature, weight, doc_test, doc_system,
+                                           len(test_ids), len(system_names))
+
+        present = np.zeros((len(test_ids), len(system_names)), dtype=bool)
+        present[doc_test, doc_system] = True
+        peers = present.sum(axis=1, keepdims=True) - 1
+        agreement = np.where(present & (peers > 0),
+                             (similarity.sum(axis=2) - 1) / np.maximum(peers, 1), np.nan)
+
+        signature = self._simhash(entry_doc, entry_feature, weight, feature_hash, len(texts))
+        labels = [(test_ids[t], system_names[sys]) for t, sys in zip(doc_test.tolist(), doc_system.tolist())]
+        has_text = np.bincount(entry_doc, minlength=len(texts)) > 0
+        duplicates = [(labels[a], labels[b]) for a, b in self._near_duplicates(signature)
+                      if has_text[a] and has_text[b]]
+
+        responses = {}
+        for t, sys in zip(doc_test.tolist(), doc_system.tolist()):
+            row = {system_names[j]: round(float(similarity[t, sys, j]), 4)
+                   for j in np.flatnonzero(present[t]).tolist() if j != sys}
+            responses[(test_ids[t], system_names[sys])] = {
+                "agreement": None if np.isnan(agreement[t, sys]) else round(float(agreement[t, sys]), 4),
+                "peers": row,
+                "near_duplicates": []
+            }
+        for first, second in duplicates:
+            responses[first]["near_duplicates"].append("/".join(second))
+            responses[second]["near_duplicates"].append("/".join(first))
+
+        matrices = {
+            test_ids[t]: {system_names[i]: {system_names[j]: round(float(similarity[t, i, j]), 4)
+                                             for j in np.flatnonzero(present[t]).tolist()}
+                          for i in np.flatnonzero(present[t]).tolist()}
+            for t in range(len(test_ids))
+        }
+        return {"responses": responses, "matrices": matrices,
+                "near_duplicates": [["/".join(a), "/".join(b)] for a, b in duplicates]}
+
+
+# ============================================================================
+# RESULT JOURNAL
+# ============================================================================
+
+class ResultJournal:
+    """Append-only JSONL log with one line per completed (test, system) pair
+
+    Each record is flushed and fsynced as soon as it arrives, so a crash or
+    Ctrl-C loses at most the requests still in flight. A truncated last line
+    left by an interrupted write is ignored when reading. If a pair appears
+    more than once (e.g. an error retried on resume) the latest record wins.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Terminate a partial line from a crashed run before appending
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+            if needs_newline:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def _parse(line: bytes) -> Dict[str, Any]:
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    @classmethod
+    def read_records(cls, path: str):
+        """Yield every readable record of a journal file in file order, without opening it for append"""
+        with open(path, "rb") as f:
+            for line in f:
+                record = cls._parse(line)
+                if record is not None:
+                    yield record
+
+    def iter_records(self):
+        """Yield every readable record in file order"""
+        return self.read_records(self.path)
+
+    def completed_pairs(self) -> set:
+        """(test_id, system) pairs whose latest record succeeded
+
+        Skipped pairs are not done: a system that was unavailable (e.g. no
+        API key) gets them on resume, and skips them again cheaply otherwise.
+        """
+        latest = {}
+        for record in self.iter_records():
+            latest[(record["test_id"], record["system"])] = response_status(record["response"])
+        return {pair for pair, status in latest.items() if status == "ok"}
+
+    def _index(self) -> Dict[str, Any]:
+        """Map test_id -> [seq, {system: byte offset of its latest record}]"""
+        index = {}
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                record = self._parse(line)
+                if record is not None:
+                    entry = index.setdefault(record["test_id"], [record.get("seq", 0), {}])
+                    entry[1][record["system"]] = offset
+                offset += len(line)
+        return index
+
+    def count_tests(self) -> int:
+        return len(self._index())
+
+    def update(self, updates: Dict[Any, Dict[str, Any]]):
+        """Append amended copies of records
+
+        `updates` maps (test_id, system) to fields merged into that pair's
+        latest response; the appended copy then supersedes the original.
+        """
+        index = self._index()
+        with open(self.path, "rb") as f:
+            for (test_id, system_name), fields in updates.items():
+                offset = index.get(test_id, [0, {}])[1].get(system_name)
+                if offset is None:
+                    continue
+                f.seek(offset)
+                record = json.loads(f.readline())
+                record["response"].update(fields)
+                self.append(record)
+
+    def iter_test_results(self, system_order: List[str] = None):
+        """Yield one grouped test result at a time, in run order
+
+        Only the byte offsets are held in memory; each test's records are
+        read back from disk as it is yielded.
+        """
+        rank = {name: i for i, name in enumerate(system_order or [])}
+        index = self._index()
+        with open(self.path, "rb") as f:
+            for test_id, (seq, offsets) in sorted(index.items(), key=lambda item: item[1][0]):
+                test_result = None
+                for system_name in sorted(offsets, key=lambda name: rank.get(name, len(rank))):
+                    f.seek(offsets[system_name])
+                    record = json.loads(f.readline())
+                    if test_result is None:
+                        test_result = {
+                            "test_id": record["test_id"],
+                            "prompt": record["prompt"],
+                            "category": record["category"],
+                            "timestamp": record["timestamp"],
+                            "responses": {}
+                        }
+                    test_result["responses"][system_name] = record["response"]
+                yield test_result
+
+
+def merge_journals(paths: List[str], output: str) -> ResultJournal:
+    """Combine journals (e.g. from sharded runs) into a new journal at `output`
+
+    For each (test, system) pair a successful record beats a failed one,
+    which beats a skipped one (e.g. from a shard run without that system's
+    API key); the newest wins among equals. Tests are ordered by input
+    journal, then by their run order within it. Only offsets are held in
+    memory.
+    """
+    status_rank = {"ok": 2, "error": 1, "skipped": 0}
+    chosen = {}
+    test_order = {}
+    for source, path in enumerate(paths):
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                record = ResultJournal._parse(line)
+                if record is not None:
+                    test_order.setdefault(record["test_id"], (source, record.get("seq", 0)))
+                    rank = (status_rank[response_status(record["response"])], record.get("timestamp", ""))
+                    pair = (record["test_id"], record["system"])
+                    if pair not in chosen or rank >= chosen[pair][0]:
+                        chosen[pair] = (rank, source, offset)
+                offset += len(line)
+
+    new_seq = {test_id: i + 1 for i, test_id in enumerate(sorted(test_order, key=test_order.get))}
+    journal = ResultJournal(output)
+    files = [open(path, "rb") for path in paths]
+    try:
+        for (test_id, _), (_, source, offset) in sorted(chosen.items(), key=lambda item: new_seq[item[0][0]]):
+            files[source].seek(offset)
+            record = json.loads(files[source].readline())
+            record["seq"] = new_seq[test_id]
+            journal.append(record)
+    finally:
+        for f in files:
+            f.close()
+
+    print(f"🔗 Merged {len(paths)} journals: {len(test_order)} tests, {len(chosen)} (test, system) pairs -> {output}")
+    return journal
+
+
+# ============================================================================
+# SUMMARY TABLES
+# ============================================================================
+
+STATUS_CODES = {"ok": 0, "error": 1, "skipped": 2}
+SUMMARY_GROUPINGS = {
+    "system": ("system",),
+    "category": ("system", "category"),
+    "test": ("test", "system"),
+}
+SUMMARY_COLUMNS = [
+    ("rows", "Rows", "{:.0f}"),
+    ("error_rate", "Errors", "{:.1%}"),
+    ("skip_rate", "Skipped", "{:.1%}"),
+    ("latency_p50", "p50 (s)", "{:.2f}"),
+    ("latency_p95", "p95 (s)", "{:.2f}"),
+    ("latency_p99", "p99 (s)", "{:.2f}"),
+    ("ttft_p50", "TTFT p50 (s)", "{:.2f}"),
+    ("output_tokens", "Output tokens", "{:.0f}"),
+    ("tokens_per_sec", "Tokens/sec", "{:.1f}"),
+    ("mean_score", "Mean score", "{:.2f}"),
+    ("pass_rate", "Hidden tests passed", "{:.1%}"),
+    ("mean_agreement", "Agreement", "{:.2f}"),
+]
+
+
+class ResultTable:
+    """Columnar copy of journal records for fast group-by summaries (needs numpy)
+
+    Records are read once into typed arrays (one per field, with test,
+    system and category stored as integer codes), so aggregating millions
+    of rows costs a few sorts and bincounts instead of a Python loop per
+    group. When a (test, system) pair appears more than once the latest
+    record wins, as in ResultJournal.
+    """
+
+    FLOAT_FIELDS = ("time", "ttft", "output_tokens", "score", "passed", "total", "agreement")
+
+    def __init__(self, records):
+        import numpy  # optional dependency; callers check for ImportError
+
+        self.np = np = numpy
+        labels = {"test": {}, "system": {}, "category": {}}
+        codes = {name: array.array("q") for name in labels}
+        status = array.array("b")
+        untimed = array.array("b")
+        floats = {name: array.array("d") for name in self.FLOAT_FIELDS}
+        nan = float("nan")
+
+        for record in records:
+            response = record["response"]
+            for name, key in (("test", "test_id"), ("system", "system"), ("category", "category")):
+                value = record.get(key) or ""
+                codes[name].append(labels[name].setdefault(value, len(labels[name])))
+            status.append(STATUS_CODES[response_status(response)])
+            # Cache hits and batch results have no comparable request latency
+            untimed.append(bool(response.get("cached") or response.get("batch")))
+            scoring = response.get("scoring") or {}
+            similarity = response.get("similarity") or {}
+            values = {
+                "time": response.get("time"),
+                "ttft": (response.get("stream") or {}).get("ttft"),
+                # Never the provider total: that includes the prompt
+                "output_tokens": response.get("output_tokens"),
+                "score": scoring.get("score"),
+                "passed": scoring.get("passed"),
+                "total": scoring.get("total"),
+                "agreement": similarity.get("agreement"),
+            }
+            for name, value in values.items():
+                floats[name].append(nan if value is None else float(value))
+
+        self.labels = {name: list(mapping) for name, mapping in labels.items()}
+        columns = {name: np.frombuffer(column, dtype=np.int64) if len(column) else np.zeros(0, dtype=np.int64)
+                   for name, column in codes.items()}
+        columns["status"] = np.frombuffer(status, dtype=np.int8) if len(status) else np.zeros(0, dtype=np.int8)
+        columns["untimed"] = np.frombuffer(untimed, dtype=np.int8).astype(bool) if len(untimed) else np.zeros(0, dtype=bool)
+        for name, column in floats.items():
+            columns[name] = np.frombuffer(column, dtype=np.float64) if len(column) else np.zeros(0)
+
+        # Latest record per (test, system): first occurrence in reverse order
+        pair = columns["test"] * max(len(self.labels["system"]), 1) + columns["system"]
+        _, last = np.unique(pair[::-1], return_index=True)
+        keep = np.sort(len(pair) - 1 - last)
+        self.columns = {name: column[keep] for name, column in columns.items()}
+
+    @classmethod
+    def from_journals(cls, paths: List[str]) -> "ResultTable":
+        """Load journal files in order; later files supersede earlier ones for the same pair"""
+        return cls(record for path in paths for record in ResultJournal.read_records(path))
+
+    @classmethod
+    def from_results(cls, test_results) -> "ResultTable":
+        """Load grouped test results such as EvaluationRunner.iter_results()"""
+        return cls(
+            {"test_id": result["test_id"], "category": result["category"], "system": system_name,
+             "response": response}
+            for result in test_results
+            for system_name, response in result["responses"].items()
+        )
+
+    def __len__(self) -> int:
+        return len(self.columns["status"])
+
+    def _percentiles(self, group, values, n_groups: int, pcts):
+        """Linear-interpolated percentiles of `values` per group, ignoring NaN"""
+        np = self.np
+        finite = ~np.isnan(values)
+        group, values = group[finite], values[finite]
+        order = np.lexsort((values, group))
+        values = values[order]
+        counts = np.bincount(group, minlength=n_groups)
+        starts = np.cumsum(counts) - counts
+        results = []
+        for pct in pcts:
+            rank = (counts - 1).clip(min=0) * pct / 100.0
+            lower = np.floor(rank).astype(np.int64)
+            upper = np.minimum(lower + 1, (counts - 1).clip(min=0))
+            if len(values):
+                low = values[(starts + lower).clip(max=len(values) - 1)]
+                high = values[(starts + upper).clip(max=len(values) - 1)]
+                result = low + (high - low) * (rank - lower)
+            else:
+                result = np.zeros(n_groups)
+            results.append(np.where(counts > 0, result, np.nan))
+        return results
+
+    def aggregate(self, by) -> List[Dict[str, Any]]:
+        """One row of summary statistics per distinct combination of the `by` columns"""
+        np = self.np
+        columns = self.columns
+        if not len(self):
+            return []
+        keys = [columns[name] for name in by]
+        dims = [max(len(self.labels[name]), 1) for name in by]
+        unique_keys, group = np.unique(np.ravel_multi_index(keys, dims), return_inverse=True)
+        group = group.ravel()
+        n = len(unique_keys)
+
+        def total(weights=None, mask=None):
+            if mask is not None:
+                weights = mask.astype(np.float64) if weights is None else np.where(mask, weights, 0.0)
+            return np.bincount(group, weights=weights, minlength=n)
+
+        def mean(values):
+            finite = ~np.isnan(values)
+            count = total(mask=finite)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, total(np.where(finite, values, 0.0)) / np.maximum(count, 1), np.nan)
+
+        ok = columns["status"] == 0
+        timed = ok & ~columns["untimed"]
+        rows = total()
+        latency = np.where(timed, columns["time"], np.nan)
+        p50, p95, p99 = self._percentiles(group, latency, n, (50, 95, 99))
+        ttft_p50, = self._percentiles(group, np.where(timed, columns["ttft"], np.nan), n, (50,))
+
+        counted = ok & ~np.isnan(columns["output_tokens"])
+        tokens = np.where(timed & counted, columns["output_tokens"], 0.0)
+        token_time = total(np.where(tokens > 0, columns["time"], 0.0))
+        passed = total(np.nan_to_num(columns["passed"]))
+        hidden = total(np.nan_to_num(columns["total"]))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats = {
+                "rows": rows,
+                "error_rate": total(mask=columns["status"] == 1) / rows,
+                "skip_rate": total(mask=columns["status"] == 2) / rows,
+                "latency_p50": p50,
+                "latency_p95": p95,
+                "latency_p99": p99,
+                "ttft_p50": ttft_p50,
+                "output_tokens": np.where(total(mask=counted) > 0,
+                                          total(np.where(counted, columns["output_tokens"], 0.0)), np.nan),
+                "tokens_per_sec": np.where(token_time > 0, total(tokens) / token_time, np.nan),
+                "mean_score": mean(columns["score"]),
+                "pass_rate": np.where(hidden > 0, passed / hidden, np.nan),
+                "mean_agreement": mean(columns["agreement"]),
+            }
+
+        # Converted column-wise; only the final dicts are built per row
+        fields = {name: [self.labels[name][code] for code in codes.tolist()]
+                  for name, codes in zip(by, np.unravel_index(unique_keys, dims))}
+        for name, values in stats.items():
+            fields[name] = [None if value != value else value for value in values.tolist()]
+        fields["rows"] = [int(value) for value in fields["rows"]]
+        return [dict(zip(fields, row)) for row in zip(*fields.values())]
+
+    @staticmethod
+    def markdown_table(summary: List[Dict[str, Any]], by) -> List[str]:
+        """Markdown lines for aggregate rows, omitting columns that are empty throughout
+
+        One line per table row, to be joined with single newlines; callers
+        leave a blank line before the header.
+        """
+        columns = [c for c in SUMMARY_COLUMNS if any(row[c[0]] is not None for row in summary)]
+        lines = [
+            "| " + " | ".join(name.title() for name in by) + " | " + " | ".join(c[1] for c in columns) + " |",
+            "|" + "|".join("-" * (len(name) + 2) for name in by) + "|"
+            + "|".join("-" * (len(c[1]) + 2) for c in columns) + "|"
+        ]
+        for row in summary:
+            cells = ["-" if row[key] is None else fmt.format(row[key]) for key, _, fmt in columns]
+            lines.append("| " + " | ".join(str(row[name]) for name in by) + " | " + " | ".join(cells) + " |")
+        return lines
+
+    def save_summary(self, prefix: str = None, parquet: bool = False) -> List[str]:
+        """Write markdown and per-grouping CSV summaries (plus the rows as Parquet); returns file names"""
+        prefix = prefix or f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        files = []
+
+        markdown = [
+            "# Evaluation Summary",
+            f"\n**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"\n**Results:** {len(self)} across {len(self.labels['test'])} tests",
+            "\n---\n"
+        ]
+        for grouping, by in SUMMARY_GROUPINGS.items():
+            summary = self.aggregate(by)
+            filename = f"{prefix}_by_{grouping}.csv"
+            with open(filename, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(by) + [c[0] for c in SUMMARY_COLUMNS])
+                writer.writeheader()
+                writer.writerows(summary)
+            files.append(filename)
+            # Per-test rows only go to CSV; they would swamp the markdown
+            if grouping != "test":
+                markdown.append(f"\n## By {' and '.join(by)}\n")
+                markdown.extend(self.markdown_table(summary, by))
+                markdown.append("\n\n---\n")
+
+        filename = f"{prefix}.md"
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("\n".join(markdown))
+        files.insert(0, filename)
+
+        if parquet:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                print("⚠️  pyarrow not installed (pip install pyarrow). Skipping Parquet export.")
+            else:
+                columns = dict(self.columns)
+                for name in ("test", "system", "category"):
+                    columns[name] = pyarrow.DictionaryArray.from_arrays(
+                        columns[name].astype(self.np.int32), self.labels[name] or [""])
+                columns["status"] = pyarrow.DictionaryArray.from_arrays(
+                    columns["status"].astype(self.np.int32), list(STATUS_CODES))
+                filename = f"{prefix}.parquet"
+                pyarrow.parquet.write_table(pyarrow.table(columns), filename)
+                files.append(filename)
+        return files
+
+
+# ============================================================================
+# ASYNC EXECUTION ENGINE
+# ============================================================================
+
+class AsyncEvaluationEngine:
+    """Runs (test, system) queries concurrently with a bounded in-flight limit
+
+    The interfaces use blocking SDKs, so each query runs on a worker thread
+    while asyncio schedules them. Results are assembled in the same
+    test/system order as a serial run.
+    """
+
+    def __init__(self, runner: "EvaluationRunner", concurrency: int):
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+
+    def run(self, test_cases) -> List[Dict[str, Any]]:
+        """Run all test cases and return their results in input order
+
+        `test_cases` may be any iterable; it is consumed lazily, keeping only
+        about `concurrency` tests scheduled at a time. With a journal the
+        results go straight to disk and the returned list is empty.
+        """
+        # Imported here because asyncio dominates startup time for serial runs and listings
+        import asyncio
+
+        return asyncio.run(self._run_all(test_cases))
+
+    async def _run_all(self, test_cases) -> List[Dict[str, Any]]:
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        runner = self.runner
+        test_results = []
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            async def run_pair(test_case: Dict[str, Any], seq: int, test_result: Dict[str, Any],
+                               system: AISystemInterface):
+                async with semaphore:
+                    response = await loop.run_in_executor(
+                        executor, runner._query_system, system, test_case["prompt"]
+                    )
+                if runner.verbose:
+                    print(f"🤖 {test_case['id']} / {system.name} done")
+                runner._print_response(response)
+                runner._record(test_result, seq, system, response)
+
+            async def run_test(test_case: Dict[str, Any], seq: int, test_result: Dict[str, Any]):
+                await asyncio.gather(*[
+                    run_pair(test_case, seq, test_result, system)
+                    for system in runner._pending_systems(test_case)
+                ])
+
+            scheduled = set()
+            for test_case in test_cases:
+                seq, test_result = runner._next_seq(), runner._new_test_result(test_case)
+                if runner.journal is None:
+                    test_results.append((seq, test_result))
+                # Keep the semaphore fed without materialising the whole corpus
+                while len(scheduled) >= self.concurrency:
+                    done, scheduled = await asyncio.wait(scheduled, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                scheduled.add(asyncio.ensure_future(run_test(test_case, seq, test_result)))
+            await asyncio.gather(*scheduled)
+
+        # Fill responses in system order so each record matches a serial run
+        ordered = []
+        for seq, test_result in test_results:
+            responses = test_result["responses"]
+            test_result["responses"] = {
+                system.name: responses[system.name] for system in runner.systems if system.name in responses
+            }
+            if test_result["responses"]:
+                ordered.append(test_result)
+        return ordered
+
+
+# ============================================================================
+# BATCH SUBMISSION
+# ============================================================================
+
+BATCH_SIZE = 1000
+BATCH_POLL_INTERVAL = 5.0
+BATCH_POLL_MAX_INTERVAL = 60.0
+BATCH_TIMEOUT = 24 * 3600
+
+
+class BatchRunner:
+    """Runs tests as one batch job per provider instead of individual calls
+
+    Tests are taken `batch_size` at a time. For each chunk, every system
+    with a batch API gets a single job, and the jobs are polled together,
+    with the interval growing up to BATCH_POLL_MAX_INTERVAL. Systems
+    without a batch API are queried normally, through the runner, while
+    the jobs run. Results go through the runner's journal and token
+    counter like any other response. They carry a "batch" entry; their
+    "time" is the provider's per-request processing time where reported,
+    otherwise 0. A job that fails records every one of its pairs as an
+    error, so `--resume` picks them up again. A job that times out is
+    cancelled and its pairs are recorded as errors naming the batch; on
+    `--resume` the requests it finished are collected from that batch and
+    only the rest are submitted again.
+    """
+
+    def __init__(self, runner: "EvaluationRunner", batch_size: int = BATCH_SIZE,
+                 poll_interval: float = BATCH_POLL_INTERVAL, timeout: float = BATCH_TIMEOUT):
+        self.runner = runner
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.batches = []
+        self.timed_out = self._timed_out_pairs()
+
+    def _timed_out_pairs(self) -> Dict[tuple, Dict[str, Any]]:
+        """(test_id, system) -> batch entry of pairs whose latest record is a timed-out batch"""
+        if self.runner.journal is None:
+            return {}
+        latest = {}
+        for record in self.runner.journal.iter_records():
+            batch = record["response"].get("batch") or {}
+            latest[(record["test_id"], record["system"])] = batch if batch.get("timed_out") else None
+        return {pair: batch for pair, batch in latest.items() if batch}
+
+    def run(self, test_cases):
+        batchable = [s for s in self.runner.systems if s.available and s.supports_batch]
+        interactive = [s for s in self.runner.systems if s not in batchable]
+        print(f"\n📦 Batch mode: {', '.join(s.name for s in batchable) or 'no systems'} "
+              f"(up to {self.batch_size} tests per job)")
+        if interactive:
+            print(f"   Queried individually: {', '.join(s.name for s in interactive)}")
+
+        chunk = []
+        for test_case in test_cases:
+            chunk.append((self.runner._next_seq(), test_case))
+            if len(chunk) >= self.batch_size:
+                self._run_chunk(chunk, batchable, interactive)
+                chunk = []
+        if chunk:
+            self._run_chunk(chunk, batchable, interactive)
+
+    def _run_chunk(self, chunk, batchable: List[AISystemInterface], interactive: List[AISystemInterface]):
+        runner = self.runner
+        test_results = {seq: runner._new_test_result(test_case) for seq, test_case in chunk}
+        jobs = []
+        for system in batchable:
+            pending = [(seq, test_case) for seq, test_case in chunk
+                       if (test_case["id"], system.name) not in runner.completed]
+            recovered = self._recover(system, pending, test_results)
+            # Provider custom IDs allow only [A-Za-z0-9_-], so test IDs are not used directly
+            requests = {f"req-{seq}": (seq, test_case) for seq, test_case in pending if seq not in recovered}
+            if not requests:
+                continue
+            job = {"system": system, "requests": requests, "id": None, "status": "failed",
+                   "submitted": time.perf_counter(), "error": None}
+            try:
+                job["id"] = system.submit_batch([{"custom_id": custom_id, "prompt": test_case["prompt"]}
+                                                 for custom_id, (_, test_case) in requests.items()])
+                job["status"] = "submitted"
+                print(f"   📤 {system.name}: submitted {len(requests)} requests as batch {job['id']}")
+            except Exception as e:
+                job["error"] = f"batch submission failed: {e}"
+                print(f"   ❌ {system.name}: {job['error']}")
+            jobs.append(job)
+
+        if interactive:
+            pairs = [(seq, test_case, system) for seq, test_case in chunk for system in interactive
+                     if (test_case["id"], system.name) not in runner.completed]
+            with ThreadPoolExecutor(max_workers=runner.concurrency) as pool:
+                responses = pool.map(lambda pair: runner._query_system(pair[2], pair[1]["prompt"]), pairs)
+                for (seq, _, system), response in zip(pairs, responses):
+                    runner._record(test_results[seq], seq, system, response)
+
+        self._wait(jobs)
+        for job in jobs:
+            self._collect(job, test_results)
+
+        if runner.journal is None:
+            runner.results.extend(test_results[seq] for seq, _ in chunk if test_results[seq]["responses"])
+
+    def _recover(self, system: AISystemInterface, pending, test_results: Dict[int, Dict[str, Any]]) -> set:
+        """Record successful results of earlier timed-out batches; returns the seqs recovered"""
+        earlier = {}
+        for seq, test_case in pending:
+            batch = self.timed_out.get((test_case["id"], system.name))
+            if batch and batch.get("custom_id"):
+                earlier.setdefault(batch["id"], {})[batch["custom_id"]] = (seq, test_case)
+
+        recovered = set()
+        for batch_id, requests in earlier.items():
+            try:
+                if not system.batch_status(batch_id)["done"]:
+                    print(f"   ⚠️  {system.name}: batch {batch_id} has not ended yet, resubmitting its requests")
+                    continue
+                results = system.batch_results(batch_id)
+            except Exception as e:
+                print(f"   ⚠️  {system.name}: recovering batch {batch_id} failed: {e}")
+                continue
+            for custom_id, (seq, test_case) in requests.items():
+                response = results.get(custom_id)
+                if response is None or response_status(response) != "ok":
+                    continue
+                response["batch"] = {"id": batch_id, "custom_id": custom_id, "size": len(requests),
+                                     "turnaround": None, "recovered": True}
+                self.runner.token_counter.fill(response, test_case["prompt"], system.model)
+                self.runner._record(test_results[seq], seq, system, response)
+                recovered.add(seq)
+            print(f"   ♻️  {system.name}: recovered {sum(seq in recovered for seq, _ in requests.values())}"
+                  f"/{len(requests)} results from timed-out batch {batch_id}")
+        return recovered
+
+    def _wait(self, jobs: List[Dict[str, Any]]):
+        """Poll submitted jobs until all are done or the timeout passes"""
+        started = time.perf_counter()
+        interval = self.poll_interval
+        pending = [job for job in jobs if job["id"] is not None]
+        while pending:
+            if time.perf_counter() - started > self.timeout:
+                for job in pending:
+                    job["error"] = f"batch {job['id']} still {job['status']} after {self.timeout:.0f}s"
+                    job["timed_out"] = True
+                    try:
+                        job["system"].cancel_batch(job["id"])
+                        print(f"   🛑 {job['system'].name}: cancelled batch {job['id']} after {self.timeout:.0f}s")
+                    except Exception as e:
+                        print(f"   ⚠️  {job['system'].name}: cancelling batch {job['id']} failed: {e}")
+                return
+            time.sleep(interval)
+            interval = min(interval * 1.5, BATCH_POLL_MAX_INTERVAL)
+            for job in list(pending):
+                try:
+                    status = job["system"].batch_status(job["id"])
+                except Exception as e:
+                    # Transient polling failures are retried on the next round
+                    print(f"   ⚠️  {job['system'].name}: polling batch {job['id']} failed: {e}")
+                    continue
+                job["status"] = status["status"]
+                print(f"   ⏳ {job['system'].name}: {status['completed']}/{status['total']} ({status['status']})")
+                if status["done"]:
+                    pending.remove(job)
+
+    def _collect(self, job: Dict[str, Any], test_results: Dict[int, Dict[str, Any]]):
+        runner = self.runner
+        system = job["system"]
+        results = {}
+        if job["error"] is None:
+            try:
+                results = system.batch_results(job["id"])
+            except Exception as e:
+                job["error"] = f"fetching batch results failed: {e}"
+        turnaround = round(time.perf_counter() - job["submitted"], 3)
+
+        for custom_id, (seq, test_case) in job["requests"].items():
+            response = results.get(custom_id)
+            if response is None:
+                response = system._error(job["error"] or f"no result in batch {job['id']} ({job['status']})")
+            response["batch"] = {"id": job["id"], "custom_id": custom_id, "size": len(job["requests"]),
+                                 "turnaround": turnaround}
+            if job.get("timed_out"):
+                response["batch"]["timed_out"] = True
+            runner.token_counter.fill(response, test_case["prompt"], system.model)
+            runner._record(test_results[seq], seq, system, response)
+
+        succeeded = sum(response_status(r) == "ok" for r in results.values())
+        print(f"   📥 {system.name}: {succeeded}/{len(job['requests'])} succeeded in batch {job['id']} "
+              f"({turnaround:.1f}s)")
+        self.batches.append({"system": system.name, "id": job["id"], "status": job["status"],
+                             "requests": len(job["requests"]), "succeeded": succeeded,
+                             "turnaround": turnaround, "error": job["error"]})
+
+
+# ============================================================================
+# LOAD TESTING
+# ============================================================================
+
+# A concurrency step counts as saturated when it adds less than this much
+# throughput over the previous step, doubles the first step's p95 latency,
+# or fails more than this share of requests
+SATURATION_MIN_GAIN = 0.10
+SATURATION_P95_FACTOR = 2.0
+SATURATION_MAX_ERROR_RATE = 0.05
+
+
+class LoadTester:
+    """Drives virtual users against one system to find its capacity
+
+    Each step runs `users` virtual users for `ramp_up + duration` seconds.
+    In the closed-loop model every user sends its next request when the
+    previous one returns (plus think time). In the open-loop model requests
+    arrive as a Poisson process at `users * rate` per second regardless of
+    completions, and latency is measured from the scheduled arrival so
+    queueing delay is not hidden. Only requests started after ramp-up count
+    towards the step's statistics; `metrics`, when given, sees every request.
+    """
+
+    def __init__(self, system: AISystemInterface, user_steps: List[int], arrival: str = "closed",
+                 rate: float = 0.5, think_time: float = 0.0, ramp_up: float = 10.0,
+                 duration: float = 60.0, seed: int = 0, metrics: "EvaluationMetrics" = None):
+        self.system = system
+        self.user_steps = user_steps
+        self.arrival = arrival
+        self.rate = rate
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.duration = duration
+        self.seed = seed
+        self.metrics = metrics
+        self.tests = [(category, test["prompt"]) for category, tests in TEST_PROMPTS.items() for test in tests]
+        self.steps = []
+
+    def _send(self, test: tuple, scheduled: float, samples: List[Dict[str, Any]], lock: threading.Lock):
+        category, prompt = test
+        if self.metrics:
+            self.metrics.in_flight.inc(system=self.system.name)
+        started = time.perf_counter()
+        try:
+            response = self.system.query(prompt)
+        finally:
+            if self.metrics:
+                self.metrics.in_flight.dec(system=self.system.name)
+        finished = time.perf_counter()
+        if self.metrics:
+            self.metrics.observe_response(self.system.name, category, response)
+        with lock:
+            samples.append({
+                "scheduled": scheduled,
+                "started": started,
+                "finished": finished,
+                "latency": finished - scheduled,
+                "ok": response_status(response) == "ok"
+            })
+
+    def _run_closed(self, users: int, start: float, end: float, samples, lock):
+        def virtual_user(index: int):
+            rng = random.Random(self.seed * 7919 + index)
+            time.sleep(self.ramp_up * index / users)
+            while time.perf_counter() < end:
+                self._send(rng.choice(self.tests), time.perf_counter(), samples, lock)
+                if self.think_time:
+                    time.sleep(rng.expovariate(1.0 / self.think_time))
+
+        threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_open(self, users: int, start: float, end: float, samples, lock):
+        rng = random.Random(self.seed)
+        target_rate = users * self.rate
+        # Bound in-flight requests so an overloaded server cannot exhaust threads
+        with ThreadPoolExecutor(max_workers=max(4, users * 4)) as executor:
+            next_arrival = start
+            while True:
+                next_arrival += rng.expovariate(target_rate)
+                if next_arrival >= end:
+                    break
+                # Thin arrivals during ramp-up so the rate climbs linearly to the target
+                if self.ramp_up and rng.random() > (next_arrival - start) / self.ramp_up:
+                    continue
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._send, rng.choice(self.tests), next_arrival, samples, lock)
+
+    def run_step(self, users: int) -> Dict[str, Any]:
+        print(f"\n📈 {users} virtual users ({self.arrival}-loop): "
+              f"{self.ramp_up:.0f}s ramp-up + {self.duration:.0f}s soak")
+        samples = []
+        lock = threading.Lock()
+        start = time.perf_counter()
+        steady_start = start + self.ramp_up
+        end = steady_start + self.duration
+
+        if self.arrival == "open":
+            self._run_open(users, start, end, samples, lock)
+        else:
+            self._run_closed(users, start, end, samples, lock)
+
+        steady = [sample for sample in samples if sample["started"] >= steady_start] or samples
+        latencies = [sample["latency"] for sample in steady if sample["ok"]]
+        errors = sum(1 for sample in steady if not sample["ok"])
+        # Throughput counts completions inside the soak window only, so a
+        # backlog drained after the deadline does not inflate it
+        completed = sum(1 for sample in samples
+                        if sample["ok"] and steady_start <= sample["finished"] <= end)
+
+        step = {
+            "users": users,
+            "requests": len(steady),
+            "errors": errors,
+            "error_rate": errors / len(steady) if steady else 0.0,
+            "throughput": completed / self.duration if self.duration else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99)
+        }
+        print(f"   {step['requests']} requests | {step['throughput']:.2f} req/s | "
+              f"p95 {step['p95'] or 0:.2f}s | errors {step['error_rate']:.1%}")
+        return step
+
+    def run(self) -> List[Dict[str, Any]]:
+        print(f"\n🔥 Load testing {self.system.name}: steps {self.user_steps}")
+        self.steps = [self.run_step(users) for users in self.user_steps]
+        return self.steps
+
+    def saturation_point(self) -> Dict[str, Any]:
+        """Highest step worth running before throughput stops scaling"""
+        if not self.steps:
+            return None
+        base_p95 = self.steps[0]["p95"]
+        for previous, step in zip(self.steps, self.steps[1:]):
+            reasons = []
+            if step["throughput"] < previous["throughput"] * (1 + SATURATION_MIN_GAIN):
+                reasons.append(f"throughput gain < {SATURATION_MIN_GAIN:.0%}")
+            if base_p95 and step["p95"] and step["p95"] > base_p95 * SATURATION_P95_FACTOR:
+                reasons.append(f"p95 > {SATURATION_P95_FACTOR:g}x baseline")
+            if step["error_rate"] > SATURATION_MAX_ERROR_RATE:
+                reasons.append(f"error rate > {SATURATION_MAX_ERROR_RATE:.0%}")
+            if reasons:
+                return {"users": previous["users"], "throughput": previous["throughput"],
+                        "next_step_users": step["users"], "reasons": reasons}
+        return None
+
+    def summary_lines(self) -> List[str]:
+        def fmt(value: float) -> str:
+            return f"{value:.2f}s" if value is not None else "-"
+
+        lines = [
+            f"# Load Test: {self.system.name}",
+            f"\n**Arrival model:** {self.arrival}-loop | **Ramp-up:** {self.ramp_up:.0f}s | "
+            f"**Soak:** {self.duration:.0f}s per step",
+            "\n| Users | Requests | Throughput (req/s) | p50 | p95 | p99 | Error rate |",
+            "|-------|----------|--------------------|-----|-----|-----|------------|"
+        ]
+        for step in self.steps:
+            lines.append(
+                f"| {step['users']} | {step['requests']} | {step['throughput']:.2f} "
+                f"| {fmt(step['p50'])} | {fmt(step['p95'])} | {fmt(step['p99'])} | {step['error_rate']:.1%} |"
+            )
+
+        saturation = self.saturation_point()
+        if saturation:
+            lines.append(
+                f"\n**Saturation point:** ~{saturation['users']} concurrent users "
+                f"({saturation['throughput']:.2f} req/s); at {saturation['next_step_users']} users: "
+                f"{', '.join(saturation['reasons'])}"
+            )
+        else:
+            lines.append("\n**Saturation point:** not reached in the tested range")
+        return lines
+
+    def save_results(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "metadata": {
+                    "timestamp": datetime.now().isoformat(),
+                    "system": self.system.name,
+                    "arrival": self.arrival,
+                    "rate_per_user": self.rate if self.arrival == "open" else None,
+                    "think_time": self.think_time if self.arrival == "closed" else None,
+                    "ramp_up": self.ramp_up,
+                    "duration": self.duration
+                },
+                "steps": self.steps,
+                "saturation": self.saturation_point()
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"\n✅ Load test results saved to: {filename}")
+        return filename
+
+
+# ============================================================================
+# BENCHMARKING
+# ============================================================================
+
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE_LEVEL = 0.95
+REGRESSION_THRESHOLD = 0.10
+
+
+def remove_outliers(values: List[float]) -> List[float]:
+    """Drop values outside Tukey's fences (1.5 x IQR beyond the quartiles)"""
+    if len(values) < 4:
+        return list(values)
+    q1, q3 = percentile(values, 25), percentile(values, 75)
+    fence = 1.5 * (q3 - q1)
+    return [v for v in values if q1 - fence <= v <= q3 + fence]
+
+
+def bootstrap_ci(values: List[float], stat=statistics.median, confidence: float = CONFIDENCE_LEVEL,
+                 resamples: int = BOOTSTRAP_RESAMPLES, seed: int = 0) -> List[float]:
+    """Percentile bootstrap confidence interval [low, high] for `stat`"""
+    if len(values) < 2:
+        return [values[0], values[0]] if values else [None, None]
+    rng = random.Random(seed)
+    estimates = [stat(rng.choices(values, k=len(values))) for _ in range(resamples)]
+    tail = (1 - confidence) / 2 * 100
+    return [percentile(estimates, tail), percentile(estimates, 100 - tail)]
+
+
+def summarize_samples(values: List[float]) -> Dict[str, Any]:
+    """Outlier-filtered mean/median/stdev with bootstrap CIs"""
+    kept = remove_outliers(values)
+    if not kept:
+        return {"n": 0, "outliers": 0}
+    return {
+        "n": len(kept),
+        "outliers": len(values) - len(kept),
+        "mean": statistics.mean(kept),
+        "median": statistics.median(kept),
+        "stdev": statistics.stdev(kept) if len(kept) > 1 else 0.0,
+        "mean_ci": bootstrap_ci(kept, statistics.mean),
+        "median_ci": bootstrap_ci(kept, statistics.median),
+        "samples": values
+    }
+
+
+class Benchmark:
+    """Repeated-trial latency/throughput benchmark with baseline comparison
+
+    Every (test, system) pair gets `warmup` discarded runs and then
+    `repeat` measured runs, issued serially so trials do not compete with
+    each other. Latency is the per-request wall time; throughput is output
+    tokens/sec (streamed decode rate when --stream is on).
+    """
+
+    def __init__(self, runner: "EvaluationRunner", repeat: int = 10, warmup: int = 2):
+        self.runner = runner
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results = {}
+
+    @staticmethod
+    def _throughput(response: Dict[str, Any]) -> float:
+        """Output tokens per second (decode rate when streamed); None when output tokens are unknown"""
+        metrics = response.get("stream") or {}
+        if metrics.get("tokens_per_sec"):
+            return metrics["tokens_per_sec"]
+        if response.get("tokens_per_sec"):
+            return response["tokens_per_sec"]
+        if response.get("time") and response.get("output_tokens"):
+            return response["output_tokens"] / response["time"]
+        return None
+
+    def run(self, test_cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+        systems = [system for system in self.runner.systems if system.available]
+        print(f"\n⏱️  Benchmark: {len(test_cases)} tests x {len(systems)} systems, "
+              f"{self.warmup} warm-up + {self.repeat} measured runs each")
+
+        for test_case in test_cases:
+            for system in systems:
+                for _ in range(self.warmup):
+                    self.runner._query_system(system, test_case["prompt"])
+
+                latencies, throughputs, errors = [], [], 0
+                for _ in range(self.repeat):
+                    response = self.runner._query_system(system, test_case["prompt"])
+                    if response_status(response) != "ok":
+                        errors += 1
+                        continue
+                    latencies.append(response["time"])
+                    throughput = self._throughput(response)
+                    if throughput is not None:
+                        throughputs.append(throughput)
+
+                entry = {
+                    "errors": errors,
+                    "latency": summarize_samples(latencies),
+                    "throughput": summarize_samples(throughputs)
+                }
+                self.results.setdefault(system.name, {})[test_case["id"]] = entry
+                latency = entry["latency"]
+                if latency["n"]:
+                    low, high = latency["median_ci"]
+                    print(f"   {test_case['id']} / {system.name}: median {latency['median']:.3f}s "
+                          f"[{low:.3f}, {high:.3f}] ({latency['outliers']} outliers, {errors} errors)")
+                else:
+                    print(f"   {test_case['id']} / {system.name}: no successful runs ({errors} errors)")
+
+        return self.results
+
+    def save_results(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "metadata": {
+                    "timestamp": datetime.now().isoformat(),
+                    "repeat": self.repeat,
+                    "warmup": self.warmup,
+                    "stream": self.runner.stream,
+                    "confidence": CONFIDENCE_LEVEL
+                },
+                "results": self.results
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"\n✅ Benchmark saved to: {filename}")
+        return filename
+
+    def compare(self, baseline_file: str, threshold: float = REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+        """Regressions against a saved benchmark
+
+        A metric regresses when its median is worse than the baseline by
+        more than `threshold` and the two median confidence intervals do
+        not overlap, so noise alone does not fail the gate.
+        """
+        with open(baseline_file, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+
+        regressions = []
+        for system_name, tests in self.results.items():
+            for test_id, entry in tests.items():
+                base_entry = baseline.get(system_name, {}).get(test_id)
+                if not base_entry:
+                    continue
+                # Latency regresses upwards, throughput downwards
+                for metric, sign in (("latency", 1), ("throughput", -1)):
+                    current, base = entry[metric], base_entry[metric]
+                    if not current.get("n") or not base.get("n"):
+                        continue
+                    change = (current["median"] - base["median"]) / base["median"] if base["median"] else 0.0
+                    separated = (current["median_ci"][0] > base["median_ci"][1] if sign > 0
+                                 else current["median_ci"][1] < base["median_ci"][0])
+                    if sign * change > threshold and separated:
+                        regressions.append({
+                            "system": system_name, "test_id": test_id, "metric": metric,
+                            "baseline": base["median"], "current": current["median"], "change": change
+                        })
+        return regressions
+
+
+# ============================================================================
+# CONTEXT-LENGTH SWEEP
+# ============================================================================
+
+CONTEXT_SWEEP_SIZES = [1000, 4000, 16000, 32000]
+CONTEXT_SEED_TASK = ("Using the code above, pick the function you consider hardest to maintain, "
+                     "explain why, and rewrite it with type hints and a docstring.")
+
+
+def load_context_lines(source: str = None) -> List[str]:
+    """Lines of real code used as padding: a .py file, a directory of them, or this script"""
+    source = source or os.path.abspath(__file__)
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(source)
+                       for name in names if name.endswith(".py"))
+    else:
+        paths = [source]
+
+    lines = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines.append(f"# File: {os.path.relpath(path, os.path.dirname(source) or '.')}\n")
+            lines.extend(f)
+    if not lines:
+        raise ValueError(f"no Python source found in {source}")
+    return lines
+
+
+def build_context_prompt(seed_task: str, target_tokens: int, lines: List[str],
+                         counter: TokenCounter, family: str = "default") -> str:
+    """Prefix the seed task with whole lines of code until the prompt reaches ~target_tokens"""
+    header = "Here is code from our repository:\n\n```python\n"
+    footer = f"```\n\n{seed_task}"
+    budget = target_tokens - counter.count(header + footer, family)[0]
+
+    # Lines repeat if the source is shorter than the target
+    context, used, i = [], 0, 0
+    while used < budget:
+        line = lines[i % len(lines)]
+        used += counter.count(line, family)[0] or 1
+        context.append(line)
+        i += 1
+    return header + "".join(context) + footer
+
+
+class ContextSweep:
+    """Latency, TTFT and throughput as prompt context grows
+
+    Each size gets a prompt padded with real code up to that many tokens
+    (by this harness's token counter) and is run `repeat` times per system,
+    serially. TTFT needs --stream. A least-squares fit of median latency
+    against input tokens gives the marginal cost per 1k context tokens.
+    """
+
+    def __init__(self, runner: "EvaluationRunner", sizes: List[int] = None, repeat: int = 3,
+                 seed_task: str = CONTEXT_SEED_TASK, source: str = None):
+        self.runner = runner
+        self.sizes = sorted(sizes or CONTEXT_SWEEP_SIZES)
+        self.repeat = repeat
+        self.seed_task = seed_task
+        self.lines = load_context_lines(source)
+        self.results = {}
+
+    @staticmethod
+    def _median(values: List[float]) -> float:
+        values = [v for v in values if v is not None]
+        return statistics.median(values) if values else None
+
+    def run(self) -> Dict[str, Any]:
+        counter = self.runner.token_counter
+        systems = [system for system in self.runner.systems if system.available]
+        print(f"\n📏 Context sweep: sizes {self.sizes} x {len(systems)} systems, {self.repeat} runs each")
+
+        for system in systems:
+            family = tokenizer_family(system.model)
+            points = []
+            for size in self.sizes:
+                prompt = build_context_prompt(self.seed_task, size, self.lines, counter, family)
+                input_tokens = counter.count(prompt, family)[0]
+                latencies, ttfts, throughputs, errors = [], [], [], 0
+                for _ in range(self.repeat):
+                    response = self.runner._query_system(system, prompt)
+                    if response_status(response) != "ok":
+                        errors += 1
+                        continue
+                    latencies.append(response["time"])
+                    ttfts.append((response.get("stream") or {}).get("ttft"))
+                    throughputs.append(Benchmark._throughput(response))
+
+                point = {
+                    "target_tokens": size,
+                    "input_tokens": input_tokens,
+                    "runs": self.repeat,
+                    "errors": errors,
+                    "latency_p50": self._median(latencies),
+                    "latency_p95": percentile(latencies, 95) if latencies else None,
+                    "ttft_p50": self._median(ttfts),
+                    "tokens_per_sec_p50": self._median(throughputs)
+                }
+                points.append(point)
+                latency = f"{point['latency_p50']:.2f}s" if point["latency_p50"] is not None else "n/a"
+                print(f"   {system.name} @ {input_tokens} tokens: latency p50 {latency} ({errors} errors)")
+
+            self.results[system.name] = {"points": points, "latency_per_1k_tokens": self._slope(points)}
+        return self.results
+
+    @staticmethod
+    def _slope(points: List[Dict[str, Any]]) -> float:
+        """Seconds of median latency added per 1k input tokens (least squares)"""
+        pairs = [(p["input_tokens"] / 1000, p["latency_p50"]) for p in points if p["latency_p50"] is not None]
+        if len(pairs) < 2:
+            return None
+        mean_x = statistics.mean(x for x, _ in pairs)
+        mean_y = statistics.mean(y for _, y in pairs)
+        spread = sum((x - mean_x) ** 2 for x, _ in pairs)
+        return sum((x - mean_x) * (y - mean_y) for x, y in pairs) / spread if spread else None
+
+    def summary_lines(self) -> List[str]:
+        """Per-system table plus a bar per size so the curve shape is visible in a terminal"""
+        def fmt(value, unit="s", digits=2):
+            return f"{value:.{digits}f}{unit}" if value is not None else "-"
+
+        lines = []
+        for system_name, result in self.results.items():
+            points = result["points"]
+            longest = max((p["latency_p50"] or 0 for p in points), default=0)
+            lines.append(f"\n{system_name}")
+            lines.append(f"  {'tokens':>7} | {'p50':>8} | {'p95':>8} | {'TTFT':>8} | {'tok/s':>7} | latency")
+            for p in points:
+                bar = "█" * round(30 * (p["latency_p50"] or 0) / longest) if longest else ""
+                lines.append(f"  {p['input_tokens']:>7} | {fmt(p['latency_p50']):>8} | {fmt(p['latency_p95']):>8} "
+                             f"| {fmt(p['ttft_p50']):>8} | {fmt(p['tokens_per_sec_p50'], '', 1):>7} | {bar}")
+            if result["latency_per_1k_tokens"] is not None:
+                lines.append(f"  ≈ {result['latency_per_1k_tokens'] * 1000:.0f} ms latency per extra 1k context tokens")
+        return lines
+
+    def save_results(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"context_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "metadata": {
+                    "timestamp": datetime.now().isoformat(),
+                    "sizes": self.sizes,
+                    "repeat": self.repeat,
+                    "stream": self.runner.stream,
+                    "seed_task": self.seed_task
+                },
+                "results": self.results
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"\n✅ Context sweep saved to: {filename}")
+        return filename
+
+
+# ============================================================================
+# SESSION REPLAY
+# ============================================================================
+
+# Scripted follow-up turns by test category; a test can supply its own "follow_ups"
+SESSION_FOLLOW_UPS = {
+    "Code Generation": [
+        "Add type hints and a docstring to that code if they are missing.",
+        "Now write pytest unit tests for it, including edge cases.",
+        "Make it handle invalid input with clear error messages.",
+        "What is the time and space complexity? Optimise it if you can.",
+    ],
+    "Debugging": [
+        "Explain the root cause of the bug in one paragraph.",
+        "Write a regression test that fails on the original code.",
+        "Are there any other bugs in the original code?",
+        "Show the final corrected version with comments.",
+    ],
+    "Refactoring": [
+        "Explain each change you made and why.",
+        "Write tests that prove the behaviour is unchanged.",
+        "Could any of it be simplified further?",
+        "Add type hints throughout.",
+    ],
+}
+SESSION_DEFAULT_FOLLOW_UPS = [
+    "Can you give a worked example?",
+    "Summarise that in three bullet points.",
+    "What edge cases should I watch out for?",
+    "Show how this would look in production code.",
+]
+# Longest conversation every built-in category can script
+SESSION_MAX_TURNS = 1 + min(len(follow_ups) for follow_ups in
+                            [*SESSION_FOLLOW_UPS.values(), SESSION_DEFAULT_FOLLOW_UPS])
+
+
+def session_script(test_case: Dict[str, Any], turns: int) -> List[str]:
+    """The test's prompt followed by up to turns - 1 scripted follow-ups"""
+    follow_ups = test_case.get("follow_ups") or SESSION_FOLLOW_UPS.get(test_case.get("category"),
+                                                                       SESSION_DEFAULT_FOLLOW_UPS)
+    return [test_case["prompt"]] + list(follow_ups)[:max(0, turns - 1)]
+
+
+class SessionReplay:
+    """Per-turn latency of multi-turn conversations against the local backend
+
+    Each session replays a test prompt plus scripted follow-ups, one turn
+    at a time, with many sessions in flight at once. It runs twice: in
+    "session" mode every turn sends only the new message with the
+    session's session_id, so the server can keep history (and its KV
+    cache) between turns; in "stateless" mode every turn resends the
+    whole transcript as context["history"] without a session_id. The
+    ratio of stateless to session latency at each turn index is the
+    speedup from server-side context reuse.
+    """
+
+    MODES = ("session", "stateless")
+
+    def __init__(self, system: "LocalInstanceInterface", sessions: int = 16, turns: int = 5,
+                 concurrency: int = 8, stream: bool = False, tests: List[Dict[str, Any]] = None):
+        self.system = system
+        self.sessions = sessions
+        self.turns = turns
+        self.concurrency = concurrency
+        self.stream = stream
+        tests = tests or list(iter_builtin_tests())
+        self.scripts = [(tests[i % len(tests)]["id"], session_script(tests[i % len(tests)], turns))
+                        for i in range(sessions)]
+        shortest = min(len(script) for _, script in self.scripts)
+        if turns < 1 or shortest < turns:
+            raise ValueError(f"turns must be between 1 and {shortest}, got {turns}")
+        self.run_id = f"replay-{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+        self.samples = {mode: [] for mode in self.MODES}
+        self.results = {}
+
+    def _play(self, mode: str, index: int) -> List[Dict[str, Any]]:
+        test_id, script = self.scripts[index]
+        session_id = f"{self.run_id}-{mode}-{index}" if mode == "session" else None
+        history, samples = [], []
+        for turn, message in enumerate(script):
+            context = {"history": history} if mode == "stateless" and history else None
+            response = self.system.query(message, stream=self.stream, session_id=session_id, context=context)
+            ok = response_status(response) == "ok"
+            samples.append({
+                "session": index,
+                "test_id": test_id,
+                "turn": turn,
+                "context_tokens": sum(estimate_tokens(m["content"]) for m in history),
+                "latency": response["time"] if ok else None,
+                "ttft": (response.get("stream") or {}).get("ttft"),
+                "ok": ok
+            })
+            if not ok:
+                # Later turns would not be comparable without this answer in the history
+                break
+            history = history + [{"role": "user", "content": message},
+                                 {"role": "assistant", "content": response["response"]}]
+        return samples
+
+    def run(self) -> Dict[str, Any]:
+        print(f"\n💬 Session replay: {self.sessions} sessions x {self.turns} turns, "
+              f"{self.concurrency} concurrent, against {self.system.base_url}")
+        for mode in self.MODES:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for samples in pool.map(lambda i: self._play(mode, i), range(self.sessions)):
+                    self.samples[mode].extend(samples)
+            completed = sum(s["ok"] for s in self.samples[mode])
+            print(f"   {mode}: {completed} turns in {time.perf_counter() - started:.1f}s")
+
+        for mode, samples in self.samples.items():
+            per_turn = []
+            for turn in range(self.turns):
+                rows = [s for s in samples if s["turn"] == turn]
+                latencies = [s["latency"] for s in rows if s["ok"]]
+                ttfts = [s["ttft"] for s in rows if s["ttft"] is not None]
+                per_turn.append({
+                    "turn": turn + 1,
+                    "requests": len(rows),
+                    "errors": sum(not s["ok"] for s in rows),
+                    "context_tokens_p50": percentile([s["context_tokens"] for s in rows], 50),
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p95": percentile(latencies, 95),
+                    "ttft_p50": percentile(ttfts, 50)
+                })
+            self.results[mode] = per_turn
+
+        for session_turn, stateless_turn in zip(self.results["session"], self.results["stateless"]):
+            if session_turn["latency_p50"] and stateless_turn["latency_p50"] is not None:
+                session_turn["speedup"] = stateless_turn["latency_p50"] / session_turn["latency_p50"]
+            else:
+                session_turn["speedup"] = None
+        return self.results
+
+    def summary_lines(self) -> List[str]:
+        """Per-turn latency in both modes, with the speedup from session reuse"""
+        def fmt(value, unit="s", digits=2):
+            return f"{value:.{digits}f}{unit}" if value is not None else "-"
+
+        lines = [f"  {'turn':>4} | {'context':>7} | {'session p50':>11} | {'p95':>8} | {'stateless p50':>13} "
+                 f"| {'p95':>8} | {'speedup':>7} | errors"]
+        for session_turn, stateless_turn in zip(self.results["session"], self.results["stateless"]):
+            lines.append(
+                f"  {session_turn['turn']:>4} | {fmt(stateless_turn['context_tokens_p50'], '', 0):>7} "
+                f"| {fmt(session_turn['latency_p50']):>11} | {fmt(session_turn['latency_p95']):>8} "
+                f"| {fmt(stateless_turn['latency_p50']):>13} | {fmt(stateless_turn['latency_p95']):>8} "
+                f"| {fmt(session_turn['speedup'], 'x'):>7} "
+                f"| {session_turn['errors']}/{stateless_turn['errors']}"
+            )
+
+        if not self.results.get("session"):
+            return lines
+        first, last = self.results["session"][0], self.results["session"][-1]
+        if first["latency_p50"] and last["latency_p50"] is not None and len(self.results["session"]) > 1:
+            lines.append(f"  Session latency p50 grows {last['latency_p50'] / first['latency_p50']:.2f}x "
+                         f"from turn 1 to turn {last['turn']}")
+        return lines
+
+    def save_results(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"session_replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "metadata": {
+                    "timestamp": datetime.now().isoformat(),
+                    "base_url": self.system.base_url,
+                    "sessions": self.sessions,
+                    "turns": self.turns,
+                    "concurrency": self.concurrency,
+                    "stream": self.stream
+                },
+                "results": self.results,
+                "samples": self.samples
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"\n✅ Session replay saved to: {filename}")
+        return filename
+
+
+# ============================================================================
+# METRICS EXPORT
+# ============================================================================
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One labelled metric family; values are keyed by label tuple"""
+
+    def __init__(self, name: str, kind: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} {self.kind}", f"# HELP {self.name} {self.help}"]
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            if self.kind == "counter":
+                lines.append(f"{self.name}_total{_format_labels(self.labels, key)} {_format_value(value)}")
+            elif self.kind == "gauge":
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+            else:
+                counts, total = value
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+        return lines
+
+
+class EvaluationMetrics:
+    """Runner metrics in OpenMetrics text format
+
+    Label cardinality is bounded: system and category only, never test IDs
+    or prompts.
+    """
+
+    def __init__(self):
+        self.requests = Metric("eval_requests", "counter",
+                               "Completed (test, system) queries by outcome, excluding cache hits",
+                               ("system", "category", "status"))
+        self.latency = Metric("eval_request_duration_seconds", "histogram",
+                              "Response time of successful queries", ("system", "category"))
+        self.ttft = Metric("eval_time_to_first_token_seconds", "histogram",
+                           "Time to first token of successful streamed queries", ("system", "category"))
+        self.tokens = Metric("eval_tokens", "counter", "Tokens reported by successful queries",
+                             ("system", "category"))
+        self.rate_limited = Metric("eval_rate_limited", "counter", "HTTP 429 responses received", ("system",))
+        self.rate_limit_wait = Metric("eval_rate_limit_wait_seconds", "counter",
+                                      "Time spent waiting on client-side rate limits", ("system",))
+        self.cache_hits = Metric("eval_cache_hits", "counter", "Responses served from the cache", ("system",))
+        self.in_flight = Metric("eval_in_flight_requests", "gauge", "Queries currently awaiting a response",
+                                ("system",))
+        self.extra_requests = Metric("eval_extra_requests", "counter",
+                                     "Requests sent beyond the first by retries and hedging", ("system", "kind"))
+        self.families = [self.requests, self.latency, self.ttft, self.tokens, self.rate_limited,
+                         self.rate_limit_wait, self.cache_hits, self.in_flight, self.extra_requests]
+
+    def observe_response(self, system: str, category: str, response: Dict[str, Any]):
+        if response.get("cached"):
+            # Replays carry the original request's timings; counting them
+            # again would skew latency and request rates
+            self.cache_hits.inc(system=system)
+            return
+        status = response_status(response)
+        self.requests.inc(system=system, category=category, status=status)
+        for attempt in (response.get("attempts") or [])[1:]:
+            self.extra_requests.inc(system=system, kind=attempt["kind"])
+        if response.get("rate_limit_wait"):
+            self.rate_limit_wait.inc(response["rate_limit_wait"], system=system)
+        if status != "ok":
+            return
+        if not response.get("batch"):
+            # Batch results have no comparable per-request latency
+            self.latency.observe(response["time"], system=system, category=category)
+        self.tokens.inc(response.get("tokens") or 0, system=system, category=category)
+        ttft = (response.get("stream") or {}).get("ttft")
+        if ttft is not None:
+            self.ttft.observe(ttft, system=system, category=category)
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prom"
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        print(f"📈 Metrics saved to: {filename}")
+        return filename
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves GET /metrics for Prometheus scrapes"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Background /metrics endpoint for the duration of a run"""
+
+    daemon_threads = True
+
+    def __init__(self, metrics: EvaluationMetrics, host: str = "0.0.0.0", port: int = 9464):
+        super().__init__((host, port), MetricsHandler)
+        self.metrics = metrics
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# ============================================================================
+# MOCK PROVIDER SERVER
+# ============================================================================
+
+MOCK_DEFAULT_RESPONSE = (
+    "Here is an implementation:\n\n"
+    "```python\n"
+    "def solution(value):\n"
+    "    \"\"\"Return the input unchanged.\"\"\"\n"
+    "    return value\n"
+    "```\n\n"
+    "This handles the basic case; add validation for production use."
+)
+
+
+def parse_latency_spec(spec: str):
+    """Parse a latency distribution: fixed:S, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()] if params else []
+    samplers = {
+        "fixed": (1, lambda rng, s: s[0]),
+        "uniform": (2, lambda rng, s: rng.uniform(s[0], s[1])),
+        "normal": (2, lambda rng, s: max(0.0, rng.gauss(s[0], s[1]))),
+        "lognormal": (2, lambda rng, s: s[0] * rng.lognormvariate(0.0, s[1])),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"Bad latency spec: {spec!r} (e.g. fixed:0.2, uniform:0.1,0.5, lognormal:0.3,0.5)")
+    sample = samplers[kind][1]
+    return lambda rng: sample(rng, values)
+
+
+class MockProviderConfig:
+    """Behaviour of the mock provider server
+
+    Latency is the time before the first byte; streamed responses then send
+    `chunk_words` words every `chunk_interval` seconds. With a prefill rate,
+    /api/chat requests carrying a session_id also pay for the session's
+    earlier turns unless `session_cache` emulates server-side KV reuse;
+    `context["history"]` is always paid for in full. Each request draws
+    from an RNG seeded by (seed, prompt, times this prompt was seen), so a
+    given request sequence always produces the same latencies and faults.
+    """
+
+    def __init__(self, latency: str = "fixed:0.05", chunk_interval: float = 0.01, chunk_words: int = 1,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 seed: int = 0, responses: Dict[str, str] = None, prefill_rate: float = None,
+                 session_cache: bool = True, batch_concurrency: int = 8):
+        self.latency_spec = latency
+        self.sample_latency = parse_latency_spec(latency)
+        self.chunk_interval = chunk_interval
+        # Prompt tokens processed per second before generation starts (None: no prompt cost)
+        self.prefill_rate = prefill_rate
+        self.session_cache = session_cache
+        # Requests of a /api/batch job processed at once
+        self.batch_concurrency = max(1, batch_concurrency)
+        self.chunk_words = max(1, chunk_words)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        # Canned responses keyed by exact prompt or test ID; others get the default
+        self.responses = responses or {}
+        self._prompt_ids = {test["prompt"]: test["id"] for tests in TEST_PROMPTS.values() for test in tests}
+
+    def response_for(self, prompt: str) -> str:
+        return self.responses.get(prompt) or self.responses.get(self._prompt_ids.get(prompt, "")) \
+            or MOCK_DEFAULT_RESPONSE
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    """Serves the local /api/chat contract and OpenAI/Perplexity chat completions"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MockProvider/1.0"
+    server_timing = None
+    # Headers and body go out in separate writes; with Nagle on, delayed ACKs
+    # add ~40 ms to every keep-alive request after the first
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.server_timing:
+            self.send_header("Server-Timing", self.server_timing)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        if self.server_timing:
+            self.send_header("Server-Timing", self.server_timing)
+        self.end_headers()
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _word_chunks(self, text: str) -> List[str]:
+        words = text.split(" ")
+        size = self.server.config.chunk_words
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                for i in range(0, len(words), size)]
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "healthy", "services": {"mock": "healthy"}})
+        elif self.path.startswith("/api/batch/"):
+            batch_id, _, results = self.path[len("/api/batch/"):].partition("/")
+            job = self.server.batch(batch_id)
+            if job is None or results not in ("", "results"):
+                self._send_json(404, {"detail": "Not Found"})
+            elif results:
+                self._send_json(200, {"batch_id": batch_id, "results": job["results"]})
+            else:
+                self._send_json(200, {"batch_id": batch_id, "status": job["status"],
+                                      "completed": len(job["results"]), "total": job["total"]})
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"detail": "invalid JSON"})
+            return
+
+        if self.path.startswith("/api/batch/") and self.path.endswith("/cancel"):
+            batch_id = self.path[len("/api/batch/"):-len("/cancel")]
+            status = self.server.cancel_batch(batch_id)
+            if status is None:
+                self._send_json(404, {"detail": "Not Found"})
+            else:
+                self._send_json(200, {"batch_id": batch_id, "status": status})
+            return
+
+        if self.path == "/api/batch":
+            requests = body.get("requests")
+            if not isinstance(requests, list) or not requests:
+                self._send_json(400, {"detail": "requests must be a non-empty list"})
+                return
+            self._send_json(200, {"batch_id": self.server.submit_batch(requests), "status": "queued"})
+            return
+
+        session_id, history = None, []
+        if self.path in ("/api/chat", "/api/chat/stream"):
+            prompt = body.get("message", "")
+            session_id = body.get("session_id")
+            history = (body.get("context") or {}).get("history") or []
+        elif self.path in ("/chat/completions", "/v1/chat/completions"):
+            messages = body.get("messages") or [{}]
+            prompt = messages[-1].get("content", "")
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+            return
+
+        server = self.server
+        config = server.config
+        rng = server.request_rng(prompt)
+        server.count("requests")
+
+        latency = config.sample_latency(rng)
+        if config.prefill_rate:
+            prefill = estimate_tokens(prompt) + sum(estimate_tokens(m.get("content", "")) for m in history)
+            if session_id and not config.session_cache:
+                prefill += server.session_tokens(session_id)
+            latency += prefill / config.prefill_rate
+        time.sleep(latency)
+        self.server_timing = f"generation;dur={latency * 1000:.3f}"
+        server.count("service_seconds", latency)
+
+        fault = rng.random()
+        if fault < config.rate_limit_rate:
+            server.count("rate_limited")
+            self._send_json(429, {"error": {"message": "rate limited (injected)"}},
+                            {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if fault < config.rate_limit_rate + config.error_rate:
+            server.count("errors")
+            self._send_json(500, {"detail": "injected failure"})
+            return
+
+        text = config.response_for(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if session_id:
+            server.extend_session(session_id, prompt_tokens + completion_tokens)
+
+        if self.path == "/api/chat":
+            self._send_json(200, {"response": text, "session_id": body.get("session_id") or "mock-session",
+                                  "tool_calls": []})
+        elif self.path == "/api/chat/stream":
+            # Plain-text SSE events; line breaks in the text become extra data: lines
+            self._start_chunked("text/event-stream")
+            chunks = self._word_chunks(text)
+            server.count("service_seconds", len(chunks) * config.chunk_interval)
+            for chunk in chunks:
+                self._write_chunk("".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n")
+                time.sleep(config.chunk_interval)
+            self._write_chunk("data: [DONE]\n\n")
+            self._end_chunked()
+        elif body.get("stream"):
+            self._start_chunked("text/event-stream")
+            created = int(time.time())
+            chunks = self._word_chunks(text)
+            server.count("service_seconds", len(chunks) * config.chunk_interval)
+            for chunk in chunks:
+                event = {"id": "mock", "object": "chat.completion.chunk", "created": created,
+                         "model": body.get("model", "mock"),
+                         "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+                time.sleep(config.chunk_interval)
+            final = {"id": "mock", "object": "chat.completion.chunk", "created": created,
+                     "model": body.get("model", "mock"),
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self._end_chunked()
+        else:
+            self._send_json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """Threaded local stand-in for every REST backend the harness talks to
+
+    Serves /api/chat, /api/chat/stream and /api/batch[/<id>/cancel] (LocalInstanceInterface),
+    /v1/chat/completions (OpenAI SDK via OPENAI_BASE_URL) and
+    /chat/completions (PerplexityInterface via PERPLEXITY_BASE_URL).
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, config: MockProviderConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), MockProviderHandler)
+        self.config = config
+        # service_seconds: simulated latency and chunk intervals summed over chat requests
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "service_seconds": 0.0}
+        self._seen = {}
+        self._sessions = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def request_rng(self, prompt: str) -> random.Random:
+        with self._lock:
+            occurrence = self._seen.get(prompt, 0)
+            self._seen[prompt] = occurrence + 1
+        digest = hashlib.sha256(f"{self.config.seed}:{occurrence}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def session_tokens(self, session_id: str) -> int:
+        """Tokens of earlier turns held for a session"""
+        with self._lock:
+            return self._sessions.get(session_id, 0)
+
+    def extend_session(self, session_id: str, tokens: int):
+        with self._lock:
+            self._sessions[session_id] = self._sessions.get(session_id, 0) + tokens
+
+    def submit_batch(self, requests: List[Dict[str, Any]]) -> str:
+        """Queue a /api/batch job, processed in the background; returns its ID"""
+        with self._lock:
+            batch_id = f"batch-{len(self._batches) + 1:06d}"
+            job = {"status": "queued", "total": len(requests), "results": []}
+            self._batches[batch_id] = job
+        threading.Thread(target=self._run_batch, args=(job, requests), daemon=True).start()
+        return batch_id
+
+    def batch(self, batch_id: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._batches.get(batch_id)
+            return dict(job, results=list(job["results"])) if job else None
+
+    def cancel_batch(self, batch_id: str) -> str:
+        """Stop a job's unstarted requests; returns its status, or None if unknown"""
+        with self._lock:
+            job = self._batches.get(batch_id)
+            if job is None:
+                return None
+            if job["status"] in ("queued", "in_progress"):
+                job["status"] = "cancelling"
+            return job["status"]
+
+    def _run_batch(self, job: Dict[str, Any], requests: List[Dict[str, Any]]):
+        with self._lock:
+            if job["status"] == "queued":
+                job["status"] = "in_progress"
+        with ThreadPoolExecutor(max_workers=self.config.batch_concurrency) as pool:
+            for result in pool.map(lambda request: self._run_batch_request(job, request), requests):
+                with self._lock:
+                    job["results"].append(result)
+        with self._lock:
+            job["status"] = "cancelled" if job["status"] == "cancelling" else "completed"
+
+    def _run_batch_request(self, job: Dict[str, Any], request: Dict[str, Any]) -> Dict[str, Any]:
+        if job["status"] == "cancelling":
+            return {"custom_id": request.get("custom_id"), "error": "request cancelled", "status_code": 409}
+        config = self.config
+        prompt = request.get("message", "")
+        rng = self.request_rng(prompt)
+        self.count("requests")
+        latency = config.sample_latency(rng)
+        if config.prefill_rate:
+            latency += estimate_tokens(prompt) / config.prefill_rate
+        time.sleep(latency)
+        if rng.random() < config.error_rate:
+            self.count("errors")
+            return {"custom_id": request.get("custom_id"), "error": "injected failure", "status_code": 500}
+        return {"custom_id": request.get("custom_id"), "response": config.response_for(prompt),
+                "time": round(latency, 6)}
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, key: str, amount: float = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def start(self) -> "MockProviderServer":
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def point_interfaces_here(self):
+        """Route the local, OpenAI and Perplexity interfaces to this server"""
+        os.environ["LOCAL_AI_URL"] = self.url
+        os.environ["PERPLEXITY_BASE_URL"] = self.url
+        os.environ["OPENAI_BASE_URL"] = f"{self.url}/v1"
+        os.environ.setdefault("PERPLEXITY_API_KEY", "mock-key")
+        os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+
+
+# ============================================================================
+# HARNESS BENCHMARK
+# ============================================================================
+
+class HarnessBenchmark:
+    """Measures the runner's own throughput and overhead against the mock server
+
+    The mock accounts for the latency it simulates (its service_seconds
+    stat), so with `concurrency` requests in flight the ideal wall time is
+    that total / concurrency; efficiency is the ideal divided by the
+    measured wall time, and everything else is harness overhead.
+    """
+
+    def __init__(self, server: MockProviderServer, systems: List[str], tests: int = 200,
+                 concurrency_levels: List[int] = None, stream: bool = False):
+        self.server = server
+        self.systems = systems
+        self.tests = tests
+        self.concurrency_levels = concurrency_levels or [1, 4, 16, 64]
+        self.stream = stream
+        self.results = []
+
+    def _corpus(self) -> List[Dict[str, Any]]:
+        base = [test for tests in TEST_PROMPTS.values() for test in tests]
+        return [dict(base[i % len(base)], id=f"{base[i % len(base)]['id']}-{i}") for i in range(self.tests)]
+
+    def run(self) -> List[Dict[str, Any]]:
+        corpus = self._corpus()
+        for concurrency in self.concurrency_levels:
+            with tempfile.TemporaryDirectory(prefix="harness_bench_") as workdir:
+                journal = ResultJournal(os.path.join(workdir, "journal.jsonl"))
+                runner = EvaluationRunner(concurrency=concurrency, stream=self.stream, journal=journal,
+                                          systems=self.systems, verbose=False, retries=0)
+                for system in runner.systems:
+                    system.rate_limiter = RateLimiter()
+
+                served = self.server.stats["service_seconds"]
+                start = time.perf_counter()
+                runner.run_tests(corpus)
+                wall = time.perf_counter() - start
+                served = self.server.stats["service_seconds"] - served
+
+                statuses = [response_status(record["response"]) for record in journal.iter_records()]
+                journal.close()
+
+            requests_done = len(statuses)
+            errors = sum(1 for status in statuses if status != "ok")
+            ideal = served / concurrency
+            step = {
+                "concurrency": concurrency,
+                "requests": requests_done,
+                "errors": errors,
+                "wall_time": wall,
+                "requests_per_sec": requests_done / wall if wall else None,
+                "efficiency": ideal / wall if wall else None,
+                "overhead_per_request_ms": (wall - ideal) * concurrency / requests_done * 1000
+                if requests_done else None
+            }
+            self.results.append(step)
+            print(f"   concurrency {concurrency:>3}: {step['requests_per_sec']:.1f} req/s, "
+                  f"efficiency {step['efficiency']:.0%}, "
+                  f"overhead {step['overhead_per_request_ms']:.2f} ms/request")
+        return self.results
+
+    def save_results(self, filename: str = None) -> str:
+        if filename is None:
+            filename = f"harness_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        config = self.server.config
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                "metadata": {
+                    "timestamp": datetime.now().isoformat(),
+                    "systems": self.systems,
+                    "tests": self.tests,
+                    "stream": self.stream,
+                    "mock_latency": config.latency_spec,
+                    "mock_error_rate": config.error_rate,
+                    "mock_rate_limit_rate": config.rate_limit_rate,
+                    "server_stats": self.server.stats
+                },
+                "results": self.results
+            }, f, indent=2, ensure_ascii=False)
+
+        print(f"\n✅ Harness benchmark saved to: {filename}")
+        return filename
+
+
+# ============================================================================
+# EVALUATION RUNNER
+# ============================================================================
+
+class EvaluationRunner:
+    """Runs evaluation tests across all AI systems"""
+
+    def __init__(self, concurrency: int = 1, max_rate_limit_retries: int = 5, stream: bool = False,
+                 pool_size: int = None, cache: ResponseCache = None, replay: bool = False,
+                 refresh: List[str] = None, journal: ResultJournal = None, systems: List[str] = None,
+                 verbose: bool = True, metrics: EvaluationMetrics = None, retries: int = DEFAULT_RETRIES,
+                 hedge: bool = False, token_counter: TokenCounter = None):
+        self.concurrency = max(1, concurrency)
+        # Size pools so every in-flight request can hold a warm connection
+        pool_size = pool_size or max(HTTP_POOL_SIZE, self.concurrency)
+
+        self.systems = build_systems(systems, pool_size)
+        for system in self.systems:
+            system.policy = ResiliencePolicy(retries, hedge)
+
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.verbose = verbose
+        self.metrics = metrics
+        self.token_counter = token_counter or TokenCounter()
+        self.stream = stream
+        self.cache = cache
+        self.replay = replay
+        # Registry keys or display names; compared against system.name
+        self.refresh = {SYSTEM_REGISTRY[key][0] for key in resolve_systems(refresh)} if refresh else set()
+        # With a journal, results stream to disk instead of accumulating here
+        self.journal = journal
+        self.completed = journal.completed_pairs() if journal else set()
+        self.results = []
+        self._seq = 0
+
+    def _next_seq(self) -> int:
+        """Position of the next test in this run, used to order journal output"""
+        self._seq += 1
+        return self._seq
+
+    def _pending_systems(self, test_case: Dict[str, Any]) -> List[AISystemInterface]:
+        """Systems not already completed for this test in a resumed journal"""
+        return [system for system in self.systems if (test_case["id"], system.name) not in self.completed]
+
+    def _record(self, test_result: Dict[str, Any], seq: int, system: AISystemInterface,
+                response: Dict[str, Any]):
+        """Journal a completed (test, system) pair, or keep it in memory"""
+        if self.metrics:
+            self.metrics.observe_response(system.name, test_result["category"], response)
+        if self.journal is None:
+            test_result["responses"][system.name] = response
+            return
+        self.journal.append({
+            "seq": seq,
+            "test_id": test_result["test_id"],
+            "prompt": test_result["prompt"],
+            "category": test_result["category"],
+            "timestamp": datetime.now().isoformat(),
+            "system": system.name,
+            "response": response
+        })
+
+    def iter_results(self):
+        """Yield test results one at a time, from the journal when there is one"""
+        if self.journal is not None:
+            yield from self.journal.iter_test_results([s.name for s in self.systems])
+        else:
+            yield from self.results
+
+    def count_results(self) -> int:
+        return self.journal.count_tests() if self.journal is not None else len(self.results)
+
+    def _new_test_result(self, test_case: Dict[str, Any]) -> Dict[str, Any]:
+        """Create an empty result record for a test case"""
+        return {
+            "test_id": test_case["id"],
+            "prompt": test_case["prompt"],
+            "category": test_case["category"],
+            "timestamp": datetime.now().isoformat(),
+            "responses": {}
+        }
+
+    def _query_system(self, system: AISystemInterface, prompt: str) -> Dict[str, Any]:
+        """Query one system within its provider's rate limits
+
+        With a cache attached, successful responses are stored; in replay
+        mode they are served from the cache and only misses hit the API.
+        Replay works without API keys: a system that is not configured only
+        falls back to its SKIPPED result on a cache miss.
+        """
+        cache_key = None
+        if self.cache:
+            cache_key = ResponseCache.key(system.cache_identity(), prompt, stream=self.stream)
+            if self.replay and system.name not in self.refresh:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    cached["cached"] = True
+                    return cached
+
+        if not system.available:
+            return system.query(prompt, stream=self.stream)
+
+        limiter = system.rate_limiter
+        estimated = estimate_tokens(prompt)
+        waited = 0.0
+
+        for attempt in range(self.max_rate_limit_retries + 1):
+            if self.metrics:
+                self.metrics.in_flight.inc(system=system.name)
+            try:
+                response = system.call(prompt, stream=self.stream)
+            finally:
+                if self.metrics:
+                    self.metrics.in_flight.dec(system=system.name)
+
+            # The policy meters every request it sends against the limiter
+            waited += response.pop("rate_limit_wait", 0.0)
+            retry_after = response.pop("retry_after", None)
+            if not response.pop("rate_limited", False):
+                self.token_counter.fill(response, prompt, system.model)
+                limiter.record(response["tokens"], estimated)
+                break
+
+            if self.metrics:
+                self.metrics.rate_limited.inc(system=system.name)
+
+            if attempt < self.max_rate_limit_retries:
+                delay = limiter.backoff(retry_after)
+                print(f"   ⏳ {system.name} rate limited (429), backing off {delay:.1f}s")
+
+        response["rate_limit_wait"] = round(waited, 3)
+        if cache_key and response_status(response) == "ok":
+            self.cache.put(cache_key, system.name, response)
+        return response
+
+    def _print_response(self, response: Dict[str, Any]):
+        """Print a short preview of a response"""
+        if not self.verbose:
+            return
+        preview = response["response"][:200].replace("\n", " ")
+        print(f"   Response: {preview}...")
+        if response.get("stream"):
+            metrics = response["stream"]
+            ttft = f"{metrics['ttft']:.2f}s" if metrics["ttft"] is not None else "n/a"
+            rate = f"{metrics['tokens_per_sec']:.1f} tok/s" if metrics["tokens_per_sec"] else "n/a"
+            print(f"   Time: {response['time']:.2f}s | TTFT: {ttft} | {rate}\n")
+        else:
+            print(f"   Time: {response['time']:.2f}s\n")
+
+    def run_single_test(self, test_case: Dict[str, Any]):
+        """Run a single test across all systems"""
+        seq = self._next_seq()
+        pending = self._pending_systems(test_case)
+        if not pending:
+            print(f"⏭️  {test_case['id']}: already in journal, skipping")
+            return None
+
+        if self.verbose:
+            print(f"\n{'='*80}")
+            print(f"Test ID: {test_case['id']}")
+            print(f"Category: {test_case['category']}")
+            print(f"Prompt: {test_case['prompt'][:100]}...")
+            print(f"{'='*80}\n")
+
+        test_result = self._new_test_result(test_case)
+
+        for system in pending:
+            if self.verbose:
+                print(f"🤖 Testing {system.name}...")
+            response = self._query_system(system, test_case["prompt"])
+            self._record(test_result, seq, system, response)
+            self._print_response(response)
+
+        if self.journal is None:
+            self.results.append(test_result)
+        return test_result
+
+    def run_tests(self, test_cases):
+        """Run an iterable of tests, concurrently when concurrency > 1"""
+        if self.concurrency <= 1:
+            for test_case in test_cases:
+                self.run_single_test(test_case)
+            return
+
+        if self.verbose:
+            print(f"⚡ Concurrent mode: up to {self.concurrency} requests in flight")
+        engine = AsyncEvaluationEngine(self, self.concurrency)
+        test_results = engine.run(test_cases)
+        if self.journal is None:
+            self.results.extend(test_results)
+
+    def run_category(self, category: str):
+        """Run all tests in a category"""
+        if category not in TEST_PROMPTS:
+            print(f"❌ Unknown category: {category}")
+            print(f"Available: {list(TEST_PROMPTS.keys())}")
+            return
+
+        print(f"\n🚀 Running {category.upper()} tests...")
+
+        self.run_tests(TEST_PROMPTS[category])
+
+    def run_all(self):
+        """Run all tests"""
+        print("\n🚀 Running ALL evaluation tests...")
+        print(f"Total tests: {sum(len(tests) for tests in TEST_PROMPTS.values())}")
+
+        if self.concurrency <= 1:
+            for category in TEST_PROMPTS.keys():
+                self.run_category(category)
+        else:
+            self.run_tests([test_case for tests in TEST_PROMPTS.values() for test_case in tests])
+
+    def score_results(self, workers: int = None) -> int:
+        """Run automated scoring on every successful response; returns the count scored"""
+        jobs = [
+            ((result["test_id"], system_name), result["test_id"], response["response"])
+            for result in self.iter_results()
+            for system_name, response in result["responses"].items()
+            if response_status(response) == "ok"
+        ]
+        if not jobs:
+            return 0
+
+        print(f"\n🧪 Scoring {len(jobs)} responses in sandboxed processes...")
+        scores = ResponseScorer(workers).score_all(jobs)
+
+        if self.journal is not None:
+            self.journal.update({pair: {"scoring": scoring} for pair, scoring in scores.items()})
+        else:
+            for result in self.results:
+                for system_name, response in result["responses"].items():
+                    scoring = scores.get((result["test_id"], system_name))
+                    if scoring is not None:
+                        response["scoring"] = scoring
+        return len(jobs)
+
+    def analyze_similarity(self) -> int:
+        """Attach cross-system agreement and near-duplicate flags to every successful response"""
+        try:
+            analyzer = SimilarityAnalyzer()
+        except ImportError:
+            print("⚠️  numpy not installed (pip install numpy). Skipping similarity analysis.")
+            return 0
+
+        print("\n🔍 Comparing responses across systems...")
+        analysis = analyzer.analyze(self.iter_results())
+        fields = {pair: {"similarity": similarity} for pair, similarity in analysis["responses"].items()}
+        if self.journal is not None:
+            self.journal.update(fields)
+        else:
+            for result in self.results:
+                for system_name, response in result["responses"].items():
+                    update = fields.get((result["test_id"], system_name))
+                    if update is not None:
+                        response.update(update)
+
+        filename = f"similarity_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({"matrices": analysis["matrices"], "near_duplicates": analysis["near_duplicates"]},
+                      f, indent=2, ensure_ascii=False)
+        print(f"✅ Similarity matrices saved to: {filename} "
+              f"({len(analysis['near_duplicates'])} near-duplicate pairs)")
+        return len(fields)
+
+    def result_table(self) -> "ResultTable":
+        """Columnar copy of this run's results (raises ImportError without numpy)"""
+        if self.journal is not None:
+            return ResultTable.from_journals([self.journal.path])
+        return ResultTable.from_results(self.results)
+
+    def save_summary(self, parquet: bool = False) -> List[str]:
+        """Write aggregate summary tables for this run; returns the files written"""
+        try:
+            table = self.result_table()
+        except ImportError:
+            print("⚠️  numpy not installed (pip install numpy). Skipping summary tables.")
+            return []
+        files = table.save_summary(parquet=parquet)
+        print(f"\n✅ Summary tables saved to: {', '.join(files)}")
+        return files
+
+    def connection_stats(self) -> Dict[str, Any]:
+        """Connection reuse statistics for systems with a pooled HTTP client"""
+        return {
+            system.name: system.connection_stats()
+            for system in self.systems
+            if system.connection_stats() is not None
+        }
+
+    def save_results(self, filename: str = None):
+        """Save results to JSON file"""
+        if filename is None:
+            filename = f"evaluation_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        metadata = {
+            "timestamp": datetime.now().isoformat(),
+            "total_tests": self.count_results(),
+            "systems": [s.name for s in self.systems],
+            "connection_stats": self.connection_stats()
+        }
+        if self.journal is not None:
+            metadata["journal"] = self.journal.path
+
+        # Written one result at a time so the journal never has to be loaded whole
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('{\n  "metadata": ')
+            f.write(json.dumps(metadata, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+            f.write(',\n  "results": [')
+            for i, result in enumerate(self.iter_results()):
+                f.write(",\n    " if i else "\n    ")
+                f.write(json.dumps(result, indent=2, ensure_ascii=False).replace("\n", "\n    "))
+            f.write("\n  ]\n}\n")
+
+        print(f"\n✅ Results saved to: {filename}")
+        return filename
+
+    def _overview_lines(self) -> List[str]:
+        """Markdown table of aggregate results per system (empty without numpy)"""
+        try:
+            table = self.result_table()
+        except ImportError:
+            return []
+        summary = table.aggregate(SUMMARY_GROUPINGS["system"])
+        if not summary:
+            return []
+        lines = ["\n## Summary by System\n"]
+        lines.extend(table.markdown_table(summary, SUMMARY_GROUPINGS["system"]))
+        lines.append("\n\n---\n")
+        return lines
+
+    def _streaming_summary_lines(self) -> List[str]:
+        """Markdown table of streaming metrics per system (empty if none)"""
+        per_system = {}
+        for result in self.iter_results():
+            for system_name, response in result["responses"].items():
+                if response.get("stream"):
+                    per_system.setdefault(system_name, []).append(response["stream"])
+
+        if not per_system:
+            return []
+
+        def fmt(values: List[float], pct: float, unit: str = "s") -> str:
+            values = [v for v in values if v is not None]
+            return f"{percentile(values, pct):.3f}{unit}" if values else "-"
+
+        lines = [
+            "\n## Streaming Summary",
+            "\n| System | Responses | TTFT p50 | TTFT p95 | ITL p50 | ITL p95 | ITL p99 | Tokens/sec p50 |",
+            "\n|--------|-----------|----------|----------|---------|---------|---------|----------------|"
+        ]
+        for system_name, metrics in per_system.items():
+            ttfts = [m["ttft"] for m in metrics]
+            lines.append(
+                f"\n| {system_name} | {len(metrics)} "
+                f"| {fmt(ttfts, 50)} | {fmt(ttfts, 95)} "
+                f"| {fmt([m['itl_p50'] for m in metrics], 50)} "
+                f"| {fmt([m['itl_p95'] for m in metrics], 50)} "
+                f"| {fmt([m['itl_p99'] for m in metrics], 50)} "
+                f"| {fmt([m['tokens_per_sec'] for m in metrics], 50, '')} |"
+            )
+        lines.append("\n\n---\n")
+        return lines
+
+    def _phase_summary_lines(self) -> List[str]:
+        """Markdown table of median request phase timings per system (empty if untraced)"""
+        per_system = {}
+        for result in self.iter_results():
+            for system_name, response in result["responses"].items():
+                if response.get("phases") and not response.get("cached"):
+                    per_system.setdefault(system_name, []).append(response["phases"])
+
+        if not per_system:
+            return []
+
+        lines = [
+            "\n## Latency Breakdown (p50, ms)",
+            "\n| System | Requests | New conns | " + " | ".join(p.title() for p in PHASES) + " | Total |",
+            "\n|--------|----------|-----------|" + "|".join("-" * (len(p) + 2) for p in PHASES) + "|-------|"
+        ]
+        for system_name, traces in per_system.items():
+            cells = []
+            for phase in PHASES + ("total",):
+                values = [t[phase] for t in traces if t.get(phase) is not None]
+                cells.append(f"{percentile(values, 50) * 1000:.1f}" if values else "-")
+            new_connections = sum(not t["connection_reused"] for t in traces)
+            lines.append(f"\n| {system_name} | {len(traces)} | {new_connections} | " + " | ".join(cells) + " |")
+        lines.append("\n\n---\n")
+        return lines
+
+    def _resilience_summary_lines(self) -> List[str]:
+        """Markdown table of retries and hedges per system (empty if none were needed)"""
+        per_system = {}
+        for result in self.iter_results():
+            for system_name, response in result["responses"].items():
+                if response.get("attempts"):
+                    per_system.setdefault(system_name, []).append(response["attempts"])
+
+        if not per_system:
+            return []
+
+        lines = [
+            "\n## Retries and Hedging",
+            "\n| System | Affected queries | Retries | Hedges | Hedges won | Still failed |",
+            "\n|--------|------------------|---------|--------|------------|--------------|"
+        ]
+        for system_name, attempt_lists in per_system.items():
+            attempts = [a for attempt_list in attempt_lists for a in attempt_list]
+            hedges = [a for a in attempts if a["kind"] == "hedge"]
+            failed = sum(not any(a["status"] == "ok" for a in attempt_list) for attempt_list in attempt_lists)
+            lines.append(
+                f"\n| {system_name} | {len(attempt_lists)} "
+                f"| {sum(a['kind'] == 'retry' for a in attempts)} | {len(hedges)} "
+                f"| {sum(bool(a.get('won')) for a in hedges)} | {failed} |"
+            )
+        lines.append("\n\n---\n")
+        return lines
+
+    def _scoring_summary_lines(self) -> List[str]:
+        """Markdown table of automated scores per system (empty if unscored)"""
+        per_system = {}
+        for result in self.iter_results():
+            for system_name, response in result["responses"].items():
+                if response.get("scoring"):
+                    per_system.setdefault(system_name, []).append(response["scoring"])
+
+        if not per_system:
+            return []
+
+        lines = [
+            "\n## Automated Scoring Summary",
+            "\n| System | Scored | Syntax OK | Executed | Hidden tests passed | Mean score |",
+            "\n|--------|--------|-----------|----------|---------------------|------------|"
+        ]
+        for system_name, scorings in per_system.items():
+            passed = sum(s["passed"] for s in scorings)
+            total = sum(s["total"] for s in scorings)
+            scores = [s["score"] for s in scorings if s["score"] is not None]
+            mean = f"{sum(scores) / len(scores):.2f}" if scores else "-"
+            lines.append(
+                f"\n| {system_name} | {len(scorings)} "
+                f"| {sum(s['syntax_ok'] for s in scorings)} | {sum(s['executed'] for s in scorings)} "
+                f"| {passed}/{total} | {mean} |"
+            )
+        lines.append("\n\n---\n")
+        return lines
+
+    def _similarity_summary_lines(self) -> List[str]:
+        """Markdown table of cross-system agreement per system (empty if not analysed)"""
+        per_system = {}
+        for result in self.iter_results():
+            for system_name, response in result["responses"].items():
+                if response.get("similarity"):
+                    per_system.setdefault(system_name, []).append(response["similarity"])
+
+        if not per_system:
+            return []
+
+        lines = [
+            "\n## Cross-System Agreement",
+            "\n| System | Responses | Mean agreement | Lowest agreement | Near-duplicates |",
+            "\n|--------|-----------|----------------|------------------|-----------------|"
+        ]
+        for system_name, similarities in per_system.items():
+            agreements = [s["agreement"] for s in similarities if s["agreement"] is not None]
+            mean = f"{sum(agreements) / len(agreements):.2f}" if agreements else "-"
+            lowest = f"{min(agreements):.2f}" if agreements else "-"
+            lines.append(
+                f"\n| {system_name} | {len(similarities)} | {mean} | {lowest} "
+                f"| {sum(len(s['near_duplicates']) for s in similarities)} |"
+            )
+        lines.append("\n\n---\n")
+        return lines
+
+    def generate_report(self):
+        """Generate markdown report"""
+        report_filename = f"evaluation_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+
+        with open(report_filename, 'w', encoding='utf-8') as f:
+            report_lines = [
+                "# AI Coding Assistant Evaluation Report",
+                f"\n**Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                f"\n**Total Tests:** {self.count_results()}",
+                "\n---\n"
+            ]
+            report_lines.extend(self._overview_lines())
+            report_lines.extend(self._streaming_summary_lines())
+            report_lines.extend(self._phase_summary_lines())
+            report_lines.extend(self._resilience_summary_lines())
+            report_lines.extend(self._scoring_summary_lines())
+            report_lines.extend(self._similarity_summary_lines())
+            f.write('\n'.join(report_lines))
+
+            # Each test section is written as soon as it is built
+            for result in self.iter_results():
+                report_lines = [f"\n## Test {result['test_id']}: {result['category']}"]
+                report_lines.append(f"\n**Prompt:**\n```\n{result['prompt']}\n```\n")
+
+                for system_name, response in result['responses'].items():
+                    report_lines.append(f"\n### {system_name}")
+
+                    if response['response'].startswith("ERROR") or response['response'].startswith("SKIPPED"):
+                        report_lines.append(f"\n⚠️ {response['response']}\n")
+                    else:
+                        report_lines.append(f"\n**Response:**\n```python\n{response['response'][:500]}...\n```\n")
+                        report_lines.append(f"**Time:** {response['time']:.2f}s | **Tokens:** {response['tokens']}\n")
+
+                report_lines.append("\n**Manual Evaluation:** (Score each 1-5)")
+                report_lines.append("\n| System | Correctness | Quality | Completeness | Context | Explanation | Total |")
+                report_lines.append("\n|--------|-------------|---------|--------------|---------|-------------|-------|")
+
+                for system_name in result['responses'].keys():
+                    report_lines.append(f"\n| {system_name} | - | - | - | - | - | - |")
+
+                scored = {name: r["scoring"] for name, r in result['responses'].items() if r.get("scoring")}
+                if scored:
+                    report_lines.append("\n\n**Automated Scoring:**")
+                    report_lines.append("\n| System | Code blocks | Syntax OK | Executed | Tests passed | Failed checks |")
+                    report_lines.append("\n|--------|-------------|-----------|----------|--------------|---------------|")
+                    for system_name, scoring in scored.items():
+                        tests = f"{scoring['passed']}/{scoring['total']}" if scoring["total"] else "-"
+                        failed = ", ".join(scoring.get("failed", [])) or "-"
+                        report_lines.append(
+                            f"\n| {system_name} | {scoring['code_blocks']} | {'✅' if scoring['syntax_ok'] else '❌'} "
+                            f"| {'✅' if scoring['executed'] else '❌'} | {tests} | {failed} |"
+                        )
+
+                similar = {name: r["similarity"] for name, r in result['responses'].items() if r.get("similarity")}
+                if similar:
+                    report_lines.append("\n\n**Cross-System Agreement:**")
+                    report_lines.append("\n| System | Agreement | Near-duplicate of |")
+                    report_lines.append("\n|--------|-----------|-------------------|")
+                    for system_name, similarity in similar.items():
+                        agreement = similarity["agreement"]
+                        report_lines.append(
+                            f"\n| {system_name} | {'-' if agreement is None else f'{agreement:.2f}'} "
+                            f"| {', '.join(similarity['near_duplicates']) or '-'} |"
+                        )
+
+                report_lines.append("\n\n---\n")
+                f.write('\n' + '\n'.join(report_lines))
+
+        print(f"✅ Report generated: {report_filename}")
+        return report_filename
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Coding Assistant Evaluation")
+    parser.add_argument("--run-all", action="store_true", help="Run all tests")
+    parser.add_argument("--category", type=str,
+                        help="Run tests for specific category (comma-separated with --corpus/--ids/--shard)")
+    parser.add_argument("--prompt", type=str, help="Test a custom prompt")
+    parser.add_argument("--corpus", type=str,
+                        help="Stream test prompts from a JSONL file (.gz supported) instead of the built-in set")
+    parser.add_argument("--corpus-mmap", action="store_true", help="Memory-map an uncompressed --corpus file")
+    parser.add_argument("--ids", type=str, help="Comma-separated test IDs or glob patterns to run (e.g. S*,N1)")
+    parser.add_argument("--shard", type=str, metavar="I/N",
+                        help="Run only shard I of N (0-based), split by a stable hash of the test ID")
+    parser.add_argument("--merge", type=str, nargs="+", metavar="JOURNAL",
+                        help="Merge journals from sharded runs into --journal and write results and report")
+    parser.add_argument("--list-categories", action="store_true", help="List available categories")
+    parser.add_argument("--list-systems", action="store_true", help="List selectable AI systems")
+    parser.add_argument("--systems", type=str,
+                        help="Comma-separated systems to evaluate, e.g. local,claude (default: all)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Max requests in flight across systems and tests (default: 1 = serial)")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="Keep-alive connections per host for REST interfaces "
+                             "(default: max(HTTP_POOL_SIZE, --concurrency))")
+    parser.add_argument("--replay", action="store_true",
+                        help="Serve responses from the on-disk cache, querying only on a miss")
+    parser.add_argument("--refresh", action="append", default=[], metavar="SYSTEM",
+                        help="With --replay, always re-query this system, by key or name (repeatable)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Response cache directory")
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_MB,
+                        help="Evict least recently used entries above this size")
+    parser.add_argument("--cache-max-age-days", type=float, default=CACHE_MAX_AGE_DAYS,
+                        help="Expire cache entries older than this")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses and record TTFT, inter-token latency and tokens/sec")
+    parser.add_argument("--score", action="store_true",
+                        help="Execute response code against hidden tests in sandboxed processes")
+    parser.add_argument("--score-workers", type=int, default=None,
+                        help="Parallel scoring processes (default: all cores)")
+    parser.add_argument("--similarity", action="store_true",
+                        help="Score cross-system agreement and flag near-duplicate responses (needs numpy)")
+    parser.add_argument("--summary", nargs="*", metavar="JOURNAL",
+                        help="Write markdown/CSV summary tables by system, category and test (needs numpy); "
+                             "given journals, summarise those instead of running tests")
+    parser.add_argument("--summary-parquet", action="store_true",
+                        help="With --summary, also export the result rows as Parquet (needs pyarrow)")
+    parser.add_argument("--journal", type=str,
+                        help="JSONL file each result is appended to (default: evaluation_journal_<timestamp>.jsonl)")
+    parser.add_argument("--resume", type=str, metavar="JOURNAL",
+                        help="Continue an interrupted run, skipping pairs already in this journal")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries for timeouts, connection errors and 5xx, with jittered backoff "
+                             f"(default: {DEFAULT_RETRIES})")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Send a duplicate request when one runs past the system's recent p95")
+    parser.add_argument("--recount-tokens", type=str, metavar="JOURNAL",
+                        help="Recount tokens not reported by providers in a journal (e.g. after adding tokenizer files)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Collect runner metrics and write an OpenMetrics dump at the end")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Also serve live metrics on http://0.0.0.0:<port>/metrics (implies --metrics)")
+    parser.add_argument("--metrics-file", type=str,
+                        help="OpenMetrics dump path (default: metrics_<timestamp>.prom)")
+
+    bench = parser.add_argument_group("benchmarking")
+    bench.add_argument("--benchmark", action="store_true",
+                       help="Repeat each selected (test, system) pair and report latency/throughput statistics")
+    bench.add_argument("--repeat", type=int, default=10, help="Measured runs per pair (default: 10)")
+    bench.add_argument("--warmup", type=int, default=2, help="Discarded warm-up runs per pair (default: 2)")
+    bench.add_argument("--baseline", type=str, help="Benchmark JSON to compare against; exits 1 on regression")
+    bench.add_argument("--regression-threshold", type=float, default=REGRESSION_THRESHOLD,
+                       help="Relative median change treated as a regression (default: 0.10)")
+
+    sweep = parser.add_argument_group("context-length sweep")
+    sweep.add_argument("--context-sweep", action="store_true",
+                       help="Measure latency/TTFT/throughput as prompt context grows (use with --stream)")
+    sweep.add_argument("--context-sizes", type=str, default=",".join(str(n) for n in CONTEXT_SWEEP_SIZES),
+                       help="Comma-separated prompt sizes in tokens (default: 1000,4000,16000,32000)")
+    sweep.add_argument("--context-source", type=str,
+                       help="Python file or directory used as padding (default: this script)")
+    sweep.add_argument("--sweep-repeat", type=int, default=3, help="Runs per size and system (default: 3)")
+
+    batch = parser.add_argument_group("batch submission")
+    batch.add_argument("--batch", action="store_true",
+                       help="Submit the selected tests as one batch job per provider and poll for results "
+                            "(systems without a batch API are queried normally; --stream is ignored)")
+    batch.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                       help=f"Tests per batch job (default: {BATCH_SIZE})")
+    batch.add_argument("--batch-poll-interval", type=float, default=BATCH_POLL_INTERVAL,
+                       help=f"Initial seconds between status polls, growing to {BATCH_POLL_MAX_INTERVAL:.0f} "
+                            f"(default: {BATCH_POLL_INTERVAL:g})")
+    batch.add_argument("--batch-timeout", type=float, default=BATCH_TIMEOUT,
+                       help="Seconds to wait for a batch before recording its requests as errors (default: 24h)")
+
+    replay = parser.add_argument_group("session replay")
+    replay.add_argument("--session-replay", action="store_true",
+                        help="Replay multi-turn conversations against the local backend, with and without session reuse")
+    replay.add_argument("--sessions", type=int, default=16, help="Conversations to replay (default: 16)")
+    replay.add_argument("--turns", type=int, default=5, help=f"Turns per conversation, 1 to {SESSION_MAX_TURNS} (default: 5)")
+    replay.add_argument("--session-concurrency", type=int, default=8,
+                        help="Conversations in flight at once (default: 8)")
+
+    mock = parser.add_argument_group("mock provider server")
+    mock.add_argument("--mock-server", action="store_true",
+                      help="Serve deterministic stand-ins for the local, OpenAI and Perplexity APIs")
+    mock.add_argument("--mock-port", type=int, default=8000, help="Mock server port (default: 8000)")
+    mock.add_argument("--mock-latency", type=str, default="fixed:0.05",
+                      help="Latency distribution: fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA")
+    mock.add_argument("--mock-chunk-interval", type=float, default=0.01, help="Seconds between streamed chunks")
+    mock.add_argument("--mock-chunk-words", type=int, default=1, help="Words per streamed chunk")
+    mock.add_argument("--mock-error-rate", type=float, default=0.0, help="Share of requests failing with HTTP 500")
+    mock.add_argument("--mock-429-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    mock.add_argument("--mock-retry-after", type=float, default=1.0, help="Retry-After seconds on injected 429s")
+    mock.add_argument("--mock-responses", type=str,
+                      help="JSON file of canned responses keyed by prompt or test ID")
+    mock.add_argument("--mock-seed", type=int, default=0, help="Seed for latency and fault injection")
+    mock.add_argument("--mock-prefill-rate", type=float,
+                      help="Add prompt_tokens / RATE seconds of latency, to emulate long-context prefill")
+    mock.add_argument("--mock-batch-concurrency", type=int, default=8,
+                      help="Requests of a /api/batch job the mock processes at once (default: 8)")
+    mock.add_argument("--mock-no-session-cache", action="store_true",
+                      help="With --mock-prefill-rate, re-prefill each session's earlier turns on every request")
+    mock.add_argument("--harness-benchmark", action="store_true",
+                      help="Benchmark the runner itself against an in-process mock server")
+    mock.add_argument("--harness-tests", type=int, default=200, help="Synthetic tests per harness benchmark step")
+    mock.add_argument("--harness-concurrency", type=str, default="1,4,16,64",
+                      help="Comma-separated concurrency levels for --harness-benchmark")
+
+    load = parser.add_argument_group("load testing (local instance)")
+    load.add_argument("--load-test", action="store_true",
+                      help="Run virtual users against the local instance instead of the evaluation")
+    load.add_argument("--users", type=str, default="1,2,4,8,16",
+                      help="Comma-separated virtual user counts, one step each (default: 1,2,4,8,16)")
+    load.add_argument("--arrival", choices=["closed", "open"], default="closed",
+                      help="closed: users wait for replies; open: Poisson arrivals at --rate per user")
+    load.add_argument("--rate", type=float, default=0.5, help="Open-loop requests/sec per user")
+    load.add_argument("--think-time", type=float, default=0.0, help="Closed-loop mean pause between requests (s)")
+    load.add_argument("--ramp-up", type=float, default=10.0, help="Seconds to ramp up each step")
+    load.add_argument("--duration", type=float, default=60.0, help="Soak seconds per step after ramp-up")
+
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    if args.list_categories:
+        print("\n📋 Available test categories:")
+        for category, tests in TEST_PROMPTS.items():
+            print(f"  - {category}: {len(tests)} tests")
+        return
+
+    if args.list_systems:
+        print("\n📋 Available systems:")
+        for key, (name, _) in SYSTEM_REGISTRY.items():
+            print(f"  - {key}: {name}")
+        return
+
+    selected_systems = args.systems.split(",") if args.systems else None
+    try:
+        resolve_systems(selected_systems)
+        resolve_systems(args.refresh)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.mock_server or args.harness_benchmark:
+        responses = None
+        if args.mock_responses:
+            with open(args.mock_responses, encoding='utf-8') as f:
+                responses = json.load(f)
+        try:
+            config = MockProviderConfig(
+                latency=args.mock_latency, chunk_interval=args.mock_chunk_interval,
+                chunk_words=args.mock_chunk_words, error_rate=args.mock_error_rate,
+                rate_limit_rate=args.mock_429_rate, retry_after=args.mock_retry_after,
+                seed=args.mock_seed, responses=responses, prefill_rate=args.mock_prefill_rate,
+                session_cache=not args.mock_no_session_cache, batch_concurrency=args.mock_batch_concurrency
+            )
+        except ValueError as e:
+            parser.error(str(e))
+
+        if args.mock_server:
+            server = MockProviderServer(config, port=args.mock_port)
+            print(f"🧪 Mock provider listening on {server.url} (Ctrl-C to stop)")
+            print(f"   LOCAL_AI_URL={server.url} PERPLEXITY_BASE_URL={server.url} "
+                  f"OPENAI_BASE_URL={server.url}/v1")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+            return
+
+        server = MockProviderServer(config).start()
+        server.point_interfaces_here()
+        levels = [int(level) for level in args.harness_concurrency.split(",") if level.strip()]
+        systems = selected_systems or ["local", "perplexity", "chatgpt"]
+        print(f"\n🧪 Harness benchmark: {args.harness_tests} tests x {systems} against {server.url}")
+        benchmark = HarnessBenchmark(server, systems, tests=args.harness_tests,
+                                     concurrency_levels=levels, stream=args.stream)
+        benchmark.run()
+        benchmark.save_results()
+        server.stop()
+        return
+
+    metrics = EvaluationMetrics() if (args.metrics or args.metrics_port or args.metrics_file) else None
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(metrics, port=args.metrics_port)
+        print(f"📈 Metrics: http://localhost:{args.metrics_port}/metrics")
+
+    if args.load_test:
+        try:
+            user_steps = [int(users) for users in args.users.split(",") if users.strip()]
+        except ValueError:
+            parser.error("--users must be a comma-separated list of integers")
+        tester = LoadTester(
+            LocalInstanceInterface(pool_size=max(user_steps) * 4),
+            user_steps, arrival=args.arrival, rate=args.rate, think_time=args.think_time,
+            ramp_up=args.ramp_up, duration=args.duration, metrics=metrics
+        )
+        try:
+            tester.run()
+        finally:
+            if metrics:
+                metrics.save(args.metrics_file)
+            if metrics_server:
+                metrics_server.stop()
+        print("\n" + "\n".join(tester.summary_lines()))
+        tester.save_results()
+        return
+
+    if args.session_replay:
+        categories = [c.strip() for c in args.category.split(",")] if args.category else None
+        try:
+            tests = list(iter_builtin_tests(categories))
+        except ValueError as e:
+            parser.error(str(e))
+        if not 1 <= args.turns <= SESSION_MAX_TURNS:
+            parser.error(f"--turns must be between 1 and {SESSION_MAX_TURNS}")
+        try:
+            replay = SessionReplay(LocalInstanceInterface(pool_size=args.session_concurrency * 2),
+                                   sessions=args.sessions, turns=args.turns,
+                                   concurrency=args.session_concurrency, stream=args.stream, tests=tests)
+        except ValueError as e:
+            parser.error(str(e))
+        replay.run()
+        print("\n" + "\n".join(replay.summary_lines()))
+        replay.save_results()
+        return
+
+    if args.recount_tokens:
+        if not os.path.exists(args.recount_tokens):
+            parser.error(f"journal not found: {args.recount_tokens}")
+        journal = ResultJournal(args.recount_tokens)
+        counter = TokenCounter(db_path=None if args.no_cache else os.path.join(args.cache_dir, "token_counts.db"))
+        updated = recount_journal_tokens(journal, counter)
+        print(f"🔢 Recounted tokens: {updated} records updated "
+              f"({counter.misses} texts tokenized, {counter.hits} memoized)")
+        counter.close()
+        journal.close()
+        return
+
+    if args.summary:
+        missing = [path for path in args.summary if not os.path.exists(path)]
+        if missing:
+            parser.error(f"journal not found: {', '.join(missing)}")
+        try:
+            table = ResultTable.from_journals(args.summary)
+        except ImportError:
+            parser.error("--summary needs numpy (pip install numpy)")
+        files = table.save_summary(parquet=args.summary_parquet)
+        print(f"📊 Summarised {len(table)} results: {', '.join(files)}")
+        return
+
+    if args.merge:
+        missing = [path for path in args.merge if not os.path.exists(path)]
+        if missing:
+            parser.error(f"journal not found: {', '.join(missing)}")
+        output = args.journal or f"merged_journal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        if os.path.exists(output) and os.path.getsize(output):
+            parser.error(f"refusing to merge into non-empty journal: {output}")
+        journal = merge_journals(args.merge, output)
+        runner = EvaluationRunner(journal=journal, systems=selected_systems, verbose=False)
+        if args.score:
+            runner.score_results(args.score_workers)
+        if args.similarity:
+            runner.analyze_similarity()
+        if args.summary is not None:
+            runner.save_summary(args.summary_parquet)
+        runner.save_results()
+        runner.generate_report()
+        journal.close()
+        return
+
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    id_patterns = [p.strip() for p in args.ids.split(",") if p.strip()] if args.ids else None
+    use_selection = bool(args.corpus or id_patterns or shard)
+    if args.corpus and not os.path.exists(args.corpus):
+        parser.error(f"corpus not found: {args.corpus}")
+    if use_selection and args.category and not args.corpus:
+        unknown = [c for c in args.category.split(",") if c.strip() not in TEST_PROMPTS]
+        if unknown:
+            parser.error(f"unknown category: {', '.join(unknown)}")
+
+    def selected_tests():
+        """Lazily yield the tests chosen by --corpus/--category/--ids/--shard"""
+        categories = [c.strip() for c in args.category.split(",")] if args.category else None
+        if args.corpus:
+            source = PromptCorpus(args.corpus, use_mmap=args.corpus_mmap).iter_tests(categories)
+        else:
+            source = iter_builtin_tests(categories)
+        return select_tests(source, id_patterns, shard)
+
+    if args.context_sweep:
+        try:
+            sizes = [int(size) for size in args.context_sizes.split(",") if size.strip()]
+        except ValueError:
+            parser.error("--context-sizes must be a comma-separated list of integers")
+        runner = EvaluationRunner(stream=args.stream, pool_size=args.pool_size, systems=selected_systems,
+                                  retries=0)
+        try:
+            sweep = ContextSweep(runner, sizes, repeat=args.sweep_repeat,
+                                 seed_task=args.prompt or CONTEXT_SEED_TASK, source=args.context_source)
+        except (OSError, ValueError) as e:
+            parser.error(f"--context-source: {e}")
+        sweep.run()
+        print("\n".join(sweep.summary_lines()))
+        sweep.save_results()
+        return
+
+    if not (args.run_all or args.category or args.prompt or use_selection):
+        print("❌ No action specified. Use --help for options")
+        return
+
+    if args.benchmark:
+        if args.category and not use_selection and args.category not in TEST_PROMPTS:
+            parser.error(f"unknown category: {args.category}")
+        if args.prompt:
+            test_cases = [{"id": "CUSTOM", "prompt": args.prompt, "category": "Custom", "expected_features": []}]
+        elif use_selection:
+            test_cases = list(selected_tests())
+        elif args.category:
+            test_cases = TEST_PROMPTS[args.category]
+        else:
+            test_cases = [test_case for tests in TEST_PROMPTS.values() for test_case in tests]
+
+        # Benchmarks always hit the backends; the cache is neither read nor written,
+        # and failures are counted rather than retried
+        runner = EvaluationRunner(stream=args.stream, pool_size=args.pool_size, systems=selected_systems,
+                                  retries=0)
+        benchmark = Benchmark(runner, repeat=args.repeat, warmup=args.warmup)
+        benchmark.run(test_cases)
+        benchmark.save_results()
+
+        if args.baseline:
+            regressions = benchmark.compare(args.baseline, args.regression_threshold)
+            if regressions:
+                print(f"\n❌ {len(regressions)} regression(s) vs {args.baseline}:")
+                for r in regressions:
+                    print(f"   {r['test_id']} / {r['system']} {r['metric']}: "
+                          f"{r['baseline']:.3f} -> {r['current']:.3f} ({r['change']:+.1%})")
+                raise SystemExit(1)
+            print(f"\n✅ No regressions vs {args.baseline}")
+        return
+
+    if args.replay and args.no_cache:
+        parser.error("--replay needs the response cache; drop --no-cache")
+
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_dir, args.cache_max_mb, args.cache_max_age_days)
+
+    if args.resume:
+        if not os.path.exists(args.resume):
+            parser.error(f"journal not found: {args.resume}")
+        journal_path = args.resume
+    else:
+        journal_path = args.journal or f"evaluation_journal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    journal = ResultJournal(journal_path)
+    print(f"📝 Journal: {journal_path}")
+
+    token_counter = TokenCounter(db_path=None if args.no_cache else os.path.join(args.cache_dir, "token_counts.db"))
+    runner = EvaluationRunner(concurrency=args.concurrency, stream=args.stream, pool_size=args.pool_size,
+                              cache=cache, replay=args.replay, refresh=args.refresh, journal=journal,
+                              systems=selected_systems, metrics=metrics, retries=args.retries, hedge=args.hedge,
+                              token_counter=token_counter)
+    if runner.completed:
+        print(f"⏭️  Resuming: {len(runner.completed)} (test, system) pairs already done")
+
+    try:
+        if args.batch:
+            if args.prompt:
+                tests = [{"id": "CUSTOM", "prompt": args.prompt, "category": "Custom", "expected_features": []}]
+            elif use_selection:
+                tests = selected_tests()
+            elif args.category:
+                if args.category not in TEST_PROMPTS:
+                    parser.error(f"unknown category: {args.category}")
+                tests = TEST_PROMPTS[args.category]
+            else:
+                tests = iter_builtin_tests()
+            BatchRunner(runner, batch_size=args.batch_size, poll_interval=args.batch_poll_interval,
+                        timeout=args.batch_timeout).run(tests)
+        elif use_selection and not args.prompt:
+            print(f"\n🚀 Running selected tests{f' (shard {args.shard})' if shard else ''}...")
+            runner.run_tests(selected_tests())
+        elif args.run_all:
+            runner.run_all()
+        elif args.category:
+            runner.run_category(args.category)
+        else:
+            test_case = {
+                "id": "CUSTOM",
+                "prompt": args.prompt,
+                "category": "Custom",
+                "expected_features": []
+            }
+            runner.run_single_test(test_case)
+    except KeyboardInterrupt:
+        journal.close()
+        if metrics:
+            metrics.save(args.metrics_file)
+        print(f"\n⛔ Interrupted. Continue with: --resume {journal_path}")
+        raise SystemExit(130)
+
+    if metrics:
+        metrics.save(args.metrics_file)
+    if metrics_server:
+        metrics_server.stop()
+
+    for system_name, stats in runner.connection_stats().items():
+        if stats["requests"]:
+            print(f"🔌 {system_name}: {stats['requests']} requests over "
+                  f"{stats['connections_opened']} connections")
+
+    if cache:
+        stats = cache.stats()
+        print(f"💾 Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+        cache.close()
+    token_counter.close()
+
+    if args.score:
+        runner.score_results(args.score_workers)
+    if args.similarity:
+        runner.analyze_similarity()
+    if args.summary is not None:
+        runner.save_summary(args.summary_parquet)
 
     # Save results
     runner.save_results()
     runner.generate_report()
+    journal.close()
 
     print("\n✅ Evaluation complete!")
     print("\nNext steps:")
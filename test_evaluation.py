@@ -0,0 +1,828 @@
+"""
+Unit tests for the pure-logic parts of evaluation_test.py
+
+No API keys or network access needed: provider keys are removed from the
+environment, HTTP tests talk to an in-process MockProviderServer, and the
+sandbox tests only run hidden test code in a local subprocess.
+
+Usage:
+    python -m pytest -q test_evaluation.py
+"""
+
+import sys
+import threading
+import time
+from typing import List, Dict, Any
+
+import pytest
+
+import evaluation_test as ev
+
+
+@pytest.fixture(autouse=True)
+def no_api_keys(monkeypatch):
+    for name in ("ANTHROPIC_API_KEY", "OPENAI_API_KEY", "PERPLEXITY_API_KEY", "XAI_API_KEY"):
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    """Start a MockProviderServer with the given config; the local interface is pointed at it"""
+    servers = []
+
+    def start(**config) -> ev.MockProviderServer:
+        config.setdefault("latency", "fixed:0.0")
+        config.setdefault("chunk_interval", 0.0)
+        server = ev.MockProviderServer(ev.MockProviderConfig(**config)).start()
+        servers.append(server)
+        monkeypatch.setenv("LOCAL_AI_URL", server.url)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def make_record(test_id: str, system: str, text: str = "def f(): pass", time: float = 1.0,
+                category: str = "Code Generation", **response) -> Dict[str, Any]:
+    return {"test_id": test_id, "system": system, "category": category,
+            "response": dict({"response": text, "tokens": 10, "time": time, "model": "m"}, **response)}
+
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+
+def test_token_bucket_delay_follows_refill_rate():
+    bucket = ev.TokenBucket(per_minute=60)  # One unit per second
+    now = bucket.updated
+    assert bucket.delay_for(60, now) == 0.0
+    bucket.consume(60)
+
+    assert bucket.delay_for(1, now) == pytest.approx(1.0)
+    assert bucket.delay_for(1, now + 0.25) == pytest.approx(0.75)
+    assert bucket.delay_for(500, now + 60) == 0.0  # Capped at capacity, and refilled
+
+
+def test_rate_limiter_waits_for_token_budget():
+    limiter = ev.RateLimiter(tpm=6000)  # 100 tokens per second
+    assert limiter.acquire(6000) == 0.0
+
+    waited = limiter.acquire(10)
+    assert waited == pytest.approx(0.1, abs=0.05)
+
+
+def test_rate_limiter_backoff_doubles_until_success(monkeypatch):
+    monkeypatch.setattr(ev, "RATE_LIMIT_BACKOFF_BASE", 0.5)
+    limiter = ev.RateLimiter()
+    assert [limiter.backoff() for _ in range(3)] == [0.5, 1.0, 2.0]
+    assert limiter.backoff(retry_after=0.25) == 0.25
+
+    limiter.record(actual_tokens=0)
+    assert limiter.backoff() == 0.5
+    assert limiter.blocked_until > time.monotonic()
+
+
+def test_rate_limiter_for_provider_env_override(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_RPM", "5")
+    monkeypatch.setenv("ANTHROPIC_TPM", "")
+    limiter = ev.RateLimiter.for_provider("anthropic")
+
+    assert limiter.requests.capacity == 5
+    assert limiter.tokens is None  # An empty override disables the limit
+    assert ev.RateLimiter.for_provider("openai").tokens.capacity == ev.RATE_LIMITS["openai"]["tpm"]
+
+
+# ============================================================================
+# STREAMING
+# ============================================================================
+
+def sse(chunks) -> list:
+    return list(ev.iter_sse_events(chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                                   for chunk in chunks))
+
+
+def test_sse_keeps_newlines_and_spaces_in_content():
+    body = "data: def f():\ndata:     return 1\n\ndata:  two spaces \n\ndata: [DONE]\n\n"
+    assert sse([body]) == ["def f():\n    return 1", " two spaces "]
+
+
+def test_sse_reassembles_events_split_across_chunks():
+    body = "data: first line\r\ndata: second\r\n\r\n: comment\n\ndata: caf\u00e9\n\ndata: [DONE]\n\n".encode("utf-8")
+    expected = ["first line\nsecond", "caf\u00e9"]
+    # Every split point, including inside CRLF pairs and the two-byte "\u00e9"
+    for cut in range(1, len(body)):
+        assert sse([body[:cut], body[cut:]]) == expected, cut
+    assert sse([body[i:i + 1] for i in range(len(body))]) == expected
+
+
+def test_sse_stops_at_done_and_tolerates_missing_final_blank_line():
+    assert sse(["data: a\n\n", "data: [DONE]\n\n", "data: ignored\n\n"]) == ["a"]
+    assert sse(["data: a\n\ndata: b"]) == ["a", "b"]
+
+
+def test_local_stream_matches_non_streamed_text(mock_server):
+    mock_server(chunk_words=3)
+    local = ev.LocalInstanceInterface()
+    plain = local.query("prompt")
+    streamed = local.query("prompt", stream=True)
+
+    assert "\n" in plain["response"]
+    assert streamed["response"] == plain["response"]
+    assert streamed["stream"]["chunks"] > 1
+    assert streamed["stream"]["ttft"] is not None
+
+
+# ============================================================================
+# CONNECTION POOLING
+# ============================================================================
+
+def test_local_instance_reuses_one_connection(mock_server):
+    mock_server()
+    system = ev.LocalInstanceInterface(pool_size=2)
+    for i in range(5):
+        assert not system.query(f"prompt {i}")["response"].startswith("ERROR")
+    assert not system.query("streamed", stream=True)["response"].startswith("ERROR")
+
+    stats = system.connection_stats()
+    assert stats["requests"] == 6
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 5
+
+
+def test_reused_connection_has_no_setup_phases(mock_server):
+    mock_server()
+    system = ev.LocalInstanceInterface()
+    first, second = (system.query("phases")["phases"] for _ in range(2))
+
+    assert first["connection_reused"] is False and first["connect"] is not None
+    assert second["connection_reused"] is True
+    assert second["dns"] is None and second["connect"] is None
+
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+
+def test_cache_key_is_content_addressed():
+    identity = {"system": "Local Instance", "model": "m", "base_url": "http://x"}
+    key = ev.ResponseCache.key(identity, "prompt", stream=False)
+
+    assert key == ev.ResponseCache.key(dict(reversed(list(identity.items()))), "prompt", stream=False)
+    assert key != ev.ResponseCache.key(identity, "prompt ", stream=False)
+    assert key != ev.ResponseCache.key(identity, "prompt", stream=True)
+    assert key != ev.ResponseCache.key(dict(identity, model="m2"), "prompt", stream=False)
+
+
+def test_replay_serves_cache_for_systems_without_keys(tmp_path):
+    cache = ev.ResponseCache(str(tmp_path / "cache"))
+    runner = ev.EvaluationRunner(systems=["claude"], cache=cache, replay=True, verbose=False)
+    [claude] = runner.systems
+    assert not claude.available
+
+    key = ev.ResponseCache.key(claude.cache_identity(), "cached prompt", stream=False)
+    cache.put(key, claude.name, {"response": "from cache", "tokens": 5, "time": 1.2, "model": "m"})
+
+    hit = runner._query_system(claude, "cached prompt")
+    assert hit["response"] == "from cache"
+    assert hit["cached"] is True
+    assert runner._query_system(claude, "other prompt")["response"].startswith("SKIPPED")
+    cache.close()
+
+
+# ============================================================================
+# RESULT JOURNAL
+# ============================================================================
+
+def test_completed_pairs_only_counts_successes(tmp_path):
+    journal = ev.ResultJournal(str(tmp_path / "journal.jsonl"))
+    journal.append(make_record("S1", "Claude"))
+    journal.append(make_record("S1", "ChatGPT", text="ERROR: timeout"))
+    journal.append(make_record("S2", "ChatGPT", text="SKIPPED: OPENAI_API_KEY not set"))
+    journal.append(make_record("S2", "Claude", text="ERROR: HTTP 500"))
+    journal.append(make_record("S2", "Claude"))  # Retried on resume
+    journal.append(make_record("S3", "Claude"))
+    journal.append(make_record("S3", "Claude", text="ERROR: HTTP 500"))  # Latest record wins
+    journal.close()
+
+    assert journal.completed_pairs() == {("S1", "Claude"), ("S2", "Claude")}
+
+
+def test_completed_pairs_ignores_truncated_last_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = ev.ResultJournal(str(path))
+    journal.append(make_record("S1", "Claude"))
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"test_id": "S2", "sys')
+
+    assert ev.ResultJournal(str(path)).completed_pairs() == {("S1", "Claude")}
+
+
+# ============================================================================
+# SANDBOX SCORING
+# ============================================================================
+
+GOOD_PRIME = '''```python
+def is_prime(n: int) -> bool:
+    if not isinstance(n, int) or isinstance(n, bool):
+        raise TypeError("n must be an int")
+    if n < 2:
+        return False
+    i = 2
+    while i * i <= n:
+        if n % i == 0:
+            return False
+        i += 1
+    return True
+```'''
+
+GOOD_LRU = '''```python
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = OrderedDict()
+
+    def get(self, key):
+        if key not in self.data:
+            return -1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.capacity:
+            self.data.popitem(last=False)
+```'''
+
+# Correct results, but get/put are O(n)
+SLOW_LRU = '''```python
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.keys = []
+        self.data = {}
+
+    def get(self, key):
+        if key not in self.data:
+            return -1
+        self.keys.remove(key)
+        self.keys.append(key)
+        return self.data[key]
+
+    def put(self, key, value):
+        if key in self.data:
+            self.keys.remove(key)
+        self.keys.append(key)
+        self.data[key] = value
+        if len(self.keys) > self.capacity:
+            del self.data[self.keys.pop(0)]
+```'''
+
+GOOD_DUPLICATES = '''```python
+def find_duplicates(items):
+    seen, duplicates = set(), set()
+    for item in items:
+        if item in seen:
+            duplicates.add(item)
+        seen.add(item)
+    return list(duplicates)
+```'''
+
+# Correct results, but quadratic
+SLOW_DUPLICATES = '''```python
+def find_duplicates(items):
+    duplicates = []
+    for i, item in enumerate(items):
+        if item in items[i + 1:] and item not in duplicates:
+            duplicates.append(item)
+    return duplicates
+```'''
+
+
+@pytest.mark.parametrize("test_id, text", [
+    ("S1", GOOD_PRIME),
+    ("C1", GOOD_LRU),
+    ("D2", GOOD_DUPLICATES),
+])
+def test_sandbox_passes_correct_solutions(test_id, text):
+    scoring = ev.score_response(test_id, text)
+    assert scoring["executed"]
+    assert scoring["failed"] == []
+    assert scoring["passed"] == scoring["total"] > 0
+    assert scoring["score"] == 1.0
+
+
+@pytest.mark.parametrize("test_id, text, failed", [
+    ("C1", SLOW_LRU, ["O(1) get/put"]),
+    ("D2", SLOW_DUPLICATES, ["linear time"]),
+])
+def test_sandbox_fails_slow_solutions(test_id, text, failed):
+    scoring = ev.score_response(test_id, text)
+    assert scoring["failed"] == failed
+    assert scoring["passed"] == scoring["total"] - 1
+
+
+def test_sandbox_does_not_run_invalid_syntax():
+    scoring = ev.score_response("S1", "```python\ndef is_prime(n)\n```")
+    assert scoring["syntax_ok"] is False
+    assert scoring["executed"] is False
+    assert scoring["score"] is None
+
+
+def test_sandbox_scores_zero_when_function_is_missing():
+    scoring = ev.score_response("S1", "```python\ndef other(n):\n    return n\n```")
+    assert scoring["score"] == 0.0
+    assert scoring["total"] == 6
+    assert scoring["errors"] == ["no function named like ['prime']"]
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+@pytest.mark.parametrize("response, expected", [
+    ({"time": 2.0, "tokens": 100, "input_tokens": 80, "output_tokens": 20}, 10.0),
+    ({"time": 2.0, "tokens": 100, "output_tokens": 20, "stream": {"tokens_per_sec": 25.0}}, 25.0),
+    ({"time": 2.0, "tokens": 100, "output_tokens": 20, "tokens_per_sec": 12.5}, 12.5),
+    ({"time": 2.0, "tokens": 100}, None),
+    ({"time": 0.0, "output_tokens": 20}, None),
+])
+def test_throughput_uses_output_tokens(response, expected):
+    assert ev.Benchmark._throughput(response) == expected
+
+
+# ============================================================================
+# PROVIDER REGISTRY
+# ============================================================================
+
+def test_refresh_accepts_registry_keys_and_names(tmp_path, mock_server):
+    mock_server(responses={"prompt": "fresh answer"})
+    cache = ev.ResponseCache(str(tmp_path / "cache"))
+    for refresh in (["local"], ["Local Instance"]):
+        runner = ev.EvaluationRunner(systems=["local"], cache=cache, replay=True, refresh=refresh, verbose=False)
+        [local] = runner.systems
+        key = ev.ResponseCache.key(local.cache_identity(), "prompt", stream=False)
+        cache.put(key, local.name, {"response": "stale answer", "tokens": 5, "time": 1.0, "model": "m"})
+
+        assert runner.refresh == {"Local Instance"}
+        assert runner._query_system(local, "prompt")["response"] == "fresh answer"
+    cache.close()
+
+    with pytest.raises(ValueError, match="Unknown system: nope"):
+        ev.EvaluationRunner(systems=["local"], refresh=["nope"], verbose=False)
+
+
+def test_missing_requests_marks_http_systems_unavailable(monkeypatch):
+    monkeypatch.setitem(sys.modules, "requests", None)  # Makes `import requests` fail
+    monkeypatch.setenv("PERPLEXITY_API_KEY", "unused")
+    local, perplexity = ev.build_systems(["local", "perplexity"])
+
+    assert not local.available and not perplexity.available
+    assert local.query("prompt")["response"].startswith("SKIPPED")
+    assert perplexity.query("prompt")["response"].startswith("SKIPPED")
+    assert local.connection_stats() is None
+
+
+# ============================================================================
+# MOCK SERVER
+# ============================================================================
+
+def test_mock_server_accounts_simulated_latency(mock_server):
+    server = mock_server(latency="fixed:0.02", chunk_interval=0.001)
+    local = ev.LocalInstanceInterface()
+    local.query("hello")
+    chunks = len(server.config.response_for("hello").split(" "))
+    local.query("hello", stream=True)
+
+    assert server.stats["requests"] == 2
+    assert server.stats["service_seconds"] == pytest.approx(0.04 + chunks * 0.001)
+    assert ev.MockProviderHandler.disable_nagle_algorithm
+
+
+def test_harness_benchmark_ideal_excludes_harness_overhead(mock_server):
+    server = mock_server(latency="fixed:0.01")
+    benchmark = ev.HarnessBenchmark(server, ["local"], tests=10, concurrency_levels=[1])
+    [step] = benchmark.run()
+
+    assert step["requests"] == 10
+    assert step["errors"] == 0
+    # Ideal is 10 x 10 ms of simulated latency; the measured wall time includes the harness
+    assert step["wall_time"] >= 0.1
+    assert step["efficiency"] == pytest.approx(0.1 / step["wall_time"])
+    assert step["overhead_per_request_ms"] == pytest.approx((step["wall_time"] - 0.1) * 100)
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+def test_metrics_render_openmetrics():
+    metrics = ev.EvaluationMetrics()
+    ok = {"response": "def f(): pass", "tokens": 42, "time": 0.3, "model": "m", "stream": {"ttft": 0.05}}
+    metrics.observe_response("Claude", "Code Generation", ok)
+    metrics.observe_response("Claude", "Code Generation", {"response": "ERROR: HTTP 500", "time": 0.1})
+    metrics.observe_response("Claude", "Code Generation", dict(ok, cached=True))
+    lines = metrics.render().splitlines()
+
+    assert lines[-1] == "# EOF"
+    assert 'eval_requests_total{system="Claude",category="Code Generation",status="ok"} 1' in lines
+    assert 'eval_requests_total{system="Claude",category="Code Generation",status="error"} 1' in lines
+    assert 'eval_cache_hits_total{system="Claude"} 1' in lines
+    assert 'eval_tokens_total{system="Claude",category="Code Generation"} 42' in lines
+    assert 'eval_request_duration_seconds_bucket{system="Claude",category="Code Generation",le="0.25"} 0' in lines
+    assert 'eval_request_duration_seconds_bucket{system="Claude",category="Code Generation",le="0.5"} 1' in lines
+    assert 'eval_request_duration_seconds_bucket{system="Claude",category="Code Generation",le="+Inf"} 1' in lines
+    assert 'eval_request_duration_seconds_count{system="Claude",category="Code Generation"} 1' in lines
+    assert 'eval_time_to_first_token_seconds_count{system="Claude",category="Code Generation"} 1' in lines
+
+
+def test_metrics_escape_label_values():
+    metric = ev.Metric("eval_test", "counter", "Escaping", ("system",))
+    metric.inc(system='a "quoted"\\name\n')
+    assert metric.render()[-1] == 'eval_test_total{system="a \\"quoted\\"\\\\name\\n"} 1'
+
+
+# ============================================================================
+# SHARDED RUNS
+# ============================================================================
+
+def write_journal(path, records) -> str:
+    journal = ev.ResultJournal(str(path))
+    for record in records:
+        journal.append(record)
+    journal.close()
+    return str(path)
+
+
+def merged_responses(tmp_path, *shards) -> Dict[Any, str]:
+    paths = [write_journal(tmp_path / f"shard{i}.jsonl", records) for i, records in enumerate(shards)]
+    merged = ev.merge_journals(paths, str(tmp_path / "merged.jsonl"))
+    merged.close()
+    return {(r["test_id"], r["system"]): r["response"]["response"] for r in merged.iter_records()}
+
+
+def test_merge_keeps_success_over_later_skip(tmp_path):
+    ok = dict(make_record("S1", "Claude", text="answer"), timestamp="2026-01-01T10:00:00")
+    skipped = dict(make_record("S1", "Claude", text="SKIPPED - No API key"), timestamp="2026-01-01T11:00:00")
+
+    assert merged_responses(tmp_path, [ok], [skipped]) == {("S1", "Claude"): "answer"}
+
+
+def test_merge_ranks_ok_over_error_over_skipped(tmp_path):
+    def at(hour, test_id, text):
+        return dict(make_record(test_id, "Local", text=text), timestamp=f"2026-01-01T{hour:02d}:00:00")
+
+    merged = merged_responses(
+        tmp_path,
+        [at(1, "S1", "ERROR: HTTP 500"), at(1, "S2", "old answer"), at(3, "S3", "ERROR: timeout")],
+        [at(2, "S1", "SKIPPED - No API key"), at(2, "S2", "new answer"), at(4, "S3", "SKIPPED - No API key")],
+    )
+    assert merged == {("S1", "Local"): "ERROR: HTTP 500", ("S2", "Local"): "new answer",
+                      ("S3", "Local"): "ERROR: timeout"}
+
+
+# ============================================================================
+# RETRIES AND HEDGING
+# ============================================================================
+
+class CountingLimiter(ev.RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.acquired = 0
+
+    def acquire(self, estimated_tokens: int = 0) -> float:
+        self.acquired += 1
+        return super().acquire(estimated_tokens)
+
+
+class ScriptedSystem(ev.AISystemInterface):
+    """Answers query() calls in order from a script of (seconds, response text, status code)"""
+
+    def __init__(self, script):
+        super().__init__("Scripted")
+        self.script = list(script)
+        self.calls = 0
+        self.rate_limiter = CountingLimiter()
+        self._lock = threading.Lock()
+
+    def query(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            seconds, text, status_code = self.script[min(self.calls, len(self.script) - 1)]
+            self.calls += 1
+        time.sleep(seconds)
+        if status_code:
+            return self._error(text, status_code)
+        return {"response": text, "tokens": 1, "time": seconds, "model": "scripted"}
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ev, "jittered_backoff", lambda attempt: 0.0)
+
+
+def test_policy_retries_transient_errors_and_meters_each_attempt(no_backoff):
+    system = ScriptedSystem([(0, "HTTP 503", 503), (0, "HTTP 500", 500), (0, "answer", None)])
+    response = ev.ResiliencePolicy(retries=2).execute(system, "prompt")
+
+    assert response["response"] == "answer"
+    assert [a["kind"] for a in response["attempts"]] == ["primary", "retry", "retry"]
+    assert [a["status"] for a in response["attempts"]] == ["error", "error", "ok"]
+    assert system.rate_limiter.acquired == 3
+
+
+def test_policy_does_not_retry_client_errors_or_429s(no_backoff):
+    for status_code in (400, 429):
+        system = ScriptedSystem([(0, "nope", status_code), (0, "answer", None)])
+        response = ev.ResiliencePolicy(retries=3).execute(system, "prompt")
+        assert response["status_code"] == status_code
+        assert "attempts" not in response
+        assert system.calls == system.rate_limiter.acquired == 1
+
+
+def test_policy_hedges_slow_requests_and_meters_the_hedge():
+    system = ScriptedSystem([(0.5, "slow", None), (0.01, "fast", None)])
+    for _ in range(ev.ADAPTIVE_MIN_SAMPLES):
+        system.latency.record(0.02)
+
+    response = ev.ResiliencePolicy(retries=0, hedge=True).execute(system, "prompt")
+
+    assert response["response"] == "fast"
+    assert {a["kind"]: a["won"] for a in response["attempts"]} == {"primary": False, "hedge": True}
+    # Time is reported from the first send, so it includes the hedge delay
+    assert 0.03 <= response["time"] < 0.5
+    assert system.rate_limiter.acquired == 2
+
+
+def test_policy_does_not_hedge_without_latency_history():
+    system = ScriptedSystem([(0.05, "answer", None)])
+    response = ev.ResiliencePolicy(retries=0, hedge=True).execute(system, "prompt")
+
+    assert response["response"] == "answer"
+    assert system.calls == system.rate_limiter.acquired == 1
+
+
+# ============================================================================
+# TOKEN ACCOUNTING
+# ============================================================================
+
+def test_token_counter_memoizes_counts():
+    counter = ev.TokenCounter(tokenizer_dir="/nonexistent")
+    first = counter.count("def add(a, b):\n    return a + b", "mistral")
+    again = counter.count("def add(a, b):\n    return a + b", "mistral")
+
+    assert first == again and first[1] == "mistral:approx"
+    assert (counter.hits, counter.misses) == (1, 1)
+    counter.count("def add(a, b):\n    return a + b", "openai")  # Memo is per tokenizer
+    assert counter.misses == 2
+
+
+def test_token_counter_persists_counts(tmp_path, monkeypatch):
+    monkeypatch.setattr(ev, "TOKEN_DB_COMMIT_EVERY", 2)
+    db_path = str(tmp_path / "tokens.sqlite")
+    counter = ev.TokenCounter(tokenizer_dir="/nonexistent", db_path=db_path)
+    counts = [counter.count(f"text number {i}") for i in range(3)]
+    assert counter._uncommitted == 1  # The first two were committed as a batch
+    counter.close()
+
+    reopened = ev.TokenCounter(tokenizer_dir="/nonexistent", db_path=db_path)
+    assert [reopened.count(f"text number {i}") for i in range(3)] == counts
+    assert (reopened.hits, reopened.misses) == (3, 0)
+    reopened.close()
+
+
+def test_token_counter_fill_keeps_provider_totals():
+    counter = ev.TokenCounter(tokenizer_dir="/nonexistent")
+    counted = counter.fill({"response": "four words of output", "tokens": 0, "time": 2.0}, "a prompt", "local")
+    provided = counter.fill({"response": "text", "tokens": 90, "output_tokens": 30, "time": 2.0}, "a prompt")
+
+    assert counted["token_source"] == "default:approx"
+    assert counted["tokens"] == counted["input_tokens"] + counted["output_tokens"]
+    assert counted["tokens_per_sec"] == pytest.approx(counted["output_tokens"] / 2.0)
+    assert provided["token_source"] == "provider"
+    assert (provided["tokens"], provided["output_tokens"]) == (90, 30)
+
+
+# ============================================================================
+# SIMILARITY ANALYSIS
+# ============================================================================
+
+def run_result(test_id: str, **responses) -> Dict[str, Any]:
+    return {"test_id": test_id,
+            "responses": {system: {"response": text, "tokens": 10, "time": 1.0} for system, text in responses.items()}}
+
+
+def test_similarity_agreement_between_systems():
+    pytest.importorskip("numpy")
+    answer = "def is_even(n):\n    return n % 2 == 0"
+    analysis = ev.SimilarityAnalyzer().analyze([
+        run_result("T1", Local=answer, Claude=answer, GPT="print('hello world')"),
+        run_result("T2", Local="only one answer", Claude="ERROR: HTTP 500"),
+    ])
+    responses = analysis["responses"]
+
+    assert responses[("T1", "Local")]["peers"]["Claude"] == pytest.approx(1.0)
+    assert responses[("T1", "Local")]["peers"]["GPT"] < 0.2
+    assert responses[("T1", "GPT")]["agreement"] < responses[("T1", "Local")]["agreement"]
+    assert responses[("T2", "Local")]["agreement"] is None  # Errors are not compared
+    assert ("T2", "Claude") not in responses
+    assert analysis["matrices"]["T1"]["Claude"]["Claude"] == 1.0
+
+
+def test_similarity_finds_near_duplicates_across_tests():
+    pytest.importorskip("numpy")
+    text = " ".join(f"word{i}" for i in range(200))
+    analysis = ev.SimilarityAnalyzer().analyze([
+        run_result("T1", Local=text),
+        run_result("T2", Claude=text + " extra"),
+        run_result("T3", GPT="something completely different from the rest"),
+    ])
+
+    assert analysis["near_duplicates"] == [["T1/Local", "T2/Claude"]]
+    assert analysis["responses"][("T1", "Local")]["near_duplicates"] == ["T2/Claude"]
+    assert analysis["responses"][("T3", "GPT")]["near_duplicates"] == []
+
+
+# ============================================================================
+# SUMMARY TABLES
+# ============================================================================
+
+def test_result_table_percentiles_match_percentile():
+    pytest.importorskip("numpy")
+    times = [0.5, 3.0, 1.0, 2.0, 8.0, 1.5, 4.0]
+    table = ev.ResultTable([make_record(f"T{i}", "Local", time=t) for i, t in enumerate(times)])
+
+    [row] = table.aggregate(ev.SUMMARY_GROUPINGS["system"])
+    assert row["rows"] == len(times)
+    for pct in (50, 95, 99):
+        assert row[f"latency_p{pct}"] == pytest.approx(ev.percentile(times, pct))
+
+
+def test_result_table_latest_record_wins():
+    pytest.importorskip("numpy")
+    table = ev.ResultTable([
+        make_record("S1", "Local", text="ERROR: HTTP 500", time=9.0),
+        make_record("S1", "Claude", time=1.0),
+        make_record("S1", "Local", time=2.0),
+        make_record("S2", "Local", time=4.0),
+    ])
+
+    rows = {row["system"]: row for row in table.aggregate(ev.SUMMARY_GROUPINGS["system"])}
+    assert len(table) == 3
+    assert rows["Local"]["rows"] == 2
+    assert rows["Local"]["error_rate"] == 0.0
+    assert rows["Local"]["latency_p50"] == pytest.approx(3.0)
+    assert rows["Claude"]["rows"] == 1
+
+
+def test_result_table_skips_untimed_latency():
+    pytest.importorskip("numpy")
+    table = ev.ResultTable([
+        make_record("S1", "Local", time=1.0),
+        make_record("S2", "Local", time=0.0, cached=True),
+        make_record("S3", "Local", time=0.0, batch={"id": "batch-1"}),
+    ])
+
+    [row] = table.aggregate(ev.SUMMARY_GROUPINGS["system"])
+    assert row["rows"] == 3
+    assert row["latency_p50"] == pytest.approx(1.0)
+
+def test_result_table_ignores_total_tokens_without_output_count():
+    pytest.importorskip("numpy")
+    table = ev.ResultTable([
+        make_record("S1", "Local", time=2.0, tokens=500),
+        make_record("S2", "Claude", time=2.0, tokens=500, output_tokens=40),
+    ])
+
+    rows = {row["system"]: row for row in table.aggregate(ev.SUMMARY_GROUPINGS["system"])}
+    assert rows["Local"]["output_tokens"] is None
+    assert rows["Local"]["tokens_per_sec"] is None
+    assert rows["Claude"]["output_tokens"] == 40
+    assert rows["Claude"]["tokens_per_sec"] == pytest.approx(20.0)
+
+
+def test_markdown_table_has_no_blank_lines():
+    pytest.importorskip("numpy")
+    table = ev.ResultTable([make_record("S1", "Local"), make_record("S2", "Claude")])
+    by = ev.SUMMARY_GROUPINGS["system"]
+    lines = ev.ResultTable.markdown_table(table.aggregate(by), by)
+
+    assert len(lines) == 4
+    assert all(line.startswith("|") and line.endswith("|") for line in lines)
+
+
+# ============================================================================
+# SESSION REPLAY
+# ============================================================================
+
+def test_session_script_length_follows_turns():
+    test = {"id": "T1", "prompt": "Write a parser", "category": "Code Generation"}
+    assert ev.session_script(test, 1) == ["Write a parser"]
+    assert len(ev.session_script(test, ev.SESSION_MAX_TURNS)) == ev.SESSION_MAX_TURNS
+    assert ev.session_script(dict(test, follow_ups=["Why?"]), 5) == ["Write a parser", "Why?"]
+
+
+@pytest.mark.parametrize("turns", [0, ev.SESSION_MAX_TURNS + 1])
+def test_session_replay_rejects_turns_out_of_range(turns):
+    with pytest.raises(ValueError, match="turns must be between 1 and"):
+        ev.SessionReplay(ev.LocalInstanceInterface(), sessions=2, turns=turns)
+
+
+def test_session_replay_rejects_scripts_shorter_than_turns():
+    tests = [{"id": "T1", "prompt": "Hi", "category": "Other", "follow_ups": ["And?"]}]
+    with pytest.raises(ValueError, match="between 1 and 2"):
+        ev.SessionReplay(ev.LocalInstanceInterface(), sessions=1, turns=3, tests=tests)
+
+
+@pytest.mark.parametrize("turns", ["0", str(ev.SESSION_MAX_TURNS + 1)])
+def test_cli_rejects_turns_out_of_range(monkeypatch, capsys, turns):
+    monkeypatch.setattr("sys.argv", ["evaluation_test.py", "--session-replay", "--turns", turns])
+    with pytest.raises(SystemExit) as exit_info:
+        ev.main()
+    assert exit_info.value.code == 2
+    assert "--turns must be between 1 and" in capsys.readouterr().err
+
+
+def test_session_replay_reports_every_turn(mock_server):
+    mock_server()
+    replay = ev.SessionReplay(ev.LocalInstanceInterface(), sessions=2, turns=3, concurrency=2)
+    results = replay.run()
+
+    for mode in ev.SessionReplay.MODES:
+        assert [row["turn"] for row in results[mode]] == [1, 2, 3]
+        assert all(row["requests"] == 2 and row["errors"] == 0 for row in results[mode])
+    # Later stateless turns resend the transcript, so context grows
+    assert results["stateless"][2]["context_tokens_p50"] > results["stateless"][1]["context_tokens_p50"]
+
+
+# ============================================================================
+# BATCH SUBMISSION
+# ============================================================================
+
+def batch_tests(count: int = 4) -> List[Dict[str, Any]]:
+    return [dict(test, id=f"{test['id']}-{i}") for i, test in enumerate(list(ev.iter_builtin_tests())[:count])]
+
+
+def batch_runner(tmp_path, **options):
+    journal = ev.ResultJournal(str(tmp_path / "journal.jsonl"))
+    runner = ev.EvaluationRunner(systems=["local"], journal=journal, verbose=False)
+    options.setdefault("poll_interval", 0.01)
+    return runner, ev.BatchRunner(runner, **options)
+
+
+def journal_responses(runner) -> Dict[str, Dict[str, Any]]:
+    """Latest response per test ID"""
+    return {record["test_id"]: record["response"] for record in runner.journal.iter_records()}
+
+
+def test_batch_maps_results_back_to_their_tests(tmp_path, mock_server):
+    tests = batch_tests(5)
+    server = mock_server(responses={test["prompt"]: f"answer to {test['id']}" for test in tests})
+    runner, batch = batch_runner(tmp_path, batch_size=2)
+    batch.run(tests)
+
+    responses = journal_responses(runner)
+    assert {test_id: r["response"] for test_id, r in responses.items()} == \
+        {test["id"]: f"answer to {test['id']}" for test in tests}
+    assert [job["requests"] for job in batch.batches] == [2, 2, 1]
+    assert all(r["batch"]["id"] and r["batch"]["custom_id"].startswith("req-") for r in responses.values())
+    assert all(r["output_tokens"] > 0 for r in responses.values())  # Filled in by the token counter
+    assert server.stats["requests"] == 5
+
+
+def test_batch_records_failed_requests_as_errors(tmp_path, mock_server):
+    mock_server(error_rate=1.0)
+    runner, batch = batch_runner(tmp_path)
+    batch.run(batch_tests(3))
+
+    assert all(ev.response_status(r) == "error" for r in journal_responses(runner).values())
+    assert runner.journal.completed_pairs() == set()
+
+
+def test_batch_timeout_cancels_and_resume_recovers_finished_requests(tmp_path, mock_server):
+    tests = batch_tests(4)
+    server = mock_server(latency="fixed:0.2", batch_concurrency=1)
+    runner, batch = batch_runner(tmp_path, timeout=0.3)
+    batch.run(tests)
+
+    [job] = batch.batches
+    assert all(r["batch"]["timed_out"] for r in journal_responses(runner).values())
+    deadline = time.time() + 5
+    while server.batch(job["id"])["status"] != "cancelled" and time.time() < deadline:
+        time.sleep(0.05)
+    finished = [r["custom_id"] for r in server.batch(job["id"])["results"] if not r.get("error")]
+    assert 0 < len(finished) < len(tests)
+    runner.journal.close()
+
+    resumed, batch = batch_runner(tmp_path)
+    batch.run(tests)
+
+    responses = journal_responses(resumed)
+    recovered = {test_id for test_id, r in responses.items() if r["batch"].get("recovered")}
+    assert len(recovered) == len(finished)
+    assert all(ev.response_status(r) == "ok" for r in responses.values())
+    assert [job["requests"] for job in batch.batches] == [len(tests) - len(finished)]